@@ -0,0 +1,145 @@
+"""Fixtures for the `pistis` benchmarks. The benchmarks are run on synthetic
+data, whose size can be set on the command line, e.g
+
+    pytest benchmarks --bench-reads 20000 --bench-read-length 8000
+
+Each benchmark records its throughput (reads and bases per second) and the
+peak resident memory of a single run in the benchmark's `extra_info`, which is
+saved with `--benchmark-autosave` and can be compared between runs with
+`pytest-benchmark compare`.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import os
+import sys
+import pysam
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+import synthetic  # noqa: E402
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('pistis benchmarks')
+    group.addoption('--bench-reads', type=int, default=2000,
+                    help="The number of reads in the synthetic fastq and BAM "
+                         "files.")
+    group.addoption('--bench-read-length', type=int, default=5000,
+                    help="The mean read length of the synthetic reads.")
+
+
+class Dataset(object):
+    """A synthetic file and the size of the data in it."""
+
+    def __init__(self, path, reads, bases):
+        self.path = path
+        self.reads = reads
+        self.bases = bases
+
+
+@pytest.fixture(scope='session')
+def bench_size(request):
+    return (request.config.getoption('--bench-reads'),
+            request.config.getoption('--bench-read-length'))
+
+
+def _fastq_dataset(tmpdir_factory, bench_size, compress):
+    num_reads, mean_length = bench_size
+    path = str(tmpdir_factory.mktemp('fastq').join(
+        'reads.fastq' + ('.gz' if compress else '')))
+    bases = synthetic.write_fastq(path, num_reads, mean_length,
+                                  compress=compress)
+
+    return Dataset(path, num_reads, bases)
+
+
+def _bam_dataset(tmpdir_factory, bench_size, nm_tag):
+    num_reads, mean_length = bench_size
+    path = str(tmpdir_factory.mktemp('bam').join('reads.bam'))
+    synthetic.write_bam(path, num_reads, mean_length,
+                        reference_length=max(1000000, 20 * mean_length),
+                        nm_tag=nm_tag)
+    with pysam.AlignmentFile(path, 'rb') as bam:
+        bases = sum(record.query_length for record in bam)
+
+    return Dataset(path, num_reads, bases)
+
+
+@pytest.fixture(scope='session', params=['plain', 'gzip'])
+def fastq_data(request, bench_size, tmpdir_factory):
+    """A synthetic fastq file, uncompressed and gzipped."""
+    return _fastq_dataset(tmpdir_factory, bench_size,
+                          compress=request.param == 'gzip')
+
+
+@pytest.fixture(scope='session')
+def plain_fastq_data(bench_size, tmpdir_factory):
+    """An uncompressed synthetic fastq file."""
+    return _fastq_dataset(tmpdir_factory, bench_size, compress=False)
+
+
+@pytest.fixture(scope='session', params=['nm', 'md'])
+def bam_data(request, bench_size, tmpdir_factory):
+    """A synthetic BAM file, with the NM tag and without it (so the identity is
+    calculated from the MD tag and CIGAR)."""
+    return _bam_dataset(tmpdir_factory, bench_size,
+                        nm_tag=request.param == 'nm')
+
+
+@pytest.fixture(scope='session')
+def nm_bam_data(bench_size, tmpdir_factory):
+    """A synthetic BAM file with the NM tag."""
+    return _bam_dataset(tmpdir_factory, bench_size, nm_tag=True)
+
+
+def peak_rss(function, *args):
+    """Runs function once in a forked child process and returns the peak
+    resident memory of the child, in MB. The child starts as a copy of this
+    process, so this includes the memory already in use here."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            function(*args)
+        finally:
+            os._exit(0)
+    usage = os.wait4(pid, 0)[2]
+    # ru_maxrss is in KB on Linux but bytes on macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+
+    return usage.ru_maxrss / scale
+
+
+def _do_nothing():
+    pass
+
+
+@pytest.fixture
+def measure(benchmark):
+    """Benchmarks a function and records the throughput over the given data
+    and the peak memory of a run.
+
+    Returns:
+        A function taking the `Dataset` the function processes, the function
+        and its arguments. Keyword arguments are passed to
+        `benchmark.pedantic`. Returns the result of the function.
+    """
+    def run(data, function, *args, **pedantic):
+        if pedantic:
+            result = benchmark.pedantic(function, args, **pedantic)
+        else:
+            result = benchmark(function, *args)
+        if benchmark.stats is None:  # --benchmark-disable
+            return result
+        mean = benchmark.stats.stats.mean
+        if data is not None:
+            benchmark.extra_info['reads'] = data.reads
+            benchmark.extra_info['bases'] = data.bases
+            benchmark.extra_info['reads_per_second'] = data.reads / mean
+            benchmark.extra_info['bases_per_second'] = data.bases / mean
+        if hasattr(os, 'fork'):
+            benchmark.extra_info['peak_rss_mb'] = peak_rss(function, *args)
+            # the memory of the child before it runs anything
+            benchmark.extra_info['baseline_rss_mb'] = peak_rss(_do_nothing)
+        return result
+
+    return run
@@ -0,0 +1,163 @@
+"""Generators of synthetic long read data for the benchmarks. The number of
+reads, their length distribution, quality profile and alignment error rate are
+all controlled, and the output is the same for the same seed.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import gzip
+import numpy as np
+import pysam
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def read_lengths(rng, num_reads, mean_length=5000, sigma=0.8,
+                 min_length=100, max_length=200000):
+    """Draw read lengths from a log-normal distribution, as for nanopore or
+    PacBio CLR reads, with the given mean."""
+    mu = np.log(mean_length) - sigma ** 2 / 2
+    lengths = rng.lognormal(mu, sigma, num_reads).astype(int)
+    return np.clip(lengths, min_length, max_length)
+
+
+def quality_string(rng, length, mean_quality=12.0, read_sd=2.0, base_sd=4.0,
+                   end_drop=3.0):
+    """A quality string whose scores vary about a per-read mean, with the
+    scores dropping by end_drop towards the end of the read."""
+    read_mean = rng.normal(mean_quality, read_sd)
+    scores = (read_mean - end_drop * np.linspace(0, 1, length) +
+              rng.normal(0, base_sd, length))
+    scores = np.clip(np.round(scores), 0, 60).astype(np.uint8)
+    return (scores + 33).tobytes()
+
+
+def write_fastq(path, num_reads=1000, mean_length=5000, mean_quality=12.0,
+                compress=False, seed=0):
+    """Writes a fastq file of random reads.
+
+    Args:
+        path: The file to write.
+        num_reads: The number of reads.
+        mean_length: The mean read length.
+        mean_quality: The mean Phred quality score.
+        compress: gzip the file.
+        seed: Seed for the random number generator.
+
+    Returns:
+        The total number of bases written.
+    """
+    rng = np.random.RandomState(seed)
+    opener = gzip.open if compress else open
+    total = 0
+    with opener(path, 'wb') as fastq:
+        for i, length in enumerate(read_lengths(rng, num_reads, mean_length)):
+            sequence = BASES[rng.randint(0, 4, length)].tobytes()
+            fastq.write(b'@read' + str(i).encode() + b'\n' + sequence +
+                        b'\n+\n' + quality_string(rng, length, mean_quality) +
+                        b'\n')
+            total += int(length)
+
+    return total
+
+
+def _align(rng, reference, start, length, error_rate):
+    """Simulate a read aligned to reference at start, with mismatches,
+    insertions and deletions (in equal proportions) at error_rate. Returns
+    the query sequence, CIGAR tuples, NM and MD tag values."""
+    query = []
+    query_length = 0
+    cigar = []
+    md = []
+    matches = 0  # bases since the last MD mismatch/deletion
+    edits = 0
+    ref_pos = start
+    while query_length < length:
+        gap = min(rng.geometric(error_rate) - 1, length - query_length)
+        if gap:
+            query.append(reference[ref_pos:ref_pos + gap])
+            _extend_cigar(cigar, 0, gap)
+            query_length += gap
+            matches += gap
+            ref_pos += gap
+        if query_length >= length:
+            break
+        event = rng.randint(3)
+        if event == 0:  # mismatch
+            ref_base = reference[ref_pos:ref_pos + 1]
+            query.append(b'C' if ref_base == b'A' else b'A')
+            _extend_cigar(cigar, 0, 1)
+            query_length += 1
+            md.extend([str(matches), ref_base.decode()])
+            matches = 0
+            ref_pos += 1
+        elif event == 1:  # insertion
+            query.append(BASES[rng.randint(0, 4, 1)].tobytes())
+            _extend_cigar(cigar, 1, 1)
+            query_length += 1
+        else:  # deletion
+            _extend_cigar(cigar, 2, 1)
+            md.extend([str(matches), '^' + reference[ref_pos:ref_pos + 1]
+                       .decode()])
+            matches = 0
+            ref_pos += 1
+        edits += 1
+    # an alignment can't end with an insertion or deletion
+    if cigar[-1][0] != 0:
+        query.append(reference[ref_pos:ref_pos + 1])
+        _extend_cigar(cigar, 0, 1)
+        matches += 1
+    md.append(str(matches))
+
+    return b''.join(query), cigar, edits, ''.join(md)
+
+
+def _extend_cigar(cigar, operation, length):
+    if cigar and cigar[-1][0] == operation:
+        cigar[-1] = (operation, cigar[-1][1] + length)
+    else:
+        cigar.append((operation, length))
+
+
+def write_bam(path, num_reads=1000, mean_length=5000, error_rate=0.08,
+              reference_length=1000000, nm_tag=True, seed=0):
+    """Writes a sorted, indexed BAM file of reads aligned to a random
+    reference.
+
+    Args:
+        path: The file to write.
+        num_reads: The number of alignments.
+        mean_length: The mean read length.
+        error_rate: The rate of mismatches, insertions and deletions.
+        reference_length: The length of the (single contig) reference.
+        nm_tag: Add the NM tag to each alignment. Otherwise only MD is added,
+        so the identity has to be calculated from MD and CIGAR.
+        seed: Seed for the random number generator.
+    """
+    rng = np.random.RandomState(seed)
+    reference = BASES[rng.randint(0, 4, reference_length)].tobytes()
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'chr1', 'LN': reference_length}]}
+    lengths = read_lengths(rng, num_reads, mean_length,
+                           max_length=reference_length // 4)
+    # leave room for deletions at the end of the reference
+    starts = np.sort(rng.randint(0, reference_length - 2 * lengths.max(),
+                                 num_reads))
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        for i, (start, length) in enumerate(zip(starts, lengths)):
+            query, cigar, edits, md = _align(rng, reference, start, length,
+                                             error_rate)
+            segment = pysam.AlignedSegment()
+            segment.query_name = 'read{}'.format(i)
+            segment.reference_id = 0
+            segment.reference_start = int(start)
+            segment.mapping_quality = 60
+            segment.cigartuples = cigar
+            segment.query_sequence = query
+            segment.query_qualities = pysam.qualitystring_to_array(
+                quality_string(rng, len(segment.query_sequence)).decode())
+            tags = [('MD', md)]
+            if nm_tag:
+                tags.append(('NM', edits))
+            segment.set_tags(tags)
+            bam.write(segment)
+    pysam.index(path)
@@ -0,0 +1,39 @@
+"""Benchmarks of the `pistis` command line interface, end to end."""
+from __future__ import absolute_import
+import sys
+import subprocess
+import pytest
+from click.testing import CliRunner
+from pistis import pistis
+
+ROUNDS = 3
+
+
+def _run_main(args):
+    result = CliRunner().invoke(pistis.main, args)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_report(measure, plain_fastq_data, nm_bam_data, tmpdir, threads):
+    args = ['--fastq', plain_fastq_data.path, '--bam', nm_bam_data.path,
+            '--output', str(tmpdir.join('report.pdf')),
+            '--threads', str(threads), '--no-cache']
+    measure(plain_fastq_data, _run_main, args, rounds=ROUNDS)
+
+
+def test_metrics_only(measure, plain_fastq_data, nm_bam_data):
+    args = ['--fastq', plain_fastq_data.path, '--bam', nm_bam_data.path,
+            '--metrics-only', '--no-cache']
+    measure(plain_fastq_data, _run_main, args, rounds=ROUNDS)
+
+
+@pytest.mark.parametrize('command', [
+    'import pistis.pistis',
+    'from pistis import pistis; pistis.main(["--help"])'])
+def test_startup(measure, command):
+    """The time to start a new interpreter and run command, which includes
+    the time to import `pistis`."""
+    args = [sys.executable, '-c', command]
+    measure(None, subprocess.call, args, rounds=ROUNDS)
@@ -0,0 +1,83 @@
+"""Benchmarks of collecting the data for the plots from fastq and BAM files."""
+from __future__ import absolute_import
+import pysam
+import pytest
+from pistis import utils, parallel, pipeline
+
+
+def _collect_with_pysam(filename):
+    with pysam.FastxFile(filename) as fastq:
+        return utils.collect_fastq_data(fastq)
+
+
+def _read_sequences(filename):
+    with pysam.FastxFile(filename) as fastq:
+        return [record.sequence for record in fastq]
+
+
+def _read_alignments(filename):
+    with pysam.AlignmentFile(filename, 'rb') as bam:
+        return list(bam)
+
+
+def test_collect_fastq_data(measure, fastq_data):
+    result = measure(fastq_data, _collect_with_pysam, fastq_data.path)
+    assert len(result[1]) == fastq_data.reads
+
+
+def test_summarise_fastq_file(measure, fastq_data):
+    summary = measure(fastq_data, pipeline.summarise_fastq_file,
+                      fastq_data.path)
+    assert summary.reads.seen == fastq_data.reads
+
+
+def test_summarise_fastq_file_profiles(measure, fastq_data):
+    summary = measure(fastq_data, pipeline.summarise_fastq_file,
+                      fastq_data.path, 0, 1, True)
+    assert summary.profile_from_start.counts.sum() == fastq_data.bases
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_scan_fastq(measure, fastq_data, threads):
+    summary = measure(fastq_data, parallel.scan_fastq, fastq_data.path, 0,
+                      threads)
+    assert summary.reads.seen == fastq_data.reads
+
+
+def test_gc_content(measure, fastq_data):
+    sequences = _read_sequences(fastq_data.path)
+
+    def gc_of_each_read():
+        return [utils.gc_content(sequence) for sequence in sequences]
+
+    assert len(measure(fastq_data, gc_of_each_read)) == fastq_data.reads
+
+
+def test_gc_content_batch(measure, fastq_data):
+    sequences = _read_sequences(fastq_data.path)
+    packed, _, offsets = utils.pack_reads(sequences, sequences)
+    result = measure(fastq_data, utils.gc_content_batch, packed, offsets)
+    assert len(result) == fastq_data.reads
+
+
+@pytest.mark.parametrize('definition', utils.IDENTITY_DEFINITIONS)
+def test_get_percent_identity(measure, bam_data, definition):
+    records = _read_alignments(bam_data.path)
+
+    def identity_of_each_read():
+        return [utils.get_percent_identity(record, definition)
+                for record in records]
+
+    assert len(measure(bam_data, identity_of_each_read)) == bam_data.reads
+
+
+def test_sam_percent_identity(measure, bam_data):
+    result = measure(bam_data, utils.sam_percent_identity, bam_data.path)
+    assert len(result) == bam_data.reads
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_scan_alignments(measure, bam_data, threads):
+    summary = measure(bam_data, parallel.scan_alignments, bam_data.path, 0,
+                      threads)
+    assert summary.identity_sketch.count == bam_data.reads
@@ -0,0 +1,70 @@
+"""Benchmarks of making the plots of the report from the collected data."""
+from __future__ import absolute_import
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt  # noqa: E402
+import seaborn as sns  # noqa: E402
+import pytest  # noqa: E402
+from conftest import Dataset  # noqa: E402
+from pistis import plots, pipeline, parallel  # noqa: E402
+from pistis.pistis import SEABORN_STYLE  # noqa: E402
+
+ROUNDS = 3
+
+
+@pytest.fixture(scope='module')
+def summaries(plain_fastq_data, nm_bam_data):
+    """The summaries of the synthetic fastq and BAM files, and a `Dataset` of
+    the reads in them."""
+    sns.set(style=SEABORN_STYLE)
+    return (pipeline.summarise_fastq_file(plain_fastq_data.path),
+            parallel.scan_alignments(nm_bam_data.path),
+            Dataset(None, plain_fastq_data.reads, plain_fastq_data.bases))
+
+
+def _plot(function, *args):
+    """Make a plot, drawing it as it would be drawn to the PDF."""
+    fig = function(*args)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def test_gc_plot(measure, summaries):
+    fastq_summary, _, data = summaries
+    measure(data, _plot, plots.gc_plot, fastq_summary.gc_histogram,
+            rounds=ROUNDS)
+
+
+@pytest.mark.parametrize('kind', ['kde', 'hex', 'scatter'])
+def test_length_vs_qual_grid_plot(measure, summaries, kind):
+    fastq_summary, _, data = summaries
+    measure(data, _plot, plots.length_vs_qual_grid_plot,
+            fastq_summary.length_quality, kind, True,
+            fastq_summary.reads.items, rounds=ROUNDS)
+
+
+@pytest.mark.parametrize('from_end', ['start', 'end'])
+def test_quality_per_position(measure, summaries, from_end):
+    fastq_summary, _, data = summaries
+    positions = (fastq_summary.bins_from_start if from_end == 'start' else
+                 fastq_summary.bins_from_end)
+    measure(data, _plot, plots.quality_per_position, positions, from_end,
+            rounds=ROUNDS)
+
+
+def test_percent_identity(measure, summaries):
+    _, alignment_summary, data = summaries
+    measure(data, _plot, plots.percent_identity,
+            alignment_summary.identity_histogram, rounds=ROUNDS)
+
+
+def test_save_plot_jobs_to_pdf(measure, summaries, tmpdir):
+    fastq_summary, alignment_summary, data = summaries
+    jobs = [(plots.gc_plot, (fastq_summary.gc_histogram,)),
+            (plots.length_vs_qual_grid_plot, (fastq_summary.length_quality,)),
+            (plots.quality_per_position,
+             (fastq_summary.bins_from_start, 'start')),
+            (plots.quality_per_position, (fastq_summary.bins_from_end, 'end')),
+            (plots.percent_identity, (alignment_summary.identity_histogram,))]
+    measure(data, plots.save_plot_jobs_to_pdf, jobs,
+            str(tmpdir.join('report.pdf')), rounds=ROUNDS)
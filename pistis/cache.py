@@ -0,0 +1,209 @@
+"""This module contains an on-disk cache of the summaries collected from fastq
+and SAM/BAM files, so re-running `pistis` on the same files (e.g to change
+the plots, or when a later step of a pipeline changes) goes straight to
+plotting instead of reading every read again.
+
+Each summary is saved with `stats.save_stats` under a key made from:
+    - The identity of the input files: their path, size and modification
+    time, or, with `content_hash`, their size and a hash of their contents so
+    copied or touched files still match.
+    - The parameters the summary was collected with, e.g --downsample.
+    - The versions of pistis and of the summary format.
+
+The cache is bounded in size: when it grows past `max_size` bytes, the least
+recently used summaries are removed. Using a summary updates its modification
+time, which is how the least recently used ones are found.
+"""
+from __future__ import absolute_import
+import os
+import json
+import hashlib
+import zipfile
+import tempfile
+import pistis
+from pistis import stats
+
+CACHE_DIR_ENV = 'PISTIS_CACHE_DIR'
+DEFAULT_MAX_SIZE = 1024 ** 3
+CACHE_EXTENSION = '.npz'
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+def default_cache_dir():
+    """The directory to cache summaries in: $PISTIS_CACHE_DIR if it is set,
+    otherwise pistis in $XDG_CACHE_HOME (~/.cache by default).
+
+    Returns:
+        The path of the cache directory.
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.path.join(base, 'pistis')
+
+
+default_cache_dir.__annotations__ = {'return': str}
+
+
+class SummaryCache(object):
+    """A size-bounded, least recently used, on-disk cache of the summaries
+    collected from sequencing files.
+
+    Args:
+        directory: The directory to keep the summaries in. It is created when
+        the first summary is saved. Defaults to `default_cache_dir()`.
+        max_size: The most bytes of summaries to keep.
+        content_hash: Identify the input files by a hash of their contents
+        instead of by their path and modification time. Hashing reads every
+        byte of the files, but is much quicker than parsing them.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE,
+                 content_hash=False):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        self.content_hash = content_hash
+
+    def key(self, kind, filenames, **parameters):
+        """Makes the key of the summary of some files.
+
+        Args:
+            kind: The kind of summary, 'fastq' or 'bam'.
+            filenames: The files summarised.
+            **parameters: The parameters the summary is collected with.
+
+        Returns:
+            The key, as a hex digest.
+        """
+        description = {'pistis': pistis.__version__,
+                       'format_version': stats.STATS_FORMAT_VERSION,
+                       'kind': kind,
+                       'files': [self._identify(filename)
+                                 for filename in filenames],
+                       'parameters': parameters}
+        encoded = json.dumps(description, sort_keys=True).encode('utf-8')
+
+        return hashlib.sha256(encoded).hexdigest()
+
+    def load(self, kind, key):
+        """Loads a summary from the cache, and marks it as recently used.
+
+        Args:
+            kind: The kind of summary, 'fastq' or 'bam'.
+            key: The key made by `key`.
+
+        Returns:
+            The `utils.FastqSummary` or `utils.AlignmentSummary`, or None if
+            it isn't in the cache (or can't be read).
+        """
+        path = self._path(key)
+        try:
+            fastq_summary, alignment_summary = stats.load_stats(path)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, KeyError,
+                zipfile.BadZipfile):
+            # missing, or written by another version or partly deleted
+            return None
+
+        return fastq_summary if kind == 'fastq' else alignment_summary
+
+    def save(self, kind, key, summary):
+        """Saves a summary to the cache, then removes the least recently used
+        summaries until the cache is no bigger than `max_size`.
+
+        Args:
+            kind: The kind of summary, 'fastq' or 'bam'.
+            key: The key made by `key`.
+            summary: The `utils.FastqSummary` or `utils.AlignmentSummary`.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # write to a temporary file first, so a summary is never read while
+        # it is half written
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        os.close(handle)
+        try:
+            if kind == 'fastq':
+                stats.save_stats(temporary, fastq_summary=summary)
+            else:
+                stats.save_stats(temporary, alignment_summary=summary)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used summaries until the cache is no
+        bigger than `max_size`.
+
+        Returns:
+            The paths of the summaries removed.
+        """
+        entries = []
+        for path in self.entries():
+            try:
+                info = os.stat(path)
+            except OSError:  # removed by another process
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        entries.sort(reverse=True)
+
+        removed = []
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.max_size:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed.append(path)
+
+        return removed
+
+    def entries(self):
+        """Lists the summaries in the cache.
+
+        Returns:
+            A list of the paths of the summaries.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if name.endswith(CACHE_EXTENSION)]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def _identify(self, filename):
+        """The identity of an input file, as part of a key."""
+        info = os.stat(filename)
+        if self.content_hash:
+            return {'size': info.st_size, 'sha1': hash_file(filename)}
+        return {'path': os.path.abspath(filename), 'size': info.st_size,
+                'mtime_ns': info.st_mtime_ns}
+
+
+def hash_file(filename):
+    """Hashes the contents of a file.
+
+    Args:
+        filename: The path to the file.
+
+    Returns:
+        The SHA-1 hex digest of the file.
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+hash_file.__annotations__ = {'filename': str, 'return': str}
@@ -0,0 +1,285 @@
+"""This module contains functions for reading fastq files directly, without
+pysam, so that separate byte ranges of a file can be read independently.
+
+Records are expected to be four lines long, i.e the sequence and quality
+strings are not wrapped, which is the case for all long read basecallers.
+Files that aren't are read with pysam instead, see `parallel.scan_fastq`.
+"""
+from __future__ import absolute_import
+import os
+from typing import BinaryIO, Iterable, Tuple, List
+import numpy as np
+import six
+from six.moves import zip
+
+GZIP_MAGIC = b'\x1f\x8b'
+FASTQ_EXTENSIONS = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+PHRED_OFFSET = 33
+BLOCK_SIZE = 2 ** 23  # bytes parsed at a time, about 4M bases
+# the bytes that parse_records looks for
+NEWLINE, CARRIAGE_RETURN, HEADER, SEPARATOR = bytearray(b'\n\r@+')
+
+
+def is_fastq(filename):
+    """Checks whether a file name has a fastq (or gzipped fastq) extension.
+
+    Args:
+        filename: The file name.
+
+    Returns:
+        True if the file name ends with one of `FASTQ_EXTENSIONS`.
+    """
+    return filename.lower().endswith(FASTQ_EXTENSIONS)
+
+
+is_fastq.__annotations__ = {'filename': str, 'return': bool}
+
+
+def find_fastq_files(directory):
+    """Lists the fastq files in a directory and its subdirectories.
+
+    Args:
+        directory: The directory to search.
+
+    Returns:
+        A sorted list of paths to files with a fastq extension.
+    """
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(dirpath, filename)
+                     for filename in filenames if is_fastq(filename))
+
+    return sorted(paths)
+
+
+find_fastq_files.__annotations__ = {'directory': str, 'return': List[str]}
+
+
+def is_gzipped(filename):
+    """Checks whether a file is gzip (or BGZF) compressed.
+
+    Args:
+        filename: Path to the file.
+
+    Returns:
+        True if the file starts with the gzip magic number.
+    """
+    with open(filename, 'rb') as handle:
+        return handle.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+is_gzipped.__annotations__ = {'filename': str, 'return': bool}
+
+
+def find_record_start(handle, offset):
+    """Moves a file handle to the start of the first fastq record beginning at,
+    or after, a byte offset.
+
+    Notes:
+        A line starting with '@' may be a header or a quality string, but only
+        a header is followed two lines later by a line starting with '+'.
+
+    Args:
+        handle: A fastq file opened in binary mode.
+        offset: The byte offset to start searching from.
+
+    Returns:
+        The byte offset of the start of the record. If there are no more
+        records, this will be the end of the file.
+    """
+    if offset == 0:
+        handle.seek(0)
+        return 0
+    # move to the start of the first line beginning at or after offset
+    handle.seek(offset - 1)
+    handle.readline()
+    while True:
+        position = handle.tell()
+        line = handle.readline()
+        if not line:
+            return position
+        if line.startswith(b'@'):
+            next_line = handle.tell()
+            handle.readline()
+            if handle.readline().startswith(b'+'):
+                handle.seek(position)
+                return position
+            handle.seek(next_line)
+
+
+find_record_start.__annotations__ = {'handle': BinaryIO, 'offset': int,
+                                     'return': int}
+
+
+def read_records(handle, end=None):
+    """Reads fastq records from the current position of a file handle.
+
+    Args:
+        handle: A fastq file opened in binary mode, positioned at the start of
+        a record.
+        end: Stop at the first record starting at, or after, this byte offset.
+        Set to None to read to the end of the file.
+
+    Yields:
+        A (sequence, quality string) tuple of bytes for each record.
+    """
+    while end is None or handle.tell() < end:
+        header = handle.readline()
+        if not header:
+            return
+        sequence = handle.readline().rstrip(b'\r\n')
+        handle.readline()
+        quality = handle.readline().rstrip(b'\r\n')
+        yield sequence, quality
+
+
+read_records.__annotations__ = {'handle': BinaryIO, 'end': int,
+                                'return': Iterable[Tuple[bytes, bytes]]}
+
+
+def read_complete_records(handle):
+    """Reads fastq records from the current position of a file handle that may
+    still be being written to. Reading stops before the first record that has
+    not been completely written, leaving the handle at its start, so reading
+    can be resumed from `handle.tell()` later.
+
+    Args:
+        handle: A fastq file opened in binary mode, positioned at the start of
+        a record.
+
+    Yields:
+        A (sequence, quality string) tuple of bytes for each complete record.
+    """
+    while True:
+        start = handle.tell()
+        lines = [handle.readline() for _ in range(4)]
+        if not lines[-1].endswith(b'\n'):
+            handle.seek(start)
+            return
+        yield lines[1].rstrip(b'\r\n'), lines[3].rstrip(b'\r\n')
+
+
+read_complete_records.__annotations__ = {'handle': BinaryIO,
+                                         'return': Iterable[Tuple[bytes,
+                                                                  bytes]]}
+
+
+def parse_records(data, final=False):
+    """Parses the complete records in a block of fastq data straight into a
+    packed batch of reads, as returned by `utils.pack_reads`.
+
+    The line breaks are found with numpy over the whole block at once, and
+    everything else is done on arrays of the line positions, except for
+    joining the sequences and quality strings into their buffers. These are
+    joined from zero-copy views of the block, so each base is copied once,
+    rather than into a line and then into the buffer.
+
+    Args:
+        data: A block of (uncompressed) fastq data, starting at the start of a
+        record.
+        final: The block is the end of the file, so should end with a complete
+        record, although it may not end with a newline.
+
+    Returns:
+        A tuple of:
+            - A uint8 array of the sequences of the complete records
+            concatenated.
+            - A uint8 array of the Phred quality scores of the complete records
+            concatenated.
+            - An array of read boundaries in the above, such that read i is
+            `sequences[offsets[i]:offsets[i + 1]]`.
+            - The number of bytes of data holding the complete records. The
+            rest should be prepended to the next block.
+
+    Raises:
+        ValueError: If a record doesn't have a header and separator line where
+        expected, its sequence and quality string differ in length, or the
+        final block ends part way through a record.
+    """
+    if final and not data.endswith(b'\n'):
+        data += b'\n'
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(buffer == NEWLINE)
+    num_records = len(line_ends) // 4
+    line_ends = line_ends[:4 * num_records].reshape(-1, 4)
+    line_starts = np.zeros_like(line_ends)
+    line_starts.flat[1:] = line_ends.flat[:-1] + 1
+
+    # an empty line 'starts' with its newline, so fails these checks too
+    malformed = np.flatnonzero((buffer[line_starts[:, 0]] != HEADER) |
+                               (buffer[line_starts[:, 2]] != SEPARATOR))
+    if len(malformed):
+        start = line_starts[malformed[0], 0]
+        raise ValueError("Expected a fastq record, got {!r}".format(
+            data[start:start + 50]))
+
+    # of the sequence and quality lines, without any \r before the \n
+    starts = line_starts[:, 1::2]
+    ends = line_ends[:, 1::2]
+    ends = ends - ((ends > starts) & (buffer[ends - 1] == CARRIAGE_RETURN))
+    lengths = ends - starts
+    unequal = np.flatnonzero(lengths[:, 0] != lengths[:, 1])
+    if len(unequal):
+        header = slice(line_starts[unequal[0], 0], line_ends[unequal[0], 0])
+        raise ValueError("The sequence and quality string of {!r} differ in "
+                         "length.".format(data[header]))
+
+    # Python 2 can't join memoryviews, so slices (copies) are joined instead
+    view = memoryview(data) if six.PY3 else data
+    sequences, qualities = (
+        np.frombuffer(b''.join([view[start:end] for start, end in
+                                zip(starts[:, i].tolist(),
+                                    ends[:, i].tolist())]), dtype=np.uint8)
+        for i in (0, 1))
+    offsets = np.zeros(num_records + 1, dtype=np.int64)
+    np.cumsum(lengths[:, 0], out=offsets[1:])
+    end = int(line_ends[-1, 3]) + 1 if num_records else 0
+    if final and data[end:].strip():
+        raise ValueError("Fastq file ended part way through a record.")
+
+    return sequences, qualities - PHRED_OFFSET, offsets, end
+
+
+parse_records.__annotations__ = {'data': bytes, 'final': bool,
+                                 'return': Tuple[np.ndarray, np.ndarray,
+                                                 np.ndarray, int]}
+
+
+def read_batches(handle, size=None, block_size=BLOCK_SIZE):
+    """Reads fastq records from the current position of a file handle in
+    blocks, parsing each block into a packed batch with `parse_records`.
+
+    Args:
+        handle: A fastq file opened in binary mode, positioned at the start of
+        a record.
+        size: The number of bytes to read, which must end at the end of a
+        record (see `find_record_start`). Set to None to read to the end of
+        the file.
+        block_size: The number of bytes to read and parse at a time.
+
+    Yields:
+        The packed sequences, qualities and offsets of the records in each
+        block.
+    """
+    remainder = b''
+    while size is None or size > 0:
+        block = handle.read(block_size if size is None else
+                            min(block_size, size))
+        if not block:
+            break
+        if size is not None:
+            size -= len(block)
+        data = remainder + block
+        sequences, qualities, offsets, end = parse_records(data)
+        remainder = data[end:]
+        if len(offsets) > 1:
+            yield sequences, qualities, offsets
+    if remainder.strip():
+        yield parse_records(remainder, final=True)[:3]
+
+
+read_batches.__annotations__ = {'handle': BinaryIO, 'size': int,
+                                'block_size': int,
+                                'return': Iterable[Tuple[np.ndarray,
+                                                         np.ndarray,
+                                                         np.ndarray]]}
@@ -0,0 +1,181 @@
+"""This module contains functions for summarising the collected data as numbers
+(e.g to check that a run passes QC in a pipeline) and for writing them to a
+JSON or TSV file.
+"""
+from __future__ import absolute_import
+import sys
+import json
+import math
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from six.moves import zip
+from pistis import utils, sketch
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+TSV_EXTENSIONS = ('.tsv', '.txt')
+
+
+def fastq_metrics(summary):
+    """Summarises the reads of a fastq file.
+
+    Args:
+        summary: A `utils.FastqSummary`.
+
+    Returns:
+        A dictionary of the number of reads and bases, whether the reads were
+        sampled at random offsets (so the numbers are of the sample), the
+        distribution of the read length (including the N50), mean quality
+        score and GC content, and the quality score statistics of each
+        positional bin (and relative bin, if the summary has profiles).
+    """
+    length = sketch.describe(summary.length_sketch, QUANTILES)
+    length['n50'] = sketch.n50(summary.length_sketch)
+
+    metrics = OrderedDict([
+        ('reads', summary.reads.seen),
+        ('bases', int(summary.length_sketch.total)),
+        ('offset_sampled', summary.offset_sampled),
+        ('length', length),
+        ('mean_quality', sketch.describe(summary.quality_sketch, QUANTILES)),
+        ('gc_content', sketch.describe(summary.gc_sketch, QUANTILES)),
+        ('quality_from_start', _positional_metrics(summary.bins_from_start)),
+        ('quality_from_end', _positional_metrics(summary.bins_from_end))])
+    if summary.relative_qualities is not None:
+        metrics['quality_relative'] = _positional_metrics(
+            summary.relative_qualities)
+
+    return metrics
+
+
+fastq_metrics.__annotations__ = {'summary': utils.FastqSummary,
+                                 'return': Dict[str, object]}
+
+
+def alignment_metrics(summary):
+    """Summarises the alignments of a SAM/BAM file.
+
+    Args:
+        summary: A `utils.AlignmentSummary`.
+
+    Returns:
+        A dictionary of the number of primary, mapped reads, the definition
+        of percent identity used, whether the reads were sampled at random
+        offsets and the distribution of their percent identity.
+    """
+    return OrderedDict([
+        ('reads', summary.identity_sketch.count),
+        ('identity_definition', summary.identity),
+        ('offset_sampled', summary.offset_sampled),
+        ('percent_identity', sketch.describe(summary.identity_sketch,
+                                             QUANTILES))])
+
+
+alignment_metrics.__annotations__ = {'summary': utils.AlignmentSummary,
+                                     'return': Dict[str, object]}
+
+
+def collect_metrics(fastq_summary=None, alignment_summary=None):
+    """Summarises the collected data.
+
+    Args:
+        fastq_summary: A `utils.FastqSummary`, if any.
+        alignment_summary: A `utils.AlignmentSummary`, if any.
+
+    Returns:
+        A dictionary with the `fastq_metrics` under 'fastq' and the
+        `alignment_metrics` under 'alignment', for those given.
+    """
+    metrics = OrderedDict()
+    if fastq_summary is not None:
+        metrics['fastq'] = fastq_metrics(fastq_summary)
+    if alignment_summary is not None:
+        metrics['alignment'] = alignment_metrics(alignment_summary)
+
+    return metrics
+
+
+collect_metrics.__annotations__ = {'fastq_summary': utils.FastqSummary,
+                                   'alignment_summary': utils.AlignmentSummary,
+                                   'return': Dict[str, object]}
+
+
+def flatten_metrics(metrics, prefix=''):
+    """Flattens nested metrics into (name, value) pairs, joining the names of
+    the levels with '.', e.g 'fastq.length.n50'.
+
+    Args:
+        metrics: A (nested) dictionary of metrics.
+        prefix: Prepended to the names.
+
+    Returns:
+        A list of (name, value) tuples.
+    """
+    flat = []
+    for key, value in metrics.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            flat.extend(flatten_metrics(value, name + '.'))
+        else:
+            flat.append((name, value))
+
+    return flat
+
+
+flatten_metrics.__annotations__ = {'metrics': Dict[str, object],
+                                   'prefix': str,
+                                   'return': List[Tuple[str, object]]}
+
+
+def write_metrics(metrics, filename):
+    """Writes metrics to a file. The file is TSV, with a name and a value on
+    each line, if the file name ends with one of `TSV_EXTENSIONS`. Otherwise
+    it is JSON.
+
+    Args:
+        metrics: A (nested) dictionary of metrics, e.g from `collect_metrics`.
+        filename: The path to write to. Use '-' to write JSON to stdout.
+    """
+    if filename == '-':
+        _write_json(metrics, sys.stdout)
+        return
+    with open(filename, 'w') as handle:
+        if filename.lower().endswith(TSV_EXTENSIONS):
+            for name, value in flatten_metrics(metrics):
+                handle.write('{}\t{}\n'.format(name, value))
+        else:
+            _write_json(metrics, handle)
+
+
+write_metrics.__annotations__ = {'metrics': Dict[str, object],
+                                 'filename': str,
+                                 'return': None}
+
+
+def _positional_metrics(qualities):
+    """The number of quality scores in, and the statistics of, each bin of a
+    `utils.PositionalQualities`, keyed by the bin name."""
+    metrics = OrderedDict()
+    for name, stats in zip(qualities.keys(), qualities.boxplot_stats()):
+        metrics[name] = OrderedDict([
+            ('scores', int(qualities[name].sum())),
+            ('mean', float(stats['mean'])),
+            ('q1', float(stats['q1'])),
+            ('median', float(stats['med'])),
+            ('q3', float(stats['q3']))])
+
+    return metrics
+
+
+def _write_json(metrics, handle):
+    """Write metrics as JSON. NaN isn't valid JSON, so is written as null."""
+    json.dump(_replace_nan(metrics), handle, indent=2)
+    handle.write('\n')
+
+
+def _replace_nan(value):
+    if isinstance(value, dict):
+        return OrderedDict((key, _replace_nan(item))
+                           for key, item in value.items())
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
@@ -0,0 +1,349 @@
+"""This module contains functions for collecting the data required for the
+`pistis` plots using multiple processes. Each process collects a partial
+summary of the reads it is given and these are merged into a single summary.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import os
+import multiprocessing
+from collections import deque
+from typing import Iterable, Tuple, List, Union
+import numpy as np
+from pistis import utils, fastq, pipeline
+from pistis.sketch import DEFAULT_K
+
+CHUNKS_PER_PROCESS = 4  # byte ranges/regions per process, load balancing
+MIN_CHUNK_SIZE = 2 ** 16  # the fewest bytes of fastq to give a process
+
+
+def scan_fastq(filename, downsample=0, threads=1, profiles=False,
+               sketch_k=DEFAULT_K):
+    """Collects a `utils.FastqSummary` from a fastq file using multiple
+    processes.
+
+    Uncompressed files are split into byte ranges, each of which is read by a
+    separate process. Compressed files are read through a `pipeline` in the
+    main process, which sends batches of records to the worker processes to
+    compute the metrics. Files that can't be parsed as four line records, e.g
+    with the sequences wrapped over several lines, are read with pysam in the
+    main process instead.
+
+    Args:
+        filename: Path to the fastq file. This can be gzipped.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        Set to 0 for no down-sampling.
+        threads: The number of worker processes to use.
+        profiles: Also collect the per-position quality profiles, see
+        `utils.FastqSummary`.
+        sketch_k: The k of the quantile sketches, see `utils.FastqSummary`.
+
+    Returns:
+        A `utils.FastqSummary` of all the reads.
+
+    Raises:
+        ValueError: If pysam can't read the file either.
+    """
+    if threads <= 1:
+        return _summarise_fastq_file(filename, downsample, profiles, sketch_k)
+
+    pool = multiprocessing.Pool(threads)
+    try:
+        if fastq.is_gzipped(filename):
+            return _scan_batches(filename, downsample, pool, threads,
+                                 profiles, sketch_k)
+        return _scan_byte_ranges(filename, downsample, pool, threads,
+                                 profiles, sketch_k)
+    except ValueError:
+        return _summarise_fastx(filename, downsample, profiles, sketch_k)
+    finally:
+        pool.close()
+        pool.join()
+
+
+scan_fastq.__annotations__ = {'filename': str, 'downsample': int,
+                              'threads': int, 'profiles': bool,
+                              'sketch_k': int,
+                              'return': utils.FastqSummary}
+
+
+def scan_fastq_files(filenames, downsample=0, threads=1,
+                     profiles=False, sketch_k=DEFAULT_K):
+    """Collects a single `utils.FastqSummary` from several fastq files.
+
+    A single file is split between processes by `scan_fastq`. Otherwise, each
+    file is read by one worker process, with the largest files dispatched first
+    so that the workers finish at around the same time.
+
+    Args:
+        filenames: Paths to the fastq files. These can be gzipped.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        Set to 0 for no down-sampling.
+        threads: The number of worker processes to use.
+        profiles: Also collect the per-position quality profiles, see
+        `utils.FastqSummary`.
+        sketch_k: The k of the quantile sketches, see `utils.FastqSummary`.
+
+    Returns:
+        A `utils.FastqSummary` of the reads in all files.
+
+    Raises:
+        ValueError: If pysam can't read one of the files either.
+    """
+    if len(filenames) == 1:
+        return scan_fastq(filenames[0], downsample, threads, profiles,
+                          sketch_k)
+
+    summary = utils.FastqSummary(downsample, profiles, sketch_k)
+    if threads <= 1:
+        for filename in filenames:
+            _merge_partial(summary, _summarise_fastq_file(
+                filename, downsample, profiles, sketch_k))
+        return summary
+
+    largest_first = sorted(filenames, key=os.path.getsize, reverse=True)
+    pool = multiprocessing.Pool(threads)
+    try:
+        for partial in pool.imap_unordered(
+                _summarise_file, [(filename, downsample, profiles, sketch_k)
+                                  for filename in largest_first]):
+            _merge_partial(summary, partial)
+    finally:
+        pool.close()
+        pool.join()
+
+    return summary
+
+
+scan_fastq_files.__annotations__ = {'filenames': List[str],
+                                    'downsample': int,
+                                    'threads': int,
+                                    'profiles': bool,
+                                    'sketch_k': int,
+                                    'return': utils.FastqSummary}
+
+
+def _merge_partial(summary, partial):
+    """Merge a partial summary into summary, unless it has no reads, e.g from
+    a region without any alignments."""
+    reads = (partial.reads if isinstance(partial, utils.FastqSummary) else
+             partial.identities)
+    if reads.seen:
+        summary.merge(partial)
+
+
+_merge_partial.__annotations__ = {
+    'summary': Union[utils.FastqSummary, utils.AlignmentSummary],
+    'partial': Union[utils.FastqSummary, utils.AlignmentSummary],
+    'return': None}
+
+
+def _summarise_file(job):
+    """Summarise a whole fastq file. Run in a worker process."""
+    return _summarise_fastq_file(*job)
+
+
+_summarise_file.__annotations__ = {'job': Tuple[str, int, bool, int],
+                                   'return': utils.FastqSummary}
+
+
+def _summarise_fastq_file(filename, downsample, profiles, sketch_k):
+    """Summarise a whole fastq file with the pipeline, or with pysam if its
+    records aren't four lines long."""
+    try:
+        return pipeline.summarise_fastq_file(filename, downsample,
+                                             profiles=profiles,
+                                             sketch_k=sketch_k)
+    except ValueError:
+        return _summarise_fastx(filename, downsample, profiles, sketch_k)
+
+
+_summarise_fastq_file.__annotations__ = {'filename': str, 'downsample': int,
+                                         'profiles': bool, 'sketch_k': int,
+                                         'return': utils.FastqSummary}
+
+
+def _summarise_fastx(filename, downsample, profiles, sketch_k):
+    """Summarise a whole fastq file with pysam, which also reads records with
+    the sequence and quality string wrapped over several lines."""
+    import pysam
+    summary = utils.FastqSummary(downsample, profiles, sketch_k)
+    with pysam.FastxFile(filename) as fastx:
+        summary.add_reads(_fastx_reads(fastx, filename))
+
+    return summary
+
+
+_summarise_fastx.__annotations__ = {'filename': str, 'downsample': int,
+                                    'profiles': bool, 'sketch_k': int,
+                                    'return': utils.FastqSummary}
+
+
+def _fastx_reads(fastx, filename):
+    """The (sequence, quality string) pairs of the records from pysam, checking
+    that they have quality strings, i.e aren't fasta."""
+    for record in fastx:
+        if record.quality is None:
+            raise ValueError("{} has no quality scores".format(filename))
+        yield record.sequence, record.quality
+
+
+_fastx_reads.__annotations__ = {'fastx': Iterable, 'filename': str,
+                                'return': Iterable[Tuple[str, str]]}
+
+
+def _scan_byte_ranges(filename, downsample, pool, threads, profiles,
+                      sketch_k):
+    """Split an uncompressed fastq into byte ranges and summarise each range in
+    a separate process. Small files are split into fewer ranges, so that no
+    range is empty."""
+    size = os.path.getsize(filename)
+    num_chunks = max(min(threads * CHUNKS_PER_PROCESS,
+                         size // MIN_CHUNK_SIZE), 1)
+    boundaries = np.linspace(0, size, num_chunks + 1).astype(int)
+    chunks = [(filename, start, end, downsample, profiles, sketch_k)
+              for start, end in zip(boundaries[:-1], boundaries[1:])]
+    summary = utils.FastqSummary(downsample, profiles, sketch_k)
+    for partial in pool.imap_unordered(_summarise_byte_range, chunks):
+        _merge_partial(summary, partial)
+
+    return summary
+
+
+def _summarise_byte_range(chunk):
+    """Summarise the records whose header starts within a byte range of an
+    uncompressed fastq. Run in a worker process."""
+    filename, start, end, downsample, profiles, sketch_k = chunk
+    summary = utils.FastqSummary(downsample, profiles, sketch_k)
+    with open(filename, 'rb') as handle:
+        end = fastq.find_record_start(handle, end)
+        start = fastq.find_record_start(handle, start)
+        for batch in fastq.read_batches(handle, end - start):
+            summary.add_batch(*batch)
+
+    return summary
+
+
+_summarise_byte_range.__annotations__ = {'chunk': Tuple[str, int, int, int,
+                                                        bool, int],
+                                         'return': utils.FastqSummary}
+
+
+def _scan_batches(filename, downsample, pool, threads, profiles, sketch_k):
+    """Read a compressed fastq in this process and summarise batches of its
+    records in worker processes."""
+    summary = utils.FastqSummary(downsample, profiles, sketch_k)
+    # bound the number of batches in flight so the parser can't run away
+    pending = deque()
+    for batch in pipeline.read_batches(filename, threads=threads):
+        if len(pending) >= 2 * threads:
+            summary.merge(pending.popleft().get())
+        pending.append(pool.apply_async(_summarise_batch,
+                                        (batch, profiles, sketch_k)))
+    while pending:
+        summary.merge(pending.popleft().get())
+
+    return summary
+
+
+def _summarise_batch(batch, profiles=False, sketch_k=DEFAULT_K):
+    """Summarise a batch of packed reads, keeping the metrics of every read so
+    that the main process can sample them. Run in a worker process."""
+    summary = utils.FastqSummary(profiles=profiles, sketch_k=sketch_k)
+    summary.add_batch(*batch)
+
+    return summary
+
+
+_summarise_batch.__annotations__ = {'batch': Tuple[np.ndarray, np.ndarray,
+                                                   np.ndarray],
+                                    'profiles': bool,
+                                    'sketch_k': int,
+                                    'return': utils.FastqSummary}
+
+
+def scan_alignments(filename, downsample=0, threads=1, identity='nm',
+                    sketch_k=DEFAULT_K):
+    """Collects a `utils.AlignmentSummary` from a SAM/BAM/CRAM file using
+    multiple processes.
+
+    Indexed files are split into genomic regions, each of which is read by a
+    separate process. As unmapped reads are excluded from the summary, no
+    reads are lost by only reading regions of the reference. Files without an
+    index are read serially.
+
+    Args:
+        filename: Path to the SAM/BAM/CRAM file.
+        downsample: Down-sample the percent identities to given number of
+        reads. Set to 0 for no down-sampling.
+        threads: The number of worker processes to use.
+        identity: How to define percent identity, one of
+        `utils.IDENTITY_DEFINITIONS`.
+        sketch_k: The k of the quantile sketch, see `utils.AlignmentSummary`.
+
+    Returns:
+        A `utils.AlignmentSummary` of all the primary, mapped reads.
+    """
+    import pysam
+    mode = utils.alignment_read_mode(filename)
+    with pysam.AlignmentFile(filename, mode) as samfile:
+        regions = (_alignment_regions(samfile, threads * CHUNKS_PER_PROCESS)
+                   if threads > 1 and samfile.has_index() else None)
+        if not regions:
+            summary = utils.AlignmentSummary(downsample, identity, sketch_k)
+            for record in samfile:
+                summary.add(record)
+            return summary
+
+    chunks = [(filename, contig, start, end, downsample, identity, sketch_k)
+              for contig, start, end in regions]
+    summary = utils.AlignmentSummary(downsample, identity, sketch_k)
+    pool = multiprocessing.Pool(threads)
+    try:
+        for partial in pool.imap_unordered(_summarise_region, chunks):
+            _merge_partial(summary, partial)
+    finally:
+        pool.close()
+        pool.join()
+
+    return summary
+
+
+scan_alignments.__annotations__ = {'filename': str, 'downsample': int,
+                                   'threads': int, 'identity': str,
+                                   'sketch_k': int,
+                                   'return': utils.AlignmentSummary}
+
+
+def _alignment_regions(samfile, num_regions):
+    """Split the contigs with mapped reads into (roughly) num_regions regions
+    of equal length. Large contigs are split, small ones are kept whole."""
+    contigs = [(stats.contig, samfile.get_reference_length(stats.contig))
+               for stats in samfile.get_index_statistics() if stats.mapped]
+    region_size = max(sum(length for _, length in contigs) // num_regions, 1)
+    regions = []
+    for contig, length in contigs:
+        for start in range(0, length, region_size):
+            regions.append((contig, start, min(start + region_size, length)))
+
+    return regions
+
+
+def _summarise_region(chunk):
+    """Summarise the reads whose alignment starts within a region of an indexed
+    alignment file. Run in a worker process."""
+    import pysam
+    filename, contig, start, end, downsample, identity, sketch_k = chunk
+    summary = utils.AlignmentSummary(downsample, identity, sketch_k)
+    mode = utils.alignment_read_mode(filename)
+    with pysam.AlignmentFile(filename, mode) as samfile:
+        for record in samfile.fetch(contig, start, end):
+            # reads overlapping the start belong to the previous region
+            if record.reference_start >= start:
+                summary.add(record)
+
+    return summary
+
+
+_summarise_region.__annotations__ = {
+    'chunk': Tuple[str, str, int, int, int, str, int],
+    'return': utils.AlignmentSummary}
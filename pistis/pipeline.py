@@ -0,0 +1,357 @@
+"""This module contains a streaming pipeline for reading fastq files. Reading
+from disk, decompression, parsing the records into batches and computing the
+metrics of each batch run in separate threads, connected by bounded queues, so
+the stages overlap and the throughput is that of the slowest stage rather than
+that of all stages combined. When a stage falls behind, the queue before it
+fills up and the stages before it wait.
+
+BGZF files (e.g from `bgzip`) are made of independent blocks, so these are
+decompressed by several threads at once. zlib releases the GIL while it works,
+so this does use more than one CPU.
+"""
+from __future__ import absolute_import
+import sys
+import struct
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
+import six
+from six.moves import queue
+from typing import Iterable, Tuple, List
+import numpy as np
+from pistis import utils, fastq, profiling
+from pistis.sketch import DEFAULT_K
+
+READ_SIZE = 2 ** 20  # bytes read from disk at a time
+QUEUE_SIZE = 8  # items held between stages before the earlier stage waits
+BGZF_HEADER_SIZE = 18  # bytes in the header of a block with only the BC field
+
+_DONE = object()  # marks the end of the items put in a queue
+
+
+def is_bgzf(filename):
+    """Checks whether a file is BGZF compressed, i.e the first gzip member has
+    the 'BC' extra field holding the size of the block.
+
+    Args:
+        filename: Path to the file.
+
+    Returns:
+        True if the file starts with a BGZF block header.
+    """
+    with open(filename, 'rb') as handle:
+        return bgzf_block_size(handle.read(BGZF_HEADER_SIZE), 0) is not None
+
+
+is_bgzf.__annotations__ = {'filename': str, 'return': bool}
+
+
+def read_batches(filename, max_bases=utils.BATCH_BASES, threads=1):
+    """Reads a fastq file through the pipeline, yielding packed batches of
+    reads as they are parsed.
+
+    Args:
+        filename: Path to the fastq file. This can be gzipped.
+        max_bases: The number of bases after which a batch is yielded.
+        threads: The number of threads to decompress BGZF files with.
+
+    Yields:
+        The packed sequences, qualities and offsets of each batch, as returned
+        by `utils.pack_reads`.
+    """
+    pipe = _Pipeline()
+    batches = _start_batching(pipe, filename, max_bases, threads)
+    try:
+        while True:
+            batch = pipe.get(batches)
+            if batch is _DONE:
+                return
+            yield batch
+    finally:
+        pipe.close()
+
+
+read_batches.__annotations__ = {'filename': str, 'max_bases': int,
+                                'threads': int,
+                                'return': Iterable[Tuple[np.ndarray,
+                                                         np.ndarray,
+                                                         np.ndarray]]}
+
+
+def summarise_fastq_file(filename, downsample=0, threads=1, profiles=False,
+                         sketch_k=DEFAULT_K):
+    """Collects a `utils.FastqSummary` from a fastq file with the pipeline.
+
+    Args:
+        filename: Path to the fastq file. This can be gzipped.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        Set to 0 for no down-sampling.
+        threads: The number of threads to compute the metrics of the batches
+        with (and to decompress BGZF files with).
+        profiles: Also collect the per-position quality profiles, see
+        `utils.FastqSummary`.
+        sketch_k: The k of the quantile sketches, see `utils.FastqSummary`.
+
+    Returns:
+        A `utils.FastqSummary` of all the reads.
+    """
+    pipe = _Pipeline()
+    batches = _start_batching(pipe, filename, utils.BATCH_BASES, threads)
+    summaries = [utils.FastqSummary(downsample, profiles, sketch_k)
+                 for _ in range(threads)]
+    for summary in summaries:
+        pipe.start(_summarise_batches, pipe, batches, summary)
+    pipe.close(wait=True)
+
+    summary = summaries[0]
+    for partial in summaries[1:]:
+        summary.merge(partial)
+
+    return summary
+
+
+summarise_fastq_file.__annotations__ = {'filename': str, 'downsample': int,
+                                        'threads': int, 'profiles': bool,
+                                        'sketch_k': int,
+                                        'return': utils.FastqSummary}
+
+
+class _Pipeline(object):
+    """The threads of a pipeline and the state they share: whether they should
+    stop early and any error raised in one of them."""
+
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.threads = []
+        self.errors = []
+
+    def start(self, target, *args):
+        """Run target(*args) in a new thread."""
+        thread = threading.Thread(target=self._run, args=(target, args))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _run(self, target, args):
+        try:
+            target(*args)
+        except BaseException:
+            self.errors.append(sys.exc_info())
+            self.stopped.set()
+
+    def put(self, items, item):
+        """Put an item in a queue, waiting until there is space for it.
+        Returns False if the pipeline was stopped while waiting."""
+        while not self.stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, items):
+        """Get an item from a queue, waiting until there is one. Returns
+        `_DONE` if the pipeline was stopped while waiting."""
+        while True:
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    return _DONE
+
+    def close(self, wait=False):
+        """Stop the threads, or wait for them to finish, and raise the first
+        error raised in any of them."""
+        if not wait:
+            self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            six.reraise(*self.errors[0])
+
+
+def _start_batching(pipe, filename, max_bases, threads):
+    """Start the reading, decompression and batching stages. Returns the queue
+    the batches are put in."""
+    raw = queue.Queue(QUEUE_SIZE)
+    pipe.start(_read_file, pipe, filename, raw)
+    if not fastq.is_gzipped(filename):
+        data = raw
+    elif is_bgzf(filename):
+        data = queue.Queue(QUEUE_SIZE)
+        pipe.start(_inflate_bgzf, pipe, raw, data, threads)
+    else:
+        data = queue.Queue(QUEUE_SIZE)
+        pipe.start(_inflate_gzip, pipe, raw, data)
+    batches = queue.Queue(QUEUE_SIZE)
+    pipe.start(_batch_records, pipe, data, batches, max_bases)
+
+    return batches
+
+
+def _read_file(pipe, filename, out):
+    """Reader stage: put the contents of a file in a queue, in chunks."""
+    with open(filename, 'rb') as handle:
+        while True:
+            with profiling.timed('fastq.read'):
+                chunk = handle.read(READ_SIZE)
+            if not chunk:
+                break
+            if not pipe.put(out, chunk):
+                return
+    pipe.put(out, _DONE)
+
+
+def _inflate_gzip(pipe, chunks, out):
+    """Decompressor stage for (possibly multi-member) gzip data."""
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    started = False
+    while True:
+        chunk = pipe.get(chunks)
+        if chunk is _DONE:
+            break
+        while chunk:
+            started = True
+            with profiling.timed('fastq.decompress'):
+                data = inflater.decompress(chunk)
+            if not pipe.put(out, data):
+                return
+            chunk = b''
+            if inflater.eof:  # a new member starts after this one
+                chunk = inflater.unused_data
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                started = False
+    if pipe.stopped.is_set():
+        return
+    if started and not inflater.eof:
+        raise ValueError("Compressed fastq file ended unexpectedly.")
+    pipe.put(out, _DONE)
+
+
+def _inflate_bgzf(pipe, chunks, out, threads):
+    """Decompressor stage for BGZF data. The blocks in each chunk are
+    decompressed by a pool of threads."""
+    workers = ThreadPool(threads)
+    try:
+        pending = b''
+        while True:
+            chunk = pipe.get(chunks)
+            if chunk is _DONE:
+                break
+            with profiling.timed('fastq.decompress'):
+                blocks, pending = _split_bgzf_blocks(pending + chunk)
+                data = b''.join(workers.map(inflate_bgzf_block, blocks))
+            if not pipe.put(out, data):
+                return
+    finally:
+        workers.close()
+        workers.join()
+    if pipe.stopped.is_set():
+        return
+    if pending:
+        raise ValueError("Compressed fastq file ended unexpectedly.")
+    pipe.put(out, _DONE)
+
+
+def bgzf_block_size(data, offset):
+    """Get the size of the BGZF block starting at offset, from the BC extra
+    field of its header. Returns None if there isn't a BGZF block header."""
+    header = data[offset:offset + 12]
+    if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+        return None
+    extra_length = struct.unpack('<H', header[10:12])[0]
+    position = offset + 12
+    extra_end = position + extra_length
+    while position + 4 <= extra_end:
+        field, length = struct.unpack('<2sH', data[position:position + 4])
+        if field == b'BC' and length == 2:
+            return struct.unpack('<H', data[position + 4:position + 6])[0] + 1
+        position += 4 + length
+
+    return None
+
+
+bgzf_block_size.__annotations__ = {'data': bytes, 'offset': int,
+                                   'return': int}
+
+
+def _split_bgzf_blocks(data):
+    """Split BGZF data into its complete blocks and the remaining data."""
+    blocks = []
+    offset = 0
+    while len(data) - offset >= BGZF_HEADER_SIZE:
+        size = bgzf_block_size(data, offset)
+        if size is None:
+            raise ValueError("Expected a BGZF block at compressed byte "
+                             "{}.".format(offset))
+        if offset + size > len(data):
+            break
+        blocks.append(data[offset:offset + size])
+        offset += size
+
+    return blocks, data[offset:]
+
+
+_split_bgzf_blocks.__annotations__ = {'data': bytes,
+                                      'return': Tuple[List[bytes], bytes]}
+
+
+def inflate_bgzf_block(block):
+    """Decompress a single BGZF block."""
+    extra_length = struct.unpack('<H', block[10:12])[0]
+    # raw deflate data, between the header and the CRC32 and size trailer
+    return zlib.decompress(block[12 + extra_length:-8], -zlib.MAX_WBITS)
+
+
+inflate_bgzf_block.__annotations__ = {'block': bytes, 'return': bytes}
+
+
+def _batch_records(pipe, data, out, max_bases):
+    """Batcher stage: parse the records from the (uncompressed) data in blocks
+    of about max_bases bases, and put them in a queue as packed batches."""
+    # a record has about as many bytes of sequence as of quality string
+    block_size = 2 * max_bases
+    chunks = []
+    num_bytes = 0
+    remainder = b''
+    while True:
+        chunk = pipe.get(data)
+        if chunk is _DONE:
+            break
+        chunks.append(chunk)
+        num_bytes += len(chunk)
+        if num_bytes < block_size:
+            continue
+        block = remainder + b''.join(chunks)
+        chunks = []
+        num_bytes = 0
+        with profiling.timed('fastq.parse'):
+            sequences, qualities, offsets, end = fastq.parse_records(block)
+        remainder = block[end:]
+        if len(offsets) > 1 and not pipe.put(out, (sequences, qualities,
+                                                   offsets)):
+            return
+    if pipe.stopped.is_set():
+        return
+    block = remainder + b''.join(chunks)
+    if block.strip():
+        with profiling.timed('fastq.parse'):
+            batch = fastq.parse_records(block, final=True)[:3]
+        if not pipe.put(out, batch):
+            return
+    pipe.put(out, _DONE)
+
+
+def _summarise_batches(pipe, batches, summary):
+    """Metrics stage: add batches to a summary until there are no more."""
+    while True:
+        batch = pipe.get(batches)
+        if batch is _DONE:
+            # leave the marker for the other metric threads
+            pipe.put(batches, _DONE)
+            return
+        offsets = batch[2]
+        with profiling.timed('fastq.metrics', len(offsets) - 1,
+                             int(offsets[-1])):
+            summary.add_batch(*batch)
@@ -5,114 +5,699 @@ data and writes it to a PDF report."""
 from __future__ import division
 from __future__ import absolute_import
 import os
-import pysam
-import matplotlib
-matplotlib.use('Agg')
-import seaborn as sns
+import glob
+import time
+from collections import namedtuple
+from functools import partial
+from typing import Tuple, List
 import click
-from pistis import utils, plots
+from pistis import (utils, parallel, sampling, stats, watch, metrics,
+                    profiling, cache, sketch, fastq as fastq_io)
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 SEABORN_STYLE = 'whitegrid'
 REQUIRED_EXT = '.pdf'
+OFFSET_SAMPLED_NOTE = ("Offset-sampled estimate: from {0:,} {1} at random "
+                       "offsets in the files, not from all {1}.")
 
+FastqInput = namedtuple('FastqInput', ['source', 'files'])
 
-@click.command(context_settings=CONTEXT_SETTINGS)
+
+class FastqPath(click.Path):
+    """A click parameter type for a fastq file, a directory of fastq files or a
+    glob of fastq files. Converts to a `FastqInput` of the path given (the
+    directory, for a glob) and the fastq files it refers to."""
+    name = 'path'
+
+    def __init__(self):
+        super(FastqPath, self).__init__(exists=True, resolve_path=True)
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, FastqInput):
+            return value
+        if glob.has_magic(value):
+            files = sorted(os.path.abspath(path) for path in glob.glob(value)
+                           if os.path.isfile(path) and fastq_io.is_fastq(path))
+            if not files:
+                self.fail('No fastq files match "{}".'.format(value), param,
+                          ctx)
+            return FastqInput(os.path.abspath(os.path.dirname(value) or '.'),
+                              files)
+
+        path = super(FastqPath, self).convert(value, param, ctx)
+        if not os.path.isdir(path):
+            return FastqInput(path, [path])
+        files = fastq_io.find_fastq_files(path)
+        if not files:
+            self.fail('No fastq files found in directory "{}".'.format(value),
+                      param, ctx)
+        return FastqInput(path, files)
+
+
+# options shared by the main command and subcommands
+OUTPUT_OPTION = click.option(
+    '--output', '-o', default='.',
+    type=click.Path(dir_okay=True, resolve_path=True, writable=True),
+    help="Path to save the plot PDF as. If name is not specified, will use "
+         "the name of the fastq (or bam) file with .pdf extension.")
+KIND_OPTION = click.option(
+    '--kind', '-k', default='kde',
+    type=click.Choice(['kde', 'scatter', 'hex']),
+    help="The kind of representation to use for the jointplot of quality "
+         "score vs read length. Accepted kinds are 'scatter', 'kde' "
+         "(default), or 'hex'. For examples refer to "
+         "https://seaborn.pydata.org/generated/seaborn.jointplot.html")
+LOG_LENGTH_OPTION = click.option(
+    '--log_length/--no_log_length', default=True,
+    help="Plot the read length as a log10 transformation on the quality vs "
+         "read length plot")
+SAVE_STATS_OPTION = click.option(
+    '--save-stats',
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Save the data collected from the fastq and/or BAM file to a binary "
+         "summary file. The report can be regenerated from this file with "
+         "--from-stats.")
+METRICS_OPTION = click.option(
+    '--metrics', 'metrics_file',
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    help="Write summary metrics (read count, total bases, read length N50 and "
+         "quantiles, quality, GC and percent identity distributions) to a "
+         "file. JSON, unless the file name ends with .tsv. Use - for stdout.")
+POSITION_BINS_OPTION = click.option(
+    '--position-bins',
+    type=click.Choice(utils.POSITION_BINNINGS),
+    default='default',
+    help="How to bin the read positions of the quality per position plots: "
+         "'default' is positions 1-10, 11-20, 21-50, 51-100, 101-200 and "
+         "201-300, 'linear' is bins of equal width and 'log' bins of equal "
+         "width on a log scale up to the longest read, and 'all' is every "
+         "position (in buckets under 1% as wide as their position past "
+         "1024). Anything but 'default' collects the quality at every "
+         "position of the reads, which is around three times slower, and adds "
+         "a plot of quality by relative position in the reads.")
+POSITION_BIN_COUNT_OPTION = click.option(
+    '--position-bin-count',
+    type=click.IntRange(min=1),
+    default=30,
+    help="The number of 'linear' or 'log' position bins. Default: 30")
+SKETCH_ERROR_OPTION = click.option(
+    '--sketch-error',
+    type=click.FloatRange(min=0.0001, max=0.5),
+    help="The largest error, as a fraction of the number of reads, in the "
+         "rank of the quantiles in the metrics (e.g the read length "
+         "quantiles and N50), with a probability of about 99%. Smaller "
+         "errors take more memory. Default: about 0.01")
+METRICS_ONLY_OPTION = click.option(
+    '--metrics-only', is_flag=True,
+    help="Only write the summary metrics, without making the PDF report. The "
+         "metrics are written to stdout as JSON if --metrics isn't given.")
+
+
+@click.group(context_settings=CONTEXT_SETTINGS, invoke_without_command=True,
+             subcommand_metavar='[COMMAND [ARGS]...]')
+@click.pass_context
 @click.option('--fastq', '-f',
-              type=click.Path(exists=True, dir_okay=False,
-                              resolve_path=True),
-              help="Fastq file to plot. This can be gzipped.")
-@click.option('--output', '-o', default='.',
-              type=click.Path(dir_okay=True, resolve_path=True,
-                              writable=True),
-              help="Path to save the plot PDF as. If name is not specified,"
-                   " will use the name of the fastq (or bam) file with .pdf "
-                   "extension.")
-@click.option('--kind', '-k', default='kde',
-              type=click.Choice(['kde', 'scatter', 'hex']),
-              help="The kind of representation to use for the jointplot of "
-                   "quality score vs read length. Accepted kinds are 'scatter'"
-                   ", 'kde' (default), or 'hex'. For examples refer to "
-                   "https://seaborn.pydata.org/generated/seaborn.jointplot.html")
-@click.option('--log_length/--no_log_length', default=True,
-              help="Plot the read length as a log10 transformation on the "
-                   "quality vs read length plot")
+              type=FastqPath(),
+              multiple=True,
+              help="Fastq file to plot. This can be gzipped. Can also be a "
+                   "directory or a (quoted) glob of fastq files, and can be "
+                   "given multiple times. All files go into one report.")
+@OUTPUT_OPTION
+@KIND_OPTION
+@LOG_LENGTH_OPTION
 @click.option('--bam', '-b',
               type=click.Path(exists=True, dir_okay=False, resolve_path=True),
               help="SAM/BAM file to produce read percent identity histogram "
                    "from.")
+@click.option('--identity',
+              type=click.Choice(utils.IDENTITY_DEFINITIONS),
+              default='nm',
+              help="How to define the percent identity of a read: 'nm' (the "
+                   "default) is 1 - NM / aligned read length, 'blast' is "
+                   "matching bases / alignment columns and 'gap_compressed' "
+                   "is as 'blast' but counts each insertion or deletion as "
+                   "one difference, whatever its length.")
 @click.option('--downsample', '-d',
               type=int,
               default=50000,
-              help="Down-sample the sequence files to a given number of reads. "
-                   "Set to 0 for no subsampling. Default: 50000")
-def main(fastq, output, kind, log_length, bam, downsample):
+              help="Down-sample the sequence files to a given number of "
+                   "reads. Set to 0 for no subsampling. Default: 50000")
+@click.option('--preview', is_flag=True,
+              help="Sample the --downsample reads at random offsets in the "
+                   "files instead of reading every read, for a quick look at "
+                   "a large run. The report is an estimate from the sampled "
+                   "reads. Works for uncompressed fastq, BGZF fastq with a "
+                   ".gzi index (from bgzip -i or samtools fqidx) and BAM with "
+                   "a .bai index. Other files are read in full.")
+@click.option('--threads', '-t',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of processes to use for reading the fastq and "
+                   "indexed BAM files. Default: 1")
+@SAVE_STATS_OPTION
+@click.option('--from-stats',
+              type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+              help="Generate the report from a summary file saved with "
+                   "--save-stats, instead of from fastq/BAM files.")
+@METRICS_OPTION
+@METRICS_ONLY_OPTION
+@SKETCH_ERROR_OPTION
+@POSITION_BINS_OPTION
+@POSITION_BIN_COUNT_OPTION
+@click.option('--no-cache', is_flag=True,
+              help="Don't use or add to the cache of the data collected from "
+                   "the fastq and BAM files. By default, a rerun on unchanged "
+                   "files with the same --downsample, --identity, --preview "
+                   "and --position-bins goes straight to plotting.")
+@click.option('--cache-dir',
+              type=click.Path(file_okay=False, writable=True,
+                              resolve_path=True),
+              help="Directory to cache the collected data in. Default: "
+                   "$PISTIS_CACHE_DIR, or pistis in $XDG_CACHE_HOME or "
+                   "~/.cache")
+@click.option('--cache-size',
+              type=click.IntRange(min=0),
+              default=cache.DEFAULT_MAX_SIZE // 1024 ** 2,
+              help="The most megabytes of data to keep in the cache. The "
+                   "least recently used data is removed first. Default: "
+                   "{}".format(cache.DEFAULT_MAX_SIZE // 1024 ** 2))
+@click.option('--cache-hash', is_flag=True,
+              help="Recognise unchanged files in the cache by a hash of their "
+                   "contents instead of by their path, size and modification "
+                   "time, so copies of a file, or files rewritten with the "
+                   "same contents, also use the cache. Hashing reads the "
+                   "whole of each file, but is much quicker than parsing it.")
+@click.option('--profile', 'profile_file',
+              type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+              help="Measure the time, CPU time, reads and bases processed and "
+                   "peak memory of each stage of the run (reading, "
+                   "decompressing and parsing the fastq files, computing the "
+                   "metrics, making each plot, writing the PDF...) and write "
+                   "them to a file as JSON. Use - to print them to stderr as "
+                   "a table.")
+@click.option('--cprofile', 'cprofile_file',
+              type=click.Path(dir_okay=False, writable=True),
+              help="Profile the main thread with cProfile and save the "
+                   "statistics to a file, for reading with pstats or "
+                   "snakeviz. To profile every thread and process, run "
+                   "pistis under a sampling profiler such as py-spy instead.")
+def main(ctx, fastq, output, kind, log_length, bam, identity, downsample,
+         preview, threads, save_stats, from_stats, metrics_file, metrics_only,
+         sketch_error, position_bins, position_bin_count, no_cache, cache_dir,
+         cache_size, cache_hash, profile_file, cprofile_file):
     """A package for sanity checking (quality control) your long read data.
-        Feed it a fastq file and in return you will receive a PDF with four plots:\n
+        Feed it a fastq file and in return you will receive a PDF with four
+        plots:\n
             1. GC content histogram with distribution curve for sample.\n
-            2. Jointplot showing the read length vs. phred quality score for each
-            read. The interior representation of this plot can be altered with the
-            --kind option.\n
-            3. Box plot of the phred quality score at positional bins across all reads. The reads are binned into read positions 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11-20, 21-50, 51-100, 101-200, 201-300. Plots from the start of reads.\n
+            2. Jointplot showing the read length vs. phred quality score for
+            each read. The interior representation of this plot can be altered
+            with the --kind option.\n
+            3. Box plot of the phred quality score at positional bins across
+            all reads. The reads are binned into read positions 1, 2, 3, 4, 5,
+            6, 7, 8, 9, 10, 11-20, 21-50, 51-100, 101-200, 201-300, or along
+            the whole read with --position-bins. Plots from the start of
+            reads.\n
             4. Same as 3, but plots from the end of the read.\n
     Additionally, if you provide a BAM/SAM file a histogram of the read percent
     identity will be added to the report.
     """
-    if not any([fastq, bam]):
+    if ctx.invoked_subcommand is not None:
+        return 0
+    if not any([fastq, bam, from_stats]):
         raise click.MissingParameter("Either --fastq, --bam or both must be "
-                                     "given as arguments.")
-    sns.set(style=SEABORN_STYLE)
+                                     "given as arguments. Alternatively, use "
+                                     "--from-stats.")
+    if from_stats and any([fastq, bam]):
+        raise click.UsageError("--from-stats cannot be used with --fastq or "
+                               "--bam.")
+    if preview and not downsample:
+        raise click.UsageError("--preview needs the number of reads to sample "
+                               "from --downsample.")
+    save_as = _report_path(output,
+                           fastq[0].source if fastq else bam or from_stats)
+
+    with profiling.session(profile_file, cprofile_file):
+        if from_stats:
+            with profiling.stage('load_stats'):
+                fastq_summary, alignment_summary = stats.load_stats(
+                    from_stats)
+        else:
+            fastq_files = [filename for fastq_input in fastq
+                           for filename in fastq_input.files]
+            summary_cache = None if no_cache else cache.SummaryCache(
+                cache_dir, cache_size * 1024 ** 2, cache_hash)
+            fastq_summary, alignment_summary = _collect_summaries(
+                fastq_files, bam, downsample, threads, identity, preview,
+                profiles=position_bins != 'default',
+                sketch_k=_sketch_k(sketch_error),
+                summary_cache=summary_cache)
+            if save_stats:
+                with profiling.stage('save_stats'):
+                    stats.save_stats(save_stats, fastq_summary,
+                                     alignment_summary)
+
+        _write_outputs(fastq_summary, alignment_summary, save_as, kind,
+                       log_length, metrics_file, metrics_only, position_bins,
+                       position_bin_count)
+
+    return 0
+
+
+main.__annotations__ = {'ctx': click.Context,
+                        'fastq': Tuple[FastqInput],
+                        'output': click.Path,
+                        'kind': str,
+                        'log_length': bool,
+                        'bam': click.Path,
+                        'identity': str,
+                        'downsample': int,
+                        'preview': bool,
+                        'threads': int,
+                        'save_stats': click.Path,
+                        'from_stats': click.Path,
+                        'metrics_file': click.Path,
+                        'metrics_only': bool,
+                        'sketch_error': float,
+                        'position_bins': str,
+                        'position_bin_count': int,
+                        'no_cache': bool,
+                        'cache_dir': click.Path,
+                        'cache_size': int,
+                        'cache_hash': bool,
+                        'profile_file': click.Path,
+                        'cprofile_file': click.Path,
+                        'return': int}
+
+
+@main.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('summaries', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False,
+                                resolve_path=True))
+@OUTPUT_OPTION
+@KIND_OPTION
+@LOG_LENGTH_OPTION
+@SAVE_STATS_OPTION
+@METRICS_OPTION
+@METRICS_ONLY_OPTION
+@POSITION_BINS_OPTION
+@POSITION_BIN_COUNT_OPTION
+def merge(summaries, output, kind, log_length, save_stats, metrics_file,
+          metrics_only, position_bins, position_bin_count):
+    """Combine summary files saved with --save-stats into a single report.
+
+    Use this to produce one report for a sample sequenced over several runs or
+    flowcells, without re-reading any reads. The summaries must have been
+    collected with the same --downsample value.
+    """
+    try:
+        fastq_summary, alignment_summary = stats.merge_stats(summaries)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    if save_stats:
+        stats.save_stats(save_stats, fastq_summary, alignment_summary)
+
+    _write_outputs(fastq_summary, alignment_summary,
+                   _report_path(output, summaries[0]), kind, log_length,
+                   metrics_file, metrics_only,
+                   position_bins=position_bins,
+                   position_bin_count=position_bin_count)
+
+    return 0
+
+
+merge.__annotations__ = {'summaries': Tuple[str],
+                         'output': click.Path,
+                         'kind': str,
+                         'log_length': bool,
+                         'save_stats': click.Path,
+                         'metrics_file': click.Path,
+                         'metrics_only': bool,
+                         'position_bins': str,
+                         'position_bin_count': int,
+                         'return': int}
+
+
+@main.command(name='watch', context_settings=CONTEXT_SETTINGS)
+@click.argument('directory',
+                type=click.Path(exists=True, file_okay=False,
+                                resolve_path=True))
+@OUTPUT_OPTION
+@KIND_OPTION
+@LOG_LENGTH_OPTION
+@click.option('--downsample', '-d',
+              type=int,
+              default=50000,
+              help="Down-sample the reads to a given number. Set to 0 for no "
+                   "subsampling. Default: 50000")
+@click.option('--interval', '-i',
+              type=click.FloatRange(min=0),
+              default=60,
+              help="Seconds between checking for new reads and updating the "
+                   "report. Default: 60")
+@click.option('--polls',
+              type=click.IntRange(min=0),
+              default=0,
+              help="Stop after checking for new reads this many times. Set to "
+                   "0 to keep watching until interrupted. Default: 0")
+@SAVE_STATS_OPTION
+@SKETCH_ERROR_OPTION
+@POSITION_BINS_OPTION
+@POSITION_BIN_COUNT_OPTION
+def watch_directory(directory, output, kind, log_length, downsample, interval,
+                    polls, save_stats, sketch_error, position_bins,
+                    position_bin_count):
+    """Watch a directory that fastq files are being written to (e.g during a
+    sequencing run) and keep a report of all reads up to date.
+
+    Only reads written since the last check are read, so each update takes
+    time proportional to the amount of new data. Files in subdirectories are
+    included.
+    """
+    save_as = _report_path(output, directory)
+    fastq_watcher = watch.FastqWatcher(directory, downsample,
+                                       profiles=position_bins != 'default',
+                                       sketch_k=_sketch_k(sketch_error))
+    num_polls = 0
+    while True:
+        new_reads = fastq_watcher.poll()
+        num_polls += 1
+        if new_reads:
+            click.echo("Added {} new reads ({} in total). Updating {}".format(
+                new_reads, fastq_watcher.summary.reads.seen, save_as),
+                err=True)
+            if save_stats:
+                stats.save_stats(save_stats, fastq_watcher.summary)
+            _write_report(fastq_watcher.summary, None, save_as, kind,
+                          log_length, position_bins=position_bins,
+                          position_bin_count=position_bin_count)
+        if polls and num_polls >= polls:
+            break
+        time.sleep(interval)
+
+    return 0
+
+
+watch_directory.__annotations__ = {'directory': click.Path,
+                                   'output': click.Path,
+                                   'kind': str,
+                                   'log_length': bool,
+                                   'downsample': int,
+                                   'interval': float,
+                                   'polls': int,
+                                   'save_stats': click.Path,
+                                   'sketch_error': float,
+                                   'position_bins': str,
+                                   'position_bin_count': int,
+                                   'return': int}
+
+
+def _report_path(output, input_filename):
+    """Work out where to save the PDF report.
 
-    # if the specified output is a directory, default pdf name is fastq name.
+    Args:
+        output: The --output option. Either a directory or a file name.
+        input_filename: The file the report is for. If output is a directory,
+        the report is named after this file.
+
+    Returns:
+        The path to save the report to, with a .pdf extension.
+    """
+    # if the specified output is a directory, default pdf name is input name.
     if os.path.isdir(output):
-        # get the basename of the fastq file and add pdf extension
-        basename, ext = os.path.splitext(os.path.basename(fastq or bam))
+        # get the basename of the input file and add pdf extension
+        basename, ext = os.path.splitext(
+            os.path.basename(os.path.normpath(input_filename)))
         # if file is gzipped, need to also strip fastq extension
         if ext == '.gz':
             basename = os.path.splitext(os.path.basename(basename))[0]
 
         filename = basename + REQUIRED_EXT
-        save_as = os.path.join(output, filename)
-    else:  # if file name is provided in output, make sure it has correct ext.
-        extension = os.path.splitext(output)[-1]
-        if extension.lower() != REQUIRED_EXT:
-            save_as = output + REQUIRED_EXT
+        return os.path.join(output, filename)
+
+    # if file name is provided in output, make sure it has correct ext.
+    extension = os.path.splitext(output)[-1]
+    if extension.lower() != REQUIRED_EXT:
+        return output + REQUIRED_EXT
+    return output
+
+
+_report_path.__annotations__ = {'output': str, 'input_filename': str,
+                                'return': str}
+
+
+def _collect_summaries(fastq_files, bam, downsample, threads, identity='nm',
+                       preview=False, profiles=False,
+                       sketch_k=sketch.DEFAULT_K, summary_cache=None):
+    """Collect the data needed for the report from the fastq and BAM files.
+
+    Args:
+        fastq_files: The fastq files to summarise (into a single summary).
+        bam: The SAM/BAM file to summarise, or None.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        threads: The number of worker processes to use.
+        identity: How to define the percent identity of the alignments.
+        preview: Sample downsample reads at random offsets in the files (see
+        `sampling`), for those files that can be sampled.
+        profiles: Collect the per-position quality profiles of the fastq
+        files, for --position-bins.
+        sketch_k: The k of the quantile sketches of the summaries.
+        summary_cache: A `cache.SummaryCache` to load the summaries from, and
+        to save them to if they aren't in it, or None.
+
+    Returns:
+        A tuple of the `utils.FastqSummary`, or None if there are no fastq
+        files, and the `utils.AlignmentSummary`, or None if there is no BAM.
+
+    Raises:
+        click.BadParameter: If the fastq files can't be read.
+    """
+    fastq_summary = alignment_summary = None
+    if fastq_files:
+        sample_fastq = preview and _can_preview(
+            fastq_files, sampling.can_sample_fastq,
+            "Reading the fastq files in full, as only uncompressed fastq and "
+            "BGZF fastq with a .gzi index can be previewed.")
+        if sample_fastq:
+            collect = partial(sampling.sample_fastq_files, fastq_files,
+                              downsample, profiles=profiles,
+                              sketch_k=sketch_k)
         else:
-            save_as = output
-
-    plots_for_report = []
-    if fastq:
-        with pysam.FastxFile(fastq) as fastq_file:
-            # collect the data needed for plotting
-            (gc_content,
-             read_lengths,
-             mean_quality_scores,
-             bins_from_start,
-             bins_from_end) = utils.collect_fastq_data(fastq_file, downsample)
-
-        # generate plots
-        plots_for_report.extend([
-            plots.gc_plot(gc_content),
-            plots.length_vs_qual_plot(read_lengths, mean_quality_scores,
-                                      log_length=log_length, kind=kind),
-            plots.quality_per_position(bins_from_start, 'start'),
-            plots.quality_per_position(bins_from_end, 'end')
-        ])
+            collect = partial(parallel.scan_fastq_files, fastq_files,
+                              downsample, threads, profiles, sketch_k)
+        with profiling.stage('fastq'):
+            try:
+                fastq_summary = _cached(summary_cache, 'fastq', fastq_files,
+                                        collect, downsample=downsample,
+                                        preview=sample_fastq,
+                                        profiles=profiles, sketch_k=sketch_k)
+            except ValueError as error:
+                raise click.BadParameter(
+                    "{}. Check that the fastq files are complete, and are "
+                    "fastq rather than fasta.".format(str(error).rstrip('.')),
+                    param_hint="'--fastq'")
+        profiling.record('fastq', fastq_summary.reads.seen,
+                         int(fastq_summary.length_sketch.total))
     if bam:
+        sample_bam = preview and _can_preview(
+            [bam], sampling.can_sample_alignments,
+            "Reading the alignments in full, as only BAM files with a .bai "
+            "index can be previewed.")
+        if sample_bam:
+            collect = partial(sampling.sample_alignments, bam, downsample,
+                              identity, sketch_k=sketch_k)
+        else:
+            collect = partial(parallel.scan_alignments, bam, downsample,
+                              threads, identity, sketch_k)
+        with profiling.stage('bam'):
+            alignment_summary = _cached(summary_cache, 'bam', [bam], collect,
+                                        downsample=downsample,
+                                        preview=sample_bam, identity=identity,
+                                        sketch_k=sketch_k)
+        profiling.record('bam', alignment_summary.identity_sketch.count)
+
+    return fastq_summary, alignment_summary
+
+
+_collect_summaries.__annotations__ = {
+    'fastq_files': List[str],
+    'bam': str,
+    'downsample': int,
+    'threads': int,
+    'identity': str,
+    'preview': bool,
+    'profiles': bool,
+    'sketch_k': int,
+    'summary_cache': cache.SummaryCache,
+    'return': Tuple[utils.FastqSummary, utils.AlignmentSummary]}
+
+
+def _sketch_k(sketch_error):
+    """The k of the quantile sketches for --sketch-error."""
+    if sketch_error is None:
+        return sketch.DEFAULT_K
+    return sketch.k_for_error(sketch_error)
+
+
+def _cached(summary_cache, kind, filenames, collect, **parameters):
+    """Load the summary of files from the cache, or collect it by calling
+    collect and add it to the cache. Without a cache, just collect it."""
+    if summary_cache is None:
+        return collect()
+    key = summary_cache.key(kind, filenames, **parameters)
+    with profiling.timed('cache.load'):
+        summary = summary_cache.load(kind, key)
+    if summary is not None:
+        return summary
+
+    summary = collect()
+    try:
+        with profiling.timed('cache.save'):
+            summary_cache.save(kind, key, summary)
+    except (IOError, OSError) as error:
+        click.echo("Warning: couldn't cache the {} data: {}".format(kind,
+                                                                    error),
+                   err=True)
+
+    return summary
+
+
+def _can_preview(filenames, can_sample, message):
+    """Check that files can all be sampled for --preview, warning with
+    message if not."""
+    if all(can_sample(filename) for filename in filenames):
+        return True
+    click.echo("Warning: " + message, err=True)
+    return False
+
+
+def _write_outputs(fastq_summary, alignment_summary, save_as, kind,
+                   log_length, metrics_file=None, metrics_only=False,
+                   position_bins='default', position_bin_count=30):
+    """Write the PDF report and/or the summary metrics.
+
+    Args:
+        fastq_summary: The `utils.FastqSummary` to report on, or None.
+        alignment_summary: The `utils.AlignmentSummary` to report on, or None.
+        save_as: The path to save the PDF to.
+        kind: The kind of representation to use for the jointplot.
+        log_length: Plot the read length on a log10 scale in the jointplot.
+        metrics_file: The path to write the metrics to, or None.
+        metrics_only: Don't write the PDF. The metrics are written to stdout
+        if there is no metrics_file.
+        position_bins: How to bin the read positions of the quality per
+        position plots, one of `utils.POSITION_BINNINGS`.
+        position_bin_count: The number of 'linear' or 'log' position bins.
+    """
+    if not metrics_only:
+        _check_position_bins(fastq_summary, position_bins)
+    if metrics_only or metrics_file:
+        with profiling.stage('metrics'):
+            metrics.write_metrics(
+                metrics.collect_metrics(fastq_summary, alignment_summary),
+                metrics_file or '-')
+    if not metrics_only:
+        with profiling.stage('report'):
+            _write_report(fastq_summary, alignment_summary, save_as, kind,
+                          log_length, position_bins, position_bin_count)
+
+
+_write_outputs.__annotations__ = {'fastq_summary': utils.FastqSummary,
+                                  'alignment_summary': utils.AlignmentSummary,
+                                  'save_as': str,
+                                  'kind': str,
+                                  'log_length': bool,
+                                  'metrics_file': str,
+                                  'metrics_only': bool,
+                                  'position_bins': str,
+                                  'position_bin_count': int,
+                                  'return': None}
+
+
+def _write_report(fastq_summary, alignment_summary, save_as, kind,
+                  log_length, position_bins='default', position_bin_count=30):
+    """Plot the collected data and save the plots to a PDF report.
+
+    Args:
+        fastq_summary: The `utils.FastqSummary` to plot, or None.
+        alignment_summary: The `utils.AlignmentSummary` to plot, or None.
+        save_as: The path to save the PDF to.
+        kind: The kind of representation to use for the jointplot.
+        log_length: Plot the read length on a log10 scale in the jointplot.
+        position_bins: How to bin the read positions of the quality per
+        position plots, one of `utils.POSITION_BINNINGS`.
+        position_bin_count: The number of 'linear' or 'log' position bins.
+    """
+    _check_position_bins(fastq_summary, position_bins)
+    # matplotlib and seaborn take a long time to import, so are only imported
+    # when a report is made
+    import seaborn as sns
+    from pistis import plots
+    sns.set(style=SEABORN_STYLE)
+
+    # each plot is made from the summaries by a job, so a page is only held
+    # in memory until it is written
+    plot_jobs = []
+    if fastq_summary is not None:
+        if position_bins == 'default':
+            bins_from_start = fastq_summary.bins_from_start
+            bins_from_end = fastq_summary.bins_from_end
+        else:
+            bins_from_start, bins_from_end = (
+                profile.bins(position_bins, position_bin_count)
+                for profile in (fastq_summary.profile_from_start,
+                                fastq_summary.profile_from_end))
+        log_position = position_bins in ('log', 'all')
+
+        fastq_jobs = [
+            (plots.gc_plot, (fastq_summary.gc_histogram,)),
+            (plots.length_vs_qual_grid_plot,
+             (fastq_summary.length_quality, kind, log_length,
+              fastq_summary.reads.items)),
+            (plots.quality_per_position,
+             (bins_from_start, 'start', log_position)),
+            (plots.quality_per_position,
+             (bins_from_end, 'end', log_position))
+        ]
+        if fastq_summary.relative_qualities is not None:
+            fastq_jobs.append((plots.relative_quality_per_position,
+                               (fastq_summary.relative_qualities,)))
+        if fastq_summary.offset_sampled:
+            note = OFFSET_SAMPLED_NOTE.format(fastq_summary.reads.seen,
+                                              'reads')
+            fastq_jobs = [job + (note,) for job in fastq_jobs]
+        plot_jobs.extend(fastq_jobs)
+    if alignment_summary is not None:
         # generate read percent identity plot
-        perc_identities = utils.sam_percent_identity(bam, downsample)
-        plots_for_report.append(plots.percent_identity(perc_identities))
+        identity_job = (plots.percent_identity,
+                        (alignment_summary.identity_histogram,))
+        if alignment_summary.offset_sampled:
+            identity_job += (OFFSET_SAMPLED_NOTE.format(
+                alignment_summary.identity_sketch.count, 'alignments'),)
+        plot_jobs.append(identity_job)
 
-    plots.save_plots_to_pdf(plots_for_report, save_as)
+    plots.save_plot_jobs_to_pdf(plot_jobs, save_as)
 
-    return 0
 
+_write_report.__annotations__ = {'fastq_summary': utils.FastqSummary,
+                                 'alignment_summary': utils.AlignmentSummary,
+                                 'save_as': str,
+                                 'kind': str,
+                                 'log_length': bool,
+                                 'position_bins': str,
+                                 'position_bin_count': int,
+                                 'return': None}
+
+
+def _check_position_bins(fastq_summary, position_bins):
+    """Check that the quality per position plots can be binned as asked,
+    i.e the fastq summary has profiles unless the bins are the default."""
+    if (position_bins != 'default' and fastq_summary is not None and
+            not fastq_summary.profiles):
+        raise click.UsageError(
+            "--position-bins {} needs the quality at every position of the "
+            "reads, which is only collected when reading the reads with "
+            "--position-bins other than 'default'.".format(position_bins))
 
-main.__annotations__ = {'fastq': click.Path,
-                        'output': click.Path,
-                        'kind': str,
-                        'log_length': bool,
-                        'return': int}
 
 if __name__ == "__main__":
     import sys
@@ -2,41 +2,47 @@
 `pistis` and also for saving those plots into a single PDF document.
 """
 from __future__ import absolute_import
-from typing import List
-import collections
+from typing import List, Tuple, Callable, Union
 import matplotlib
 matplotlib.use('Agg')
 import seaborn as sns
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.gridspec import GridSpec
+from matplotlib.collections import LineCollection, PolyCollection
 from matplotlib.backends.backend_pdf import PdfPages
-from six.moves import map
+from six.moves import map, zip
+from pistis import profiling
+from pistis.utils import (PositionalQualities, RelativeQualities,
+                          LengthQualityGrid, PercentHistogram, ReadTable,
+                          binned_kde)
 
 
 DPI = 150  # resolution for plots
 FIGURE_SIZE = (11.7, 10)
+MAX_BOXES = 50  # positional bins beyond which quality is drawn as bands
+BOX_WIDTH = 0.5  # of the boxes of the quality box plots, in bins
+QUALITY_LABEL = 'Phred Quality Score'
 
 
 def gc_plot(gc_content):
     """Generate a histogram with density curve over it for GC content of sample.
 
     Args:
-        gc_content: A list of GC content for each read.
+        gc_content: A `utils.PercentHistogram` of the GC content of the reads,
+        or a list of GC content for each read.
 
     Returns:
         A matplotlib figure object containing the plot.
 
     """
-    bins = 100
     xlabel = 'GC content'
     ylabel = 'Proportion of reads'
     title = 'GC content of each read'
-    # set the x-axis limits based on whether data is decimal or percentage
-    xlim = (0, 100) if any(x > 1 for x in gc_content) else (0, 1.0)
 
     fig, axes = plt.subplots(dpi=DPI, figsize=FIGURE_SIZE)
-    plot = sns.distplot(gc_content, bins=bins, ax=axes)
-    plot.set(xlabel=xlabel, ylabel=ylabel, title=title, xlim=xlim)
+    _histogram_plot(_as_histogram(gc_content), axes)
+    axes.set(xlabel=xlabel, ylabel=ylabel, title=title, xlim=(0, 100))
 
     # remove top and right border of plot
     sns.despine()
@@ -44,18 +50,19 @@ def gc_plot(gc_content):
     return fig
 
 
-gc_plot.__annotations__ = {'gc_content': List[float],
+gc_plot.__annotations__ = {'gc_content': PercentHistogram,
                            'return': plt.Figure}
 
 
-def length_vs_qual_plot(lengths, quality_scores, kind='scatter',
+def length_vs_qual_plot(lengths, quality_scores=None, kind='scatter',
                         log_length=True):
     """Generates a plot of the read length against quality score for each read.
 
     Args:
-        lengths: A list with each element being the length of a read.
+        lengths: A list with each element being the length of a read, or a
+        `utils.ReadTable` of the reads.
         quality_scores: A list with each element being the mean Phred quality
-        score for a read.
+        score for a read. Not needed when lengths is a `utils.ReadTable`.
         kind: The way the points are represented on the plot. Options include
         hex bins, scatter points or kernel density estimatation ('hex',
         'scatter', and 'kde' respectively).
@@ -70,9 +77,7 @@ def length_vs_qual_plot(lengths, quality_scores, kind='scatter',
         xlabel = 'Read Length (bp)'
         ylabel = 'Phred quality score'
 
-        # jointplot require numpy array
-        x_data = np.array(lengths)
-        y_data = np.array(quality_scores)
+        x_data, y_data = _length_and_quality(lengths, quality_scores)
 
         if log_length:
             x_data = np.log10(x_data)
@@ -107,79 +112,357 @@ def length_vs_qual_plot(lengths, quality_scores, kind='scatter',
     return plot.fig
 
 
-length_vs_qual_plot.__annotations__ = {'lengths': List[int],
+length_vs_qual_plot.__annotations__ = {'lengths': Union[ReadTable,
+                                                        List[int]],
                                        'quality_scores': List[float],
                                        'kind': str,
                                        'log_length': bool,
                                        'return': plt.Figure}
 
 
-def quality_per_position(data, from_end='start'):
+def length_vs_qual_grid_plot(grid, kind='kde', log_length=True, sample=None):
+    """Generates a plot of the read length against quality score from a
+    `utils.LengthQualityGrid`. As the plot is drawn from the binned counts, the
+    time taken doesn't depend on the number of reads.
+
+    Args:
+        grid: A `utils.LengthQualityGrid` of the reads.
+        kind: The way the reads are represented on the plot. Options include
+        hex bins, scatter points or kernel density estimatation ('hex',
+        'scatter', and 'kde' respectively). The kernel density estimate is
+        calculated from the binned counts.
+        log_length: Plot the length as a logarithm (base 10).
+        sample: A `utils.ReadTable` (or a tuple of read lengths and mean
+        quality scores) to draw as points when kind is 'scatter', e.g a
+        down-sample of the reads. If None, the centre of each occupied bin is
+        drawn instead.
+
+    Returns:
+        A matplotlib figure object containing the plot.
+    """
+    # use slightly different plot styling for this plot compared to the others
+    with sns.axes_style('whitegrid',
+                        rc={"grid.linewidth": 0.25, 'grid.linestyle': '--'}):
+        xlabel = 'Read Length (bp)'
+        ylabel = 'Phred quality score'
+        colour = sns.color_palette()[0]
+
+        fig = plt.figure(dpi=DPI, figsize=FIGURE_SIZE)
+        layout = GridSpec(6, 6, figure=fig, wspace=0, hspace=0)
+        ax_joint = fig.add_subplot(layout[1:, :-1])
+        ax_marg_x = fig.add_subplot(layout[0, :-1], sharex=ax_joint)
+        ax_marg_y = fig.add_subplot(layout[1:, -1], sharey=ax_joint)
+
+        length_edges = grid.length_edges
+        log_length_centres = (length_edges[:-1] + length_edges[1:]) / 2
+        length_centres = log_length_centres
+        if not log_length:
+            length_edges = 10 ** length_edges
+            length_centres = 10 ** length_centres
+        quality_edges = grid.quality_edges
+        quality_centres = (quality_edges[:-1] + quality_edges[1:]) / 2
+        length_counts = grid.counts.sum(axis=1)
+        quality_counts = grid.counts.sum(axis=0)
+        occupied = grid.counts > 0
+
+        if kind == 'kde':
+            with profiling.timed('report.kde'):
+                density = binned_kde(grid.counts,
+                                     [grid.length_edges, grid.quality_edges])
+            if density.any():
+                ax_joint.contourf(length_centres, quality_centres,
+                                  density.T, levels=np.linspace(
+                                      density.max() / 10, density.max(), 8),
+                                  cmap=sns.light_palette(colour,
+                                                         as_cmap=True),
+                                  extend='neither')
+            with profiling.timed('report.kde'):
+                length_density = binned_kde(length_counts,
+                                            [grid.length_edges])
+                quality_density = binned_kde(quality_counts, [quality_edges])
+            ax_marg_x.fill_between(length_centres, length_density,
+                                   color=colour, alpha=0.25)
+            ax_marg_x.plot(length_centres, length_density, color=colour)
+            ax_marg_y.fill_betweenx(quality_centres, quality_density,
+                                    color=colour, alpha=0.25)
+            ax_marg_y.plot(quality_density, quality_centres, color=colour)
+        else:
+            if kind == 'hex':
+                lengths, qualities = np.meshgrid(length_centres,
+                                                 quality_centres,
+                                                 indexing='ij')
+                if occupied.any():
+                    ax_joint.hexbin(lengths[occupied], qualities[occupied],
+                                    C=grid.counts[occupied],
+                                    reduce_C_function=np.sum, gridsize=50,
+                                    cmap=sns.light_palette(colour,
+                                                           as_cmap=True))
+            elif kind == 'scatter':
+                if sample is None:
+                    lengths, qualities = np.nonzero(occupied)
+                    sample = (10 ** log_length_centres[lengths],
+                              quality_centres[qualities])
+                x_data, y_data = _length_and_quality(*(
+                    (sample,) if isinstance(sample, ReadTable) else sample))
+                if log_length:
+                    x_data = np.log10(x_data)
+                ax_joint.scatter(x_data, y_data, color=colour, alpha=0.15)
+            else:
+                raise ValueError("'kde', 'scatter' and 'hex' are the only "
+                                 "kinds of length vs. quality plot.")
+            _histogram_bars(ax_marg_x, length_centres,
+                            _coarse_edges(length_edges, length_counts),
+                            length_counts, colour, alpha=0.6)
+            _histogram_bars(ax_marg_y, quality_centres,
+                            _coarse_edges(quality_edges, quality_counts),
+                            quality_counts, colour, alpha=0.6,
+                            horizontal=True)
+
+        ax_joint.set(xlabel=xlabel, ylabel=ylabel)
+
+        # fix the y axis limits to reasonable phred scores
+        quality_ticks = list(range(0, 50, 5))
+        ax_joint.set_yticks(quality_ticks)
+        ax_joint.set_yticklabels(quality_ticks)
+
+        if log_length:  # format x-axis labels and ticks for log data
+            log_ticks = [500, 1e3, 3e3, 5e3, 1e4, 3e4, 5e4, 1e5, 3e5, 5e5, 1e6,
+                         1.5e6, 2e6]
+            ax_joint.set_xticks(np.log10(log_ticks))
+            ax_joint.set_xticklabels(list(map(int, log_ticks)), rotation=270)
+
+        # only show the part of the grid with reads in it. ticks are set first
+        # as setting them expands the limits to include them
+        if occupied.any():
+            lengths, qualities = np.nonzero(occupied)
+            ax_joint.set_xlim(_padded_range(length_edges[lengths.min()],
+                                            length_edges[lengths.max() + 1]))
+            ax_joint.set_ylim(_padded_range(
+                quality_edges[qualities.min()],
+                quality_edges[qualities.max() + 1]))
+
+        # the marginal axes only need to show the distribution's shape
+        for axes in (ax_marg_x, ax_marg_y):
+            axes.grid(False)
+            axes.tick_params(labelbottom=False, labelleft=False, bottom=False,
+                             left=False)
+        ax_marg_x.set_ylim(bottom=0)
+        ax_marg_y.set_xlim(left=0)
+        sns.despine(ax=ax_marg_x, left=True)
+        sns.despine(ax=ax_marg_y, bottom=True)
+
+    return fig
+
+
+length_vs_qual_grid_plot.__annotations__ = {'grid': LengthQualityGrid,
+                                            'kind': str,
+                                            'log_length': bool,
+                                            'sample': Union[
+                                                ReadTable,
+                                                Tuple[List[int],
+                                                      List[float]]],
+                                            'return': plt.Figure}
+
+
+def _length_and_quality(lengths, quality_scores=None):
+    """The read lengths and mean quality scores to plot, as arrays, from a
+    `utils.ReadTable` or from lists of each."""
+    if isinstance(lengths, ReadTable):
+        lengths, quality_scores = lengths.length, lengths.mean_quality
+    # lengths are uint32 in a ReadTable, so are made floats to take logs of
+    return np.asarray(lengths, dtype=float), np.asarray(quality_scores)
+
+
+def _coarse_edges(edges, counts, bins=50):
+    """Get the edges of (roughly) `bins` histogram bins, made by joining the
+    fine bins of a grid, covering the occupied part of the grid."""
+    occupied = np.nonzero(counts)[0]
+    if not len(occupied):
+        return edges[[0, -1]]
+    edges = edges[occupied.min():occupied.max() + 2]
+    step = max(len(edges) // bins, 1)
+
+    return np.append(edges[:-1:step], edges[-1])
+
+
+def _padded_range(low, high, fraction=0.05):
+    """Widen an axis range by a fraction of its width on either side."""
+    padding = (high - low) * fraction
+    return low - padding, high + padding
+
+
+def quality_per_position(data, from_end='start', log_position=False):
     """Generate a box plot of quality scores across positions in all reads.
     Each box in the plot corresponds to a 'bin'. That is, all quality scores
     at that position (or positions if it is a range) across all reads.
 
+    With more than `MAX_BOXES` bins (e.g a bin for every position), the
+    quartiles and whiskers of the bins are drawn as bands along the reads
+    instead of as boxes.
+
     Args:
-        data: An ordered dictionary where the keys are positions in the reads
-        and the values are the quality scores at those positions.
+        data: A `utils.PositionalQualities` holding counts of the quality
+        scores in each positional bin.
         from_end: Which end of the read to plot from. 'start' or 'end'.
+        log_position: Draw the read position of the bands on a log scale.
 
     Returns:
         A matplotlib figure object containing the plot.
     """
-    if from_end.lower() == 'start':
-        col_names = list(data.keys())
-        values = list(data.values())
-    elif from_end.lower() == 'end':
-        col_names = list(data.keys())[::-1]
-        values = list(data.values())[::-1]
-    else:
+    if from_end.lower() not in ('start', 'end'):
         raise Exception("'start' and 'end' are the only options allowed for "
                         "plotting quality per position.")
+    stats = data.boxplot_stats()
 
     title = 'Quality score across reads, from the {}'.format(from_end)
     xlabel = 'Read position (bp)'
-    ylabel = 'Phred Quality Score'
+    if len(stats) <= MAX_BOXES:
+        if from_end.lower() == 'end':
+            stats = stats[::-1]
+        return _quality_boxplot(stats, title, xlabel)
 
+    xlabel = 'Read position from the {} (bp)'.format(from_end)
     fig, axes = plt.subplots(figsize=FIGURE_SIZE, dpi=DPI)
-    plot = sns.boxplot(data=values, ax=axes, linewidth=0.5)
-    plot.set(xlabel=xlabel, ylabel=ylabel, title=title)
-    plot.set_xticklabels(col_names, rotation=45)
+    # each band runs from the first to the last (1-based) position of its bin
+    starts = np.asarray(data.starts, dtype=float)
+    edges = np.append(starts[:-1] + 1, starts[-1])
+    values = {key: np.array([bin_stats[key] for bin_stats in stats])
+              for key in ('whislo', 'q1', 'med', 'q3', 'whishi')}
+    if from_end.lower() == 'end':
+        axes.invert_xaxis()  # so the ends of the reads are on the right
+    colour = sns.color_palette()[0]
+    axes.fill_between(edges, np.append(values['whislo'], np.nan),
+                      np.append(values['whishi'], np.nan), step='post',
+                      color=colour, alpha=0.2, linewidth=0,
+                      label='Whiskers')
+    axes.fill_between(edges, np.append(values['q1'], np.nan),
+                      np.append(values['q3'], np.nan), step='post',
+                      color=colour, alpha=0.5, linewidth=0,
+                      label='Interquartile range')
+    axes.step(edges, np.append(values['med'], values['med'][-1:]),
+              where='post', color='0.25', linewidth=0.8, label='Median')
+    if log_position:
+        axes.set_xscale('log')
+    axes.set(xlabel=xlabel, ylabel=QUALITY_LABEL, title=title)
+    axes.legend(loc='lower left')
     sns.despine()
 
     return fig
 
 
-quality_per_position.__annotations__ = {'data': collections.OrderedDict,
+quality_per_position.__annotations__ = {'data': PositionalQualities,
                                         'from_end': str,
+                                        'log_position': bool,
                                         'return': plt.Figure}
 
 
+def relative_quality_per_position(data):
+    """Generate a box plot of quality scores across relative positions in all
+    reads, e.g the first 5% of each read, so that reads of every length are
+    in every box.
+
+    Args:
+        data: A `utils.RelativeQualities` holding counts of the quality scores
+        in each relative bin.
+
+    Returns:
+        A matplotlib figure object containing the plot.
+    """
+    return _quality_boxplot(data.boxplot_stats(),
+                            'Quality score along the length of the reads',
+                            'Relative read position')
+
+
+relative_quality_per_position.__annotations__ = {'data': RelativeQualities,
+                                                 'return': plt.Figure}
+
+
+def _quality_boxplot(stats, title, xlabel):
+    """Draw the pre-computed box plot statistics of positional bins.
+
+    The boxes, whiskers and medians are each drawn as a single collection,
+    rather than as an artist per box and line as `Axes.bxp` does, which makes
+    the figure several times quicker to make and to save."""
+    col_names = [bin_stats['label'] for bin_stats in stats]
+    fig, axes = plt.subplots(figsize=FIGURE_SIZE, dpi=DPI)
+    positions = np.arange(len(stats))
+    values = {key: np.array([bin_stats[key] for bin_stats in stats],
+                            dtype=float)
+              for key in ('whislo', 'q1', 'med', 'q3', 'whishi')}
+    # bins without any scores have no statistics, so no box
+    drawn = ~np.isnan(values['med'])
+    x, whislo, q1, med, q3, whishi = (
+        array[drawn] for array in (positions, values['whislo'], values['q1'],
+                                   values['med'], values['q3'],
+                                   values['whishi']))
+    colours = np.array(sns.color_palette(n_colors=len(stats)))[drawn]
+
+    # the widths are those of bxp: boxes half a bin wide, caps half of that
+    left, right = x - BOX_WIDTH / 2, x + BOX_WIDTH / 2
+    axes.add_collection(PolyCollection(
+        np.stack([np.column_stack(corner) for corner in
+                  ((left, q1), (right, q1), (right, q3), (left, q3))], axis=1),
+        facecolors=colours, edgecolors='black', linewidths=0.5))
+    cap_left, cap_right = x - BOX_WIDTH / 4, x + BOX_WIDTH / 4
+    whiskers = [((x, whislo), (x, q1)), ((x, q3), (x, whishi)),
+                ((cap_left, whislo), (cap_right, whislo)),
+                ((cap_left, whishi), (cap_right, whishi))]
+    axes.add_collection(LineCollection(
+        np.concatenate([_segments(*ends) for ends in whiskers]),
+        colors='black', linewidths=0.5))
+    axes.add_collection(LineCollection(_segments((left, med), (right, med)),
+                                       colors='0.25', linewidths=0.5,
+                                       zorder=2.1))
+    fliers = [(position, bin_stats['fliers'])
+              for position, bin_stats in zip(positions, stats)]
+    axes.plot(np.concatenate([np.full(len(scores), position)
+                              for position, scores in fliers]),
+              np.concatenate([scores for _, scores in fliers]),
+              linestyle='none', marker='d', markersize=3,
+              markerfacecolor='none', markeredgecolor='black')
+
+    axes.autoscale_view()
+    axes.set(xlabel=xlabel, ylabel=QUALITY_LABEL, title=title,
+             xlim=(-0.5, len(stats) - 0.5))
+    axes.set_xticks(positions)
+    axes.set_xticklabels(col_names, rotation=45)
+    sns.despine()
+
+    return fig
+
+
+def _segments(start, end):
+    """Line segments from arrays of the x and y of their starts to those of
+    their ends, as the (segment, point, x/y) array of a `LineCollection`."""
+    return np.stack([np.column_stack(start), np.column_stack(end)], axis=1)
+
+
 def percent_identity(perc_indentities):
     """Plots read percent identity as a distribution/histogram plot.
 
     Args:
-        perc_indentities: A list of the percentage identity figures.
+        perc_indentities: A `utils.PercentHistogram` of the percent identity of
+        the reads, or a list of the percentage identity figures.
 
     Returns:
         A matplotlib figure object containing the plot.
     """
-    bins = 100
     xlabel = 'Read percent identity'
     ylabel = 'Proportion of reads'
     title = 'Read alignment percent identity'
 
+    histogram = _as_histogram(perc_indentities)
     fig, axes = plt.subplots(dpi=DPI, figsize=FIGURE_SIZE)
-    plot = sns.distplot(perc_indentities, bins=bins, ax=axes)
+    _histogram_plot(histogram, axes)
 
     # add a vertical dashed line at the median
-    median = np.median(perc_indentities)
-    plt.plot([median] * 2, [0, 1], linewidth=2, c='r', alpha=0.75,
-             linestyle='--')
-    xticks = plot.get_xticks().tolist()[1:-1]
-    xticks.append(median.round(2))
-    xticks.sort()
-    plot.set(xlabel=xlabel, ylabel=ylabel, title=title, xticks=xticks,
+    median = histogram.median()
+    xticks = axes.get_xticks().tolist()[1:-1]
+    if not np.isnan(median):
+        axes.axvline(median, linewidth=2, c='r', alpha=0.75, linestyle='--')
+        xticks.append(round(median, 2))
+        xticks.sort()
+    axes.set(xlabel=xlabel, ylabel=ylabel, title=title, xticks=xticks,
              xticklabels=xticks)
     # remove top and right border of plot
     sns.despine()
@@ -187,10 +470,66 @@ def percent_identity(perc_indentities):
     return fig
 
 
-percent_identity.__annotations__ = {'gc_content': List[float],
+percent_identity.__annotations__ = {'perc_indentities': PercentHistogram,
                                     'return': plt.Figure}
 
 
+def _as_histogram(values):
+    """Get a `utils.PercentHistogram` of a list of percentages, or decimals.
+    Histograms are returned as they are."""
+    if isinstance(values, PercentHistogram):
+        return values
+    values = np.asarray(values, dtype=float)
+    if len(values) and np.nanmax(values) <= 1:
+        values = values * 100
+    histogram = PercentHistogram()
+    histogram.add(values)
+
+    return histogram
+
+
+def _histogram_plot(histogram, axes, bins=100):
+    """Draw a `utils.PercentHistogram` as a histogram of (roughly) `bins` bins
+    over the range of its values, with a kernel density estimate over it."""
+    centres = (histogram.edges[:-1] + histogram.edges[1:]) / 2
+    colour = sns.color_palette()[0]
+    _histogram_bars(axes, centres,
+                    _coarse_edges(histogram.edges, histogram.counts, bins),
+                    histogram.counts, colour, alpha=0.4,
+                    density=bool(histogram.counts.any()))
+    occupied = np.nonzero(histogram.counts)[0]
+    if len(occupied):
+        with profiling.timed('report.kde'):
+            density = binned_kde(histogram.counts, [histogram.edges])
+        # draw the curve a little past the values so its tails are visible
+        padding = max(len(occupied), occupied[-1] - occupied[0]) // 10 + 1
+        shown = slice(max(occupied[0] - padding, 0),
+                      occupied[-1] + padding + 1)
+        axes.plot(centres[shown], density[shown], color=colour)
+
+
+def _histogram_bars(axes, values, edges, weights, colour, alpha,
+                    density=False, horizontal=False):
+    """Draw a weighted histogram of values, like `Axes.hist`, but with the bars
+    as a single collection rather than a patch each, which is much quicker to
+    draw and to save."""
+    heights = np.histogram(values, edges, weights=weights, density=density)[0]
+    bottoms = np.zeros_like(heights)
+    corners = [(edges[:-1], bottoms), (edges[1:], bottoms),
+               (edges[1:], heights), (edges[:-1], heights)]
+    if horizontal:
+        corners = [(y, x) for x, y in corners]
+    bars = PolyCollection(np.stack([np.column_stack(corner)
+                                    for corner in corners], axis=1),
+                          facecolors=colour, alpha=alpha)
+    # like the bars of a histogram, keep the axis from extending past zero
+    (bars.sticky_edges.x if horizontal else bars.sticky_edges.y).append(0)
+    axes.add_collection(bars)
+    axes.autoscale_view()
+
+    return bars
+
+
 def save_plots_to_pdf(plots, filename):
     """Saves a list of given plots to a single PDF document.
 
@@ -210,3 +549,50 @@ def save_plots_to_pdf(plots, filename):
 save_plots_to_pdf.__annotations__ = {'plots': List[plt.Figure],
                                      'filename': str,
                                      'return': None}
+
+
+def save_plot_jobs_to_pdf(jobs, filename):
+    """Makes plots and saves them to a single PDF document, one page per plot
+    in the same order as the jobs. Each page is written, and its figure
+    closed, before the next plot is made.
+
+    Notes:
+        The plots are made in this process. Making them in worker processes
+        doesn't make the report any quicker, as writing the pages, which
+        takes as long as making the figures, has to be done by the process
+        that opened the PDF, and sending the figures to it costs more than
+        making them.
+
+    Args:
+        jobs: A list of (plot function, positional arguments) tuples, e.g
+        `(gc_plot, (gc_content,))`. A job can have a note as a third item,
+        which is written at the foot of its page, e.g that the plot is of an
+        estimate.
+        filename: The file name (and path) to save the PDF to.
+    """
+    pdf_doc = PdfPages(filename)
+    try:
+        for job in jobs:
+            fig = _make_plot(job)
+            with profiling.timed('report.write_pdf'):
+                pdf_doc.savefig(fig, dpi=DPI)
+            plt.close(fig)
+    finally:
+        pdf_doc.close()
+
+
+save_plot_jobs_to_pdf.__annotations__ = {'jobs': List[Tuple[Callable, tuple]],
+                                         'filename': str,
+                                         'return': None}
+
+
+def _make_plot(job):
+    """Make the plot for a job of `save_plot_jobs_to_pdf`."""
+    function, args = job[:2]
+    with profiling.timed('report.' + function.__name__):
+        fig = function(*args)
+    if len(job) > 2:
+        fig.text(0.5, 0.01, job[2], horizontalalignment='center',
+                 verticalalignment='bottom', fontsize='small', style='italic')
+
+    return fig
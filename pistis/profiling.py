@@ -0,0 +1,297 @@
+"""This module contains the instrumentation behind the `--profile` option. It
+measures where the time and memory of a run go, e.g reading, decompressing and
+parsing a fastq file, computing the metrics, making each plot and writing the
+PDF.
+
+There are two kinds of measurement:
+    - Stages are the sequential steps of a run, in the main process, e.g
+    collecting the data from the fastq files. Each records its wall time, CPU
+    time (including that of worker processes), the number of reads and bases
+    processed and the peak memory.
+    - Timers accumulate the time spent in a piece of work that is done many
+    times, possibly in several threads at once, e.g decompressing each chunk of
+    a gzipped file in the pipeline. Each records the total time spent, the
+    number of times the work was done and the reads and bases processed.
+
+Nothing is measured unless a `session` is active, so the instrumentation costs
+next to nothing otherwise. Timers in worker processes (e.g with --threads
+greater than one) are not collected, but their CPU time is included in the
+stage that started them.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import sys
+import os
+import json
+import threading
+import cProfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+from typing import Dict, Iterator
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+import pistis
+
+_profile = None  # the `Profile` of the active session, if there is one
+
+
+class Profile(object):
+    """The stages and timers measured during a run."""
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.timers = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage of the run. Stages with the same name are combined.
+
+        Args:
+            name: The name of the stage, e.g 'fastq'.
+        """
+        start_wall = default_timer()
+        start_times = os.times()
+        try:
+            yield
+        finally:
+            end_times = os.times()
+            stage = self._entry(self.stages, name)
+            stage['wall_seconds'] += default_timer() - start_wall
+            stage['cpu_seconds'] += sum(end_times[:2]) - sum(start_times[:2])
+            stage['children_cpu_seconds'] += (sum(end_times[2:4]) -
+                                              sum(start_times[2:4]))
+            stage['max_rss_mb'], stage['children_max_rss_mb'] = _max_rss()
+
+    def add(self, name, seconds=0.0, reads=0, bases=0):
+        """Add to a timer. This is safe to call from several threads.
+
+        Args:
+            name: The name of the timer, e.g 'fastq.decompress'.
+            seconds: The time spent.
+            reads: The number of reads processed.
+            bases: The number of bases processed.
+        """
+        with self._lock:
+            timer = self._entry(self.timers, name)
+            timer['seconds'] += seconds
+            timer['calls'] += 1
+            timer['reads'] += reads
+            timer['bases'] += bases
+
+    def record(self, name, reads=0, bases=0):
+        """Record the number of reads and bases processed by a stage.
+
+        Args:
+            name: The name of the stage.
+            reads: The number of reads processed.
+            bases: The number of bases processed.
+        """
+        stage = self._entry(self.stages, name)
+        stage['reads'] += reads
+        stage['bases'] += bases
+
+    def to_dict(self):
+        """The measurements as a dictionary, with the throughput in reads and
+        bases per second of each stage and timer that processed any reads.
+
+        Returns:
+            A dictionary with the pistis version, the stages and the timers.
+        """
+        stages = OrderedDict((name, _with_rates(stage, 'wall_seconds'))
+                             for name, stage in self.stages.items())
+        timers = OrderedDict((name, _with_rates(timer, 'seconds'))
+                             for name, timer in self.timers.items())
+
+        return OrderedDict([('version', pistis.__version__),
+                            ('stages', stages), ('timers', timers)])
+
+    def write(self, filename):
+        """Write the measurements to a file as JSON, or as a table to stderr.
+
+        Args:
+            filename: The path to write to, or '-' for stderr.
+        """
+        if filename == '-':
+            sys.stderr.write(self.format_table())
+            return
+        with open(filename, 'w') as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+            handle.write('\n')
+
+    def format_table(self):
+        """The measurements as a table to be read by a person."""
+        lines = [_STAGE_HEADER.format(
+            'stage', 'wall (s)', 'cpu (s)', 'reads', 'reads/s', 'rss (MB)')]
+        for name, stage in self.to_dict()['stages'].items():
+            lines.append(_STAGE_ROW.format(
+                name, stage['wall_seconds'],
+                stage['cpu_seconds'] + stage['children_cpu_seconds'],
+                stage['reads'], _format_rate(stage),
+                max(stage['max_rss_mb'], stage['children_max_rss_mb'])))
+        if self.timers:
+            lines.extend(['', '{:<32}{:>10}{:>10}{:>10}{:>12}'.format(
+                'timer', 'time (s)', 'calls', 'reads', 'reads/s')])
+        for name, timer in self.to_dict()['timers'].items():
+            lines.append('{:<32}{:>10.2f}{:>10}{:>10}{:>12}'.format(
+                name, timer['seconds'], timer['calls'], timer['reads'],
+                _format_rate(timer)))
+
+        return '\n'.join(lines) + '\n'
+
+    def _entry(self, entries, name):
+        if name not in entries:
+            fields = (_STAGE_FIELDS if entries is self.stages else
+                      _TIMER_FIELDS)
+            entries[name] = OrderedDict((field, 0) for field in fields)
+        return entries[name]
+
+
+_STAGE_FIELDS = ('wall_seconds', 'cpu_seconds', 'children_cpu_seconds',
+                 'reads', 'bases', 'max_rss_mb', 'children_max_rss_mb')
+_TIMER_FIELDS = ('seconds', 'calls', 'reads', 'bases')
+_STAGE_HEADER = '{:<32}{:>10}{:>10}{:>10}{:>12}{:>10}'
+_STAGE_ROW = '{:<32}{:>10.2f}{:>10.2f}{:>10}{:>12}{:>10.1f}'
+
+
+class _Timer(object):
+    """Context manager that adds the time spent in it to a timer."""
+
+    def __init__(self, profile, name, reads, bases):
+        self.profile = profile
+        self.name = name
+        self.reads = reads
+        self.bases = bases
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, default_timer() - self.start, self.reads,
+                         self.bases)
+
+
+class _NullTimer(object):
+    """Context manager that does nothing, for when there is no session."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+@contextmanager
+def session(profile_file=None, cprofile_file=None):
+    """Measure the stages and timers of a run, and write them out at the end.
+
+    Args:
+        profile_file: The path to write the measurements to as JSON, '-' to
+        write them to stderr as a table, or None not to measure anything.
+        cprofile_file: The path to write `cProfile` statistics of the main
+        thread to, or None. These can be read with the `pstats` module or
+        tools like snakeviz.
+
+    Yields:
+        The `Profile` being measured, or None.
+    """
+    global _profile
+    profiler = None
+    if cprofile_file:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profile_file:
+        _profile = Profile()
+    profile = _profile
+    try:
+        if profile is None:
+            yield None
+        else:
+            with profile.stage('total'):
+                yield profile
+    finally:
+        _profile = None
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_file)
+        if profile is not None:
+            profile.write(profile_file)
+
+
+session.__annotations__ = {'profile_file': str, 'cprofile_file': str,
+                           'return': Iterator[Profile]}
+
+
+@contextmanager
+def stage(name):
+    """Measure a stage of the run, if there is an active `session`. See
+    `Profile.stage`."""
+    if _profile is None:
+        yield
+    else:
+        with _profile.stage(name):
+            yield
+
+
+def timed(name, reads=0, bases=0):
+    """A context manager that adds the time spent in it to a timer, if there is
+    an active `session`.
+
+    Args:
+        name: The name of the timer, e.g 'fastq.decompress'.
+        reads: The number of reads processed.
+        bases: The number of bases processed.
+    """
+    if _profile is None:
+        return _NULL_TIMER
+    return _Timer(_profile, name, reads, bases)
+
+
+timed.__annotations__ = {'name': str, 'reads': int, 'bases': int}
+
+
+def record(name, reads=0, bases=0):
+    """Record the reads and bases processed by a stage, if there is an active
+    `session`. See `Profile.record`."""
+    if _profile is not None:
+        _profile.record(name, reads, bases)
+
+
+def _max_rss():
+    """The peak memory, in MB, of this process and of its largest child
+    process (that has finished) so far."""
+    if resource is None:
+        return float('nan'), float('nan')
+    # ru_maxrss is in KB on Linux but bytes on macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return tuple(resource.getrusage(who).ru_maxrss / scale
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+def _with_rates(entry, seconds_field):
+    """A copy of a stage or timer with its throughput added."""
+    entry = OrderedDict(entry)
+    seconds = entry[seconds_field]
+    if entry['reads'] and seconds > 0:
+        entry['reads_per_second'] = entry['reads'] / seconds
+        entry['bases_per_second'] = entry['bases'] / seconds
+    return entry
+
+
+_with_rates.__annotations__ = {'entry': Dict[str, float],
+                               'seconds_field': str,
+                               'return': Dict[str, float]}
+
+
+def _format_rate(entry):
+    if 'reads_per_second' not in entry:
+        return '-'
+    return '{:.0f}'.format(entry['reads_per_second'])
@@ -0,0 +1,430 @@
+"""This module contains functions for previewing fastq and BAM files from reads
+sampled at random offsets in each file, instead of reading every record. The
+amount of data read grows with the number of reads sampled rather than with
+the size of the file, so a preview of a very large run takes seconds.
+
+Each sample is the first record starting at, or after, a random offset. A
+record is picked with a probability proportional to the size of the record
+before it, so as long as the lengths of neighbouring reads are independent,
+long reads are no more likely to be picked than short ones. The summaries are
+still estimates, and are marked as `offset_sampled`.
+
+The files that can be sampled are:
+    - Uncompressed fastq files.
+    - BGZF compressed fastq files with a .gzi index (e.g from `bgzip -i` or
+    `samtools fqidx`), which holds the uncompressed offset of each block.
+    - BAM files with a .bai index. Its linear index holds the virtual offsets
+    of records throughout the file, so the records after a random virtual
+    offset can be found without reading from the start.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import os
+import struct
+from typing import BinaryIO, List, Tuple
+import numpy as np
+from six.moves import zip
+from pistis import utils, fastq, pipeline
+from pistis.sketch import DEFAULT_K
+
+GZI_EXTENSION = '.gzi'
+BAI_EXTENSION = '.bai'
+BAI_MAGIC = b'BAI\x01'
+BAI_PSEUDO_BIN = 37450  # holds the start and end of a contig's records
+BGZF_BLOCK_DATA = 2 ** 16  # the most uncompressed bytes in a BGZF block
+
+
+def can_sample_fastq(filename):
+    """Checks whether a fastq file can be sampled at random offsets, i.e it is
+    uncompressed, or BGZF compressed with a .gzi index.
+
+    Args:
+        filename: Path to the fastq file.
+
+    Returns:
+        True if `sample_fastq_files` can sample the file.
+    """
+    if not fastq.is_gzipped(filename):
+        return True
+    return (pipeline.is_bgzf(filename) and
+            os.path.isfile(filename + GZI_EXTENSION))
+
+
+can_sample_fastq.__annotations__ = {'filename': str, 'return': bool}
+
+
+def can_sample_alignments(filename):
+    """Checks whether an alignment file can be sampled at random offsets, i.e
+    it is a BAM file with a .bai index.
+
+    Args:
+        filename: Path to the SAM/BAM/CRAM file.
+
+    Returns:
+        True if `sample_alignments` can sample the file.
+    """
+    return (utils.alignment_read_mode(filename) == 'rb' and
+            _bai_path(filename) is not None)
+
+
+can_sample_alignments.__annotations__ = {'filename': str, 'return': bool}
+
+
+def sample_fastq_files(filenames, num_reads, seed=None, profiles=False,
+                       sketch_k=DEFAULT_K):
+    """Collects a `utils.FastqSummary` from reads sampled at random offsets in
+    fastq files. The reads are shared between the files in proportion to their
+    (uncompressed) size.
+
+    Args:
+        filenames: Paths to the fastq files. See `can_sample_fastq` for the
+        files that can be sampled.
+        num_reads: The number of random offsets to sample. Offsets leading to
+        the same record count once, so small files give fewer reads.
+        seed: Seed for the random number generator.
+        profiles: Also collect the per-position quality profiles, see
+        `utils.FastqSummary`.
+        sketch_k: The k of the quantile sketches, see `utils.FastqSummary`.
+
+    Returns:
+        A `utils.FastqSummary` of the sampled reads.
+    """
+    rng = np.random.RandomState(seed)
+    summary = utils.FastqSummary(num_reads, profiles, sketch_k)
+    summary.offset_sampled = True
+    handles = [_open_fastq(filename) for filename in filenames]
+    try:
+        sizes = np.array([_size(handle) for handle in handles], dtype=float)
+        if not sizes.sum():
+            return summary
+        for handle, count in zip(handles, rng.multinomial(
+                num_reads, sizes / sizes.sum())):
+            summary.add_reads(sample_records(handle, count, rng))
+    finally:
+        for handle in handles:
+            handle.close()
+
+    return summary
+
+
+sample_fastq_files.__annotations__ = {'filenames': List[str],
+                                      'num_reads': int,
+                                      'seed': int,
+                                      'profiles': bool,
+                                      'sketch_k': int,
+                                      'return': utils.FastqSummary}
+
+
+def sample_records(handle, num_reads, rng=None):
+    """Samples the fastq records after random offsets of a file handle.
+
+    Args:
+        handle: A fastq file opened in binary mode, or a `BgzfReader`.
+        num_reads: The number of random offsets to sample.
+        rng: A `numpy.random.RandomState`.
+
+    Returns:
+        A list of (sequence, quality string) tuples of bytes of the distinct
+        records sampled, in the order they are in the file.
+    """
+    rng = rng or np.random.RandomState()
+    size = _size(handle)
+    if not size:
+        return []
+    starts = set()
+    records = []
+    # sorted, so the file is read from start to end
+    for offset in np.sort(rng.randint(0, size, num_reads,
+                                      dtype=np.int64)).tolist():
+        start = fastq.find_record_start(handle, offset)
+        if start == size:  # after the last record, so wrap to the first one
+            start = fastq.find_record_start(handle, 0)
+        if start in starts:
+            continue
+        starts.add(start)
+        records.extend(fastq.read_records(handle, start + 1))
+
+    return records
+
+
+sample_records.__annotations__ = {'handle': BinaryIO, 'num_reads': int,
+                                  'rng': np.random.RandomState,
+                                  'return': List[Tuple[bytes, bytes]]}
+
+
+def sample_alignments(filename, num_reads, identity='nm', seed=None,
+                      sketch_k=DEFAULT_K):
+    """Collects a `utils.AlignmentSummary` from alignments sampled at random
+    virtual offsets in an indexed BAM file.
+
+    Args:
+        filename: Path to the BAM file. It must have a .bai index.
+        num_reads: The number of random offsets to sample. Offsets leading to
+        the same record count once, and unmapped, secondary and supplementary
+        alignments are sampled but left out of the summary, so there are
+        usually fewer reads in the summary.
+        identity: How to define percent identity, one of
+        `utils.IDENTITY_DEFINITIONS`.
+        seed: Seed for the random number generator.
+        sketch_k: The k of the quantile sketch, see `utils.AlignmentSummary`.
+
+    Returns:
+        A `utils.AlignmentSummary` of the sampled primary, mapped reads.
+    """
+    import pysam
+    rng = np.random.RandomState(seed)
+    summary = utils.AlignmentSummary(num_reads, identity, sketch_k)
+    summary.offset_sampled = True
+    starts, end = read_bai_offsets(_bai_path(filename))
+    if not len(starts):
+        return summary
+    with pysam.AlignmentFile(filename, 'rb') as samfile:
+        for record in _sample_alignment_records(samfile, starts, end,
+                                                num_reads, rng):
+            summary.add(record)
+
+    return summary
+
+
+sample_alignments.__annotations__ = {'filename': str, 'num_reads': int,
+                                     'identity': str, 'seed': int,
+                                     'sketch_k': int,
+                                     'return': utils.AlignmentSummary}
+
+
+def _sample_alignment_records(samfile, starts, end, num_reads, rng):
+    """Yield the distinct records after random virtual offsets. A random
+    virtual offset is a random compressed offset, which is in some block, and
+    a random position in that block's data. The offsets are visited in order,
+    seeking to the last known record start before each one unless it is
+    quicker to read on."""
+    first = int(starts[0])
+    blocks = rng.randint(first >> 16, max(end >> 16, (first >> 16) + 1),
+                         num_reads, dtype=np.int64)
+    positions = rng.randint(0, BGZF_BLOCK_DATA, num_reads)
+    order = np.lexsort((positions, blocks))
+    block_records = []  # the records of the last block at or before target
+    following = None  # the first record in a block after the target
+    seen = set()
+    for block, position in zip(blocks[order].tolist(),
+                               positions[order].tolist()):
+        start = int(starts[max(np.searchsorted(starts, block << 16) - 1, 0)])
+        if following is None or following[0] < start:
+            samfile.seek(start)
+            block_records = []
+            following = _next_record(samfile, end)
+        while following[1] is not None and following[0] >> 16 <= block:
+            if block_records and block_records[0][0] >> 16 != (
+                    following[0] >> 16):
+                block_records = []
+            block_records.append(following)
+            following = _next_record(samfile, end)
+        offset, record = next((found for found in block_records
+                               if found[0] & 0xffff >= position), following)
+        if record is None:  # after the last placed record, so wrap round
+            offset = first
+            samfile.seek(first)
+            record = next(samfile)
+            following = None
+        if offset not in seen:
+            seen.add(offset)
+            yield record
+
+
+def _next_record(samfile, end):
+    """Read the next record and its virtual offset. The record is None if
+    there are no more records placed on a contig."""
+    offset = samfile.tell()
+    record = next(samfile, None) if offset < end else None
+
+    return offset, record
+
+
+def read_bai_offsets(filename):
+    """Reads the virtual offsets of records throughout a BAM file from its
+    .bai index: the first record of each contig and the first record
+    overlapping each 16 kbp window of the linear index.
+
+    Args:
+        filename: Path to the .bai index.
+
+    Returns:
+        A tuple of a sorted array of the distinct virtual offsets of record
+        starts and the virtual offset of the end of the records placed on a
+        contig.
+
+    Raises:
+        ValueError: If the file isn't a BAM index.
+    """
+    with open(filename, 'rb') as handle:
+        data = handle.read()
+    if data[:4] != BAI_MAGIC:
+        raise ValueError("{} is not a BAM (.bai) index.".format(filename))
+    num_contigs = struct.unpack_from('<i', data, 4)[0]
+    position = 8
+    offsets = []
+    end = 0
+    for _ in range(num_contigs):
+        num_bins = struct.unpack_from('<i', data, position)[0]
+        position += 4
+        for _ in range(num_bins):
+            bin_number, num_chunks = struct.unpack_from('<Ii', data, position)
+            position += 8
+            if bin_number == BAI_PSEUDO_BIN:
+                # the start and end of the contig's records, then the number
+                # of mapped and unmapped reads
+                start, contig_end = struct.unpack_from('<QQ', data, position)
+                offsets.append(start)
+                end = max(end, contig_end)
+            position += 16 * num_chunks
+        num_windows = struct.unpack_from('<i', data, position)[0]
+        position += 4
+        offsets.extend(np.frombuffer(data, dtype='<u8', count=num_windows,
+                                     offset=position).tolist())
+        position += 8 * num_windows
+    # windows without any records have an offset of 0
+    offsets = np.unique(np.array(offsets, dtype=np.int64))
+    if not end:  # old indexes don't have the pseudo-bins
+        end = int(offsets.max()) + 1 if len(offsets) else 0
+
+    return offsets[(offsets > 0) & (offsets < end)], end
+
+
+read_bai_offsets.__annotations__ = {'filename': str,
+                                    'return': Tuple[np.ndarray, int]}
+
+
+def _bai_path(filename):
+    """The path of the .bai index of a BAM file, or None if it has none."""
+    for path in (filename + BAI_EXTENSION,
+                 os.path.splitext(filename)[0] + BAI_EXTENSION):
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def _size(handle):
+    """The size of the (uncompressed) data of a file handle."""
+    handle.seek(0, os.SEEK_END)
+    return handle.tell()
+
+
+def _open_fastq(filename):
+    """Open a fastq file for sampling: uncompressed files as they are, BGZF
+    files through their .gzi index."""
+    if fastq.is_gzipped(filename):
+        return BgzfReader(filename)
+    return open(filename, 'rb')
+
+
+class BgzfReader(object):
+    """A file-like object for reading the uncompressed data of a BGZF file
+    from any offset. The .gzi index of the file gives the block holding each
+    offset, and only the blocks that are read are decompressed.
+
+    Args:
+        filename: Path to the BGZF file.
+        index_filename: Path to the .gzi index. Defaults to the file name with
+        .gzi appended.
+
+    Attributes:
+        size: The number of bytes of uncompressed data.
+    """
+
+    def __init__(self, filename, index_filename=None):
+        index = np.fromfile(index_filename or filename + GZI_EXTENSION,
+                            dtype='<u8').astype(np.int64)
+        # the number of entries, then the compressed and uncompressed offset
+        # of the start of each block after the first
+        entries = index[1:1 + 2 * int(index[0])].reshape(-1, 2)
+        self._compressed = np.append(0, entries[:, 0])
+        self._uncompressed = np.append(0, entries[:, 1])
+        self._handle = open(filename, 'rb')
+        self._position = 0
+        self._data = b''  # the data of the current block
+        self._data_start = 0  # the uncompressed offset of the current block
+        self._next_block = 0  # the compressed offset of the next block
+        self.size = self._find_size()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the file."""
+        self._handle.close()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to an uncompressed offset, from the start or (with
+        `os.SEEK_END`) the end of the data."""
+        self._position = offset + (self.size if whence == os.SEEK_END else 0)
+
+    def tell(self):
+        """The current uncompressed offset."""
+        return self._position
+
+    def readline(self):
+        """Read up to and including the next newline, or to the end of the
+        data."""
+        parts = []
+        while self._move_to(self._position):
+            start = self._position - self._data_start
+            end = self._data.find(b'\n', start) + 1 or len(self._data)
+            parts.append(self._data[start:end])
+            self._position += end - start
+            if parts[-1].endswith(b'\n'):
+                break
+
+        return b''.join(parts)
+
+    def _move_to(self, position):
+        """Make the block holding an uncompressed offset the current block.
+        Returns False if the offset is past the end of the data."""
+        if position >= self.size:
+            return False
+        if not (self._data_start <= position <
+                self._data_start + len(self._data)):
+            if position != self._data_start + len(self._data):
+                # not in the next block, so look it up in the index
+                block = np.searchsorted(self._uncompressed, position,
+                                        side='right') - 1
+                self._data = b''
+                self._data_start = int(self._uncompressed[block])
+                self._next_block = int(self._compressed[block])
+            while self._data_start + len(self._data) <= position:
+                if not self._read_block():
+                    return False
+
+        return True
+
+    def _read_block(self):
+        """Decompress the next block, and make it the current block. Returns
+        False at the end of the file."""
+        self._handle.seek(self._next_block)
+        header = self._handle.read(pipeline.BGZF_HEADER_SIZE)
+        if not header:
+            return False
+        size = pipeline.bgzf_block_size(header, 0)
+        if size is None:
+            raise ValueError("Expected a BGZF block at compressed byte "
+                             "{}.".format(self._next_block))
+        data = pipeline.inflate_bgzf_block(
+            header + self._handle.read(size - len(header)))
+        self._data_start += len(self._data)
+        self._data = data
+        self._next_block += size
+
+        return True
+
+    def _find_size(self):
+        """Find the size of the uncompressed data, by decompressing the blocks
+        after the last one in the index."""
+        self._data_start = int(self._uncompressed[-1])
+        self._next_block = int(self._compressed[-1])
+        while self._read_block():
+            pass
+
+        return self._data_start + len(self._data)
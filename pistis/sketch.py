@@ -0,0 +1,284 @@
+"""This module contains a mergeable sketch of a distribution, from which
+quantiles (e.g the median read length) can be estimated to within a known
+error in constant memory, however many values are added.
+
+The sketch is the KLL sketch (Karnin, Lang and Liberty, 2016). Values are held
+in a hierarchy of compactors. When a compactor is full its values are sorted
+and every other one is promoted to the next compactor, where each value stands
+for twice as many of the original values.
+"""
+from __future__ import division
+from __future__ import absolute_import
+import math
+import random
+from typing import Dict, Iterable
+import numpy as np
+
+DEFAULT_K = 200  # for a rank error of about 1% (see `k_for_error`)
+CAPACITY_DECAY = 2 / 3  # how fast compactor capacity shrinks with depth
+MIN_CAPACITY = 2
+
+
+def k_for_error(error):
+    """Calculates the KLL `k` parameter needed for a given rank error.
+
+    Args:
+        error: The largest acceptable error in the rank of a quantile, as a
+        fraction of the number of values, e.g 0.01. This holds with a
+        probability of about 99%.
+
+    Returns:
+        The k to create a `KLLSketch` with.
+    """
+    return max(int(math.ceil(1.65 / error)), MIN_CAPACITY)
+
+
+k_for_error.__annotations__ = {'error': float, 'return': int}
+
+
+class KLLSketch(object):
+    """A quantile sketch of a stream of numbers.
+
+    Args:
+        k: The capacity of the largest compactor. Larger k gives a smaller
+        error, at the cost of memory. See `k_for_error`.
+        rng: A `random.Random` instance to draw from. Defaults to a new,
+        unseeded instance.
+
+    Attributes:
+        count: The number of values added.
+        total: The sum of the values added.
+        min: The smallest value added.
+        max: The largest value added.
+    """
+
+    def __init__(self, k=DEFAULT_K, rng=None):
+        self.k = k
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._levels = [np.empty(0)]
+        self._pending = []
+        self._rng = rng or random.Random()
+
+    def add(self, values):
+        """Add an array of values to the sketch. Non-finite values are ignored.
+
+        Args:
+            values: An array of numbers.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._insert(values)
+
+    def add_value(self, value):
+        """Add a single value to the sketch. Values are buffered, so this is
+        cheap to call once per read.
+
+        Args:
+            value: A number.
+        """
+        if math.isnan(value) or math.isinf(value):
+            return
+        # the counters are kept up to date, only the values are buffered
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._pending.append(value)
+        if len(self._pending) >= self.k:
+            self._flush()
+
+    def merge(self, other):
+        """Merge another sketch into this one, as if its values had been added
+        to this one. Sketches with different k can be merged, keeping the k of
+        this one.
+
+        Args:
+            other: The `KLLSketch` to merge into this one.
+        """
+        self._flush()
+        other._flush()
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for level, values in enumerate(other._levels):
+            if level == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[level] = np.concatenate([self._levels[level],
+                                                  values])
+        self._compress()
+
+    def quantiles(self, fractions):
+        """Estimates the quantiles of the values added.
+
+        Args:
+            fractions: The quantiles to estimate, as fractions in [0, 1], e.g
+            0.5 for the median.
+
+        Returns:
+            An array of the value at each quantile, or NaN if the sketch is
+            empty.
+        """
+        fractions = np.asarray(fractions, dtype=float)
+        values, weights = self.weighted_values()
+        if not len(values):
+            return np.full(fractions.shape, np.nan)
+        ranks = np.cumsum(weights)
+        idx = np.searchsorted(ranks, fractions * ranks[-1], side='left')
+        estimates = values[np.minimum(idx, len(values) - 1)]
+        # the extremes are known exactly
+        estimates = np.where(fractions <= 0, self.min, estimates)
+
+        return np.where(fractions >= 1, self.max, estimates)
+
+    def quantile(self, fraction):
+        """Estimates a single quantile of the values added, see `quantiles`."""
+        return float(self.quantiles([fraction])[0])
+
+    def mean(self):
+        """The (exact) mean of the values added, or NaN if there are none."""
+        self._flush()
+        return self.total / self.count if self.count else float('nan')
+
+    def weighted_values(self):
+        """The values held in the sketch, sorted, with the number of added
+        values each stands for.
+
+        Returns:
+            A tuple of the sorted values and their weights.
+        """
+        self._flush()
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(level_values), 2.0 ** level)
+                                  for level, level_values in
+                                  enumerate(self._levels)])
+        order = np.argsort(values, kind='mergesort')
+
+        return values[order], weights[order]
+
+    def to_arrays(self):
+        """The sketch as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the values of every compactor concatenated, the
+            number of values in each compactor and the counters.
+        """
+        self._flush()
+        return {'values': np.concatenate(self._levels),
+                'level_sizes': np.array([len(values)
+                                         for values in self._levels]),
+                'state': np.array([self.k, self.count]),
+                'stats': np.array([self.total, self.min, self.max])}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a sketch from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `KLLSketch`.
+        """
+        k, count = (int(value) for value in arrays['state'])
+        sketch = cls(k)
+        sketch.count = count
+        sketch.total, sketch.min, sketch.max = (
+            float(value) for value in arrays['stats'])
+        boundaries = np.cumsum(arrays['level_sizes'])[:-1]
+        sketch._levels = [np.array(values) for values in
+                          np.split(arrays['values'], boundaries)]
+
+        return sketch
+
+    def _flush(self):
+        """Add the values buffered by `add_value`."""
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            self._insert(np.array(pending, dtype=float))
+
+    def _insert(self, values):
+        """Add values to the first compactor, without updating the
+        counters."""
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(int(math.ceil(self.k * CAPACITY_DECAY ** depth)),
+                   MIN_CAPACITY)
+
+    def _compress(self):
+        """Compact full compactors until the sketch is within its capacity."""
+        while (sum(len(values) for values in self._levels) >
+               sum(self._capacity(level)
+                   for level in range(len(self._levels)))):
+            level = next(level for level, values in enumerate(self._levels)
+                         if len(values) >= self._capacity(level))
+            if level == len(self._levels) - 1:
+                self._levels.append(np.empty(0))
+            values = np.sort(self._levels[level])
+            # an odd one out stays behind
+            keep = values[:len(values) % 2]
+            values = values[len(values) % 2:]
+            promoted = values[self._rng.randrange(2)::2]
+            self._levels[level] = keep
+            self._levels[level + 1] = np.concatenate([self._levels[level + 1],
+                                                      promoted])
+
+
+def n50(lengths):
+    """Estimates the N50 of a set of reads from a sketch of their lengths: the
+    length such that reads at least that long hold half of all bases.
+
+    Args:
+        lengths: A `KLLSketch` of read lengths.
+
+    Returns:
+        The N50, or NaN if the sketch is empty.
+    """
+    values, weights = lengths.weighted_values()
+    if not len(values):
+        return float('nan')
+    bases = np.cumsum((values * weights)[::-1])
+    idx = int(np.searchsorted(bases, bases[-1] / 2, side='left'))
+
+    return float(values[::-1][idx])
+
+
+n50.__annotations__ = {'lengths': KLLSketch, 'return': float}
+
+
+def describe(sketch, fractions=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """Summarise the distribution in a sketch.
+
+    Args:
+        sketch: A `KLLSketch`.
+        fractions: The quantiles to include.
+
+    Returns:
+        A dictionary with the count, mean, min, max and each quantile (with
+        keys like 'p50').
+    """
+    summary = {'count': sketch.count, 'mean': sketch.mean(),
+               'min': sketch.min if sketch.count else float('nan'),
+               'max': sketch.max if sketch.count else float('nan')}
+    for fraction, value in zip(fractions, sketch.quantiles(fractions)):
+        summary['p{:g}'.format(100 * fraction)] = float(value)
+
+    return summary
+
+
+describe.__annotations__ = {'sketch': KLLSketch,
+                            'fractions': Iterable[float],
+                            'return': Dict[str, float]}
@@ -0,0 +1,108 @@
+"""This module contains functions for saving the data collected from fastq and
+SAM/BAM files to a compact binary summary file, and for loading (and merging)
+them again. This allows the plots to be regenerated without re-reading the
+sequencing files.
+
+The summary is a (compressed) numpy `.npz` archive.
+"""
+from __future__ import absolute_import
+from typing import Tuple, Iterable
+import numpy as np
+from pistis import utils
+
+STATS_FORMAT_VERSION = 1
+
+
+def save_stats(filename, fastq_summary=None, alignment_summary=None):
+    """Saves collected summaries to a binary summary file.
+
+    Args:
+        filename: The path to save the summary to.
+        fastq_summary: A `utils.FastqSummary` to save, if any.
+        alignment_summary: A `utils.AlignmentSummary` to save, if any.
+    """
+    arrays = {'format_version': np.array(STATS_FORMAT_VERSION)}
+    if fastq_summary is not None:
+        arrays.update(utils.nest_arrays('fastq', fastq_summary.to_arrays()))
+    if alignment_summary is not None:
+        arrays.update(utils.nest_arrays('bam', alignment_summary.to_arrays()))
+
+    # write via a handle so numpy doesn't append .npz to the filename
+    with open(filename, 'wb') as handle:
+        np.savez_compressed(handle, **arrays)
+
+
+save_stats.__annotations__ = {'filename': str,
+                              'fastq_summary': utils.FastqSummary,
+                              'alignment_summary': utils.AlignmentSummary,
+                              'return': None}
+
+
+def load_stats(filename):
+    """Loads the summaries saved in a binary summary file.
+
+    Args:
+        filename: Path to a summary file written by `save_stats`.
+
+    Returns:
+        A tuple of the `utils.FastqSummary` and `utils.AlignmentSummary` in the
+        file. Either is None if it was not saved.
+
+    Raises:
+        ValueError: If the file was written with an unsupported format version.
+    """
+    with np.load(filename, allow_pickle=False) as archive:
+        arrays = {key: archive[key] for key in archive.files}
+
+    version = int(arrays.pop('format_version', -1))
+    if version != STATS_FORMAT_VERSION:
+        raise ValueError("{} has summary format version {}, but only version "
+                         "{} is supported.".format(filename, version,
+                                                   STATS_FORMAT_VERSION))
+
+    fastq_arrays = utils.unnest_arrays('fastq', arrays)
+    alignment_arrays = utils.unnest_arrays('bam', arrays)
+    fastq_summary = (utils.FastqSummary.from_arrays(fastq_arrays)
+                     if fastq_arrays else None)
+    alignment_summary = (utils.AlignmentSummary.from_arrays(alignment_arrays)
+                         if alignment_arrays else None)
+
+    return fastq_summary, alignment_summary
+
+
+load_stats.__annotations__ = {'filename': str,
+                              'return': Tuple[utils.FastqSummary,
+                                              utils.AlignmentSummary]}
+
+
+def merge_stats(filenames):
+    """Loads and merges the summaries saved in several binary summary files,
+    e.g from separate fastq files of the same sample.
+
+    Args:
+        filenames: Paths to summary files written by `save_stats`.
+
+    Returns:
+        A tuple of the merged `utils.FastqSummary` and `utils.AlignmentSummary`
+        from all files. Either is None if none of the files contain it.
+
+    Raises:
+        ValueError: If the summaries were collected with different
+        down-sampling.
+    """
+    merged = [None, None]
+    for filename in filenames:
+        for i, summary in enumerate(load_stats(filename)):
+            if summary is None:
+                continue
+            if merged[i] is None:
+                merged[i] = summary
+                continue
+            merged[i].merge(summary)
+
+    return tuple(merged)
+
+
+merge_stats.__annotations__ = {'filenames': Iterable[str],
+                               'return': Tuple[utils.FastqSummary,
+                                               utils.AlignmentSummary]}
@@ -4,25 +4,1580 @@ formats required to produce the quality plots for `pistis`.
 from __future__ import division
 from __future__ import absolute_import
 import os
-import re
-import pysam
+import math
 import random
+from collections import OrderedDict
 from typing import List, Tuple, Iterable, NewType, Dict
-from collections import OrderedDict, Counter
 import numpy as np
 from six.moves import zip
+from pistis.sketch import KLLSketch, DEFAULT_K
 
-Sam = NewType('Sam', pysam.AlignedSegment)
+# a pysam.AlignedSegment. pysam is only imported when alignments are read, to
+# keep start up fast
+Sam = NewType('Sam', object)
 
 BIN_NAMES = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11-20',
              '21-50', '51-100', '101-200', '201-300']
 BIN_STARTS = np.append(np.arange(11), np.array([21, 51, 101, 201, 301]))
+PHRED_RANGE = 94  # Phred quality scores 0-93, i.e. ASCII 33-126 in a fastq
+PHRED_OFFSET = 33
+BATCH_BASES = 2 ** 22  # number of bases to pack into a batch of reads
+# a PositionProfile has a bucket for each of the first 2 ** PROFILE_EXACT_BITS
+# positions, then 2 ** PROFILE_BUCKET_BITS buckets each time position doubles
+PROFILE_EXACT_BITS = 10
+PROFILE_BUCKET_BITS = 7
+# the ways of binning a PositionProfile for the plots, see PositionProfile.bins
+POSITION_BINNINGS = ('default', 'linear', 'log', 'all')
+RELATIVE_BINS = 20  # bins of RelativeQualities, each 5% of the read
+# the columns of a ReadTable and their types, then the columns only stored
+# once values are given for them
+READ_COLUMNS = (('gc_content', np.float32), ('length', np.uint32),
+                ('mean_quality', np.float32))
+OPTIONAL_READ_COLUMNS = (('id_hash', np.uint32), ('channel', np.uint16),
+                         ('start_time', np.uint32))
+# the FastqSummary attributes holding a sketch of a per-read metric
+SKETCHED_READ_METRICS = ('length_sketch', 'quality_sketch', 'gc_sketch')
+# the FastqSummary attributes only collected with profiles=True
+PROFILES = ('profile_from_start', 'profile_from_end', 'relative_qualities')
+
+# the bases counted as GC, and ignored, by gc_content, plus lookup tables of
+# them for gc_content_batch
+GC_BASES = b'cCgGsS'
+N_BASES = b'nN'
+GC_TABLE = np.zeros(256, dtype=np.uint8)
+GC_TABLE[bytearray(GC_BASES)] = 1
+N_TABLE = np.zeros(256, dtype=np.uint8)
+N_TABLE[bytearray(N_BASES)] = 1
+
+# the ways of defining the percent identity of an alignment, see
+# get_percent_identities
+IDENTITY_DEFINITIONS = ('nm', 'blast', 'gap_compressed')
+# indices into the arrays from pysam's AlignedSegment.get_cigar_stats
+CIGAR_MATCH, CIGAR_INS, CIGAR_DEL, CIGAR_EQUAL, CIGAR_DIFF = 0, 1, 2, 7, 8
+CIGAR_STATS_NM = 10  # the NM tag, or 0 if there isn't one
+# the characters of an MD tag that aren't reference bases
+MD_NON_BASES = b'0123456789^'
+
+
+class Reservoir(object):
+    """A uniform random sample of fixed size from a stream of unknown length.
+
+    Items are sampled in a single pass using Algorithm L (Li, 1994), so memory
+    is bounded by the sample size and only the items that enter the sample
+    cost any work beyond a counter increment.
+
+    Args:
+        size: The maximum number of items to keep. Set to 0 to keep every item.
+        rng: A `random.Random` instance to draw from. Defaults to a new,
+        unseeded instance.
+        items: The (empty) container to keep the sample in, e.g a `ReadTable`.
+        It must support `len`, `extend`, slicing and `take`. Defaults to a
+        list.
+
+    Attributes:
+        items: The current sample.
+        seen: The number of items offered to the reservoir so far.
+    """
+
+    def __init__(self, size=0, rng=None, items=None):
+        self.size = size
+        self.items = [] if items is None else items
+        self.seen = 0
+        self._rng = rng or random.Random()
+        self._log_w = 0.0
+        self._next = 0
+
+    def add(self, item):
+        """Offer a single item to the reservoir.
+
+        Args:
+            item: The item to (possibly) sample.
+        """
+        self.extend((item,))
+
+    def extend(self, items):
+        """Offer a sequence of items to the reservoir, in order.
+
+        Args:
+            items: A sliceable sequence (list, tuple, array, `ReadTable` etc.)
+            of items.
+        """
+        offset = self.seen
+        total = len(items)
+        self.seen += total
+        if self.size <= 0:
+            self.items.extend(items)
+            return
+
+        # fill the reservoir before any replacement happens
+        fill = min(max(self.size - offset, 0), total)
+        if fill:
+            self.items.extend(items if fill == total else items[:fill])
+        if len(self.items) < self.size:
+            return
+        if fill:
+            self._next = self.size - 1
+            self._skip()
+
+        # the index of the item to put in each slot, applied together at the
+        # end, so that columnar containers are updated in one go
+        replacements = {}
+        while self._next < self.seen:
+            replacements[self._rng.randrange(self.size)] = self._next - offset
+            self._skip()
+        if replacements:
+            _put(self.items, list(replacements.keys()),
+                 _take(items, list(replacements.values())))
+
+    def merge(self, other):
+        """Merge in the reservoir of another, disjoint, stream. The result is
+        a uniform sample of both streams combined, as if they had been offered
+        to this reservoir one after the other.
+
+        Args:
+            other: A `Reservoir` of the same size, or one that holds every item
+            offered to it.
+
+        Raises:
+            ValueError: If other is a sample of a different size.
+        """
+        if len(other.items) == other.seen:  # other holds its entire stream
+            self.extend(other.items)
+            return
+        if self.size != other.size:
+            raise ValueError("Cannot merge reservoirs of size {} and "
+                             "{}.".format(self.size, other.size))
+        if len(self.items) == self.seen:
+            own_items = self.items
+            self.items = other.items[:]
+            self.seen = other.seen
+            self._log_w = other._log_w
+            self._next = other._next
+            self.extend(own_items)
+            return
+
+        # draw the number of items to keep from each sample without
+        # replacement, in proportion to the size of the stream it represents
+        remaining = [self.seen, other.seen]
+        taken = [0, 0]
+        for _ in range(self.size):
+            pick = int(self._rng.random() * sum(remaining) >= remaining[0])
+            remaining[pick] -= 1
+            taken[pick] += 1
+        items = _take(self.items,
+                      self._rng.sample(range(len(self.items)), taken[0]))
+        items.extend(_take(other.items,
+                           self._rng.sample(range(len(other.items)),
+                                            taken[1])))
+        self.items = items
+        self.seen += other.seen
+        # W is the k-th smallest of n uniform keys, i.e Beta(k, n - k + 1)
+        weight = self._rng.betavariate(self.size, self.seen - self.size + 1)
+        self._log_w = math.log(weight)
+        self._next = self.seen - 1
+        self._skip(update_weight=False)
+
+    def to_arrays(self):
+        """The reservoir as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the sampled items and the sampling state. Items
+            kept in a container with a `to_arrays` method (e.g a `ReadTable`)
+            are saved by it, nested under 'items'.
+        """
+        if hasattr(self.items, 'to_arrays'):
+            arrays = nest_arrays('items', self.items.to_arrays())
+        else:
+            arrays = {'items': np.array(self.items, dtype=float)}
+        arrays.update({'state': np.array([self.size, self.seen, self._next],
+                                         dtype=np.int64),
+                       'log_w': np.array(self._log_w)})
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, item_type=float, container=None):
+        """Create a reservoir from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+            item_type: A function to convert each element of the items array
+            back into an item.
+            container: The class of the container the items were kept in, if
+            it saved them itself, e.g `ReadTable`.
+
+        Returns:
+            A `Reservoir` that continues sampling where the saved one left off.
+        """
+        size, seen, next_index = (int(value) for value in arrays['state'])
+        reservoir = cls(size)
+        if container is not None:
+            reservoir.items = container.from_arrays(unnest_arrays('items',
+                                                                  arrays))
+        else:
+            reservoir.items = [item_type(item) for item in arrays['items']]
+        reservoir.seen = seen
+        reservoir._next = next_index
+        reservoir._log_w = float(arrays['log_w'])
+
+        return reservoir
+
+    def _skip(self, update_weight=True):
+        """Advance to the index of the next item that will enter the sample."""
+        if update_weight:
+            self._log_w += math.log(self._random()) / self.size
+        # -expm1(log W) is 1 - W without losing precision when W is near 1
+        gap = math.log(self._random()) / math.log(-math.expm1(self._log_w))
+        self._next += int(math.floor(gap)) + 1
+
+    def _random(self):
+        """A uniform random number on the open interval (0, 1)."""
+        value = 0.0
+        while value == 0.0:
+            value = self._rng.random()
+        return value
+
+
+def _take(items, indices):
+    """The items at a list of indices, from a list or from a container with a
+    `take` method, e.g a `ReadTable`."""
+    if hasattr(items, 'take'):
+        return items.take(indices)
+    return [items[i] for i in indices]
+
+
+def _put(items, indices, values):
+    """Replace the items at a list of indices, in a list or in a container
+    with a `put` method, e.g a `ReadTable`."""
+    if hasattr(items, 'put'):
+        items.put(indices, values)
+        return
+    for i, value in zip(indices, values):
+        items[i] = value
+
+
+class ReadTable(object):
+    """The per-read metrics of a set of reads, held column by column in typed
+    arrays rather than as a list of tuples of Python numbers. A read takes 12
+    bytes (plus the optional columns, when they are used), rather than over
+    100, and the columns can be plotted without being converted.
+
+    The table grows like a list: the arrays are over-allocated, so adding
+    reads one batch at a time takes amortised constant time per read. A row of
+    the table is a (GC content, length, mean quality) tuple, so the table can
+    stand in for a list of those, e.g as the items of a `Reservoir`.
+
+    Args:
+        capacity: The number of reads to allocate space for up front.
+
+    Attributes:
+        gc_content: A float32 array of the GC content (%) of each read.
+        length: A uint32 array of the length of each read.
+        mean_quality: A float32 array of the mean quality score of each read.
+        The optional columns `OPTIONAL_READ_COLUMNS` (e.g channel) are None
+        unless values are given for them.
+    """
+
+    def __init__(self, capacity=0):
+        self._size = 0
+        self._columns = OrderedDict((name, np.zeros(capacity, dtype=dtype))
+                                    for name, dtype in READ_COLUMNS)
+
+    @classmethod
+    def from_columns(cls, gc_content, length, mean_quality, **optional):
+        """Create a table from arrays of the metrics of each read.
+
+        Args:
+            gc_content: The GC content (%) of each read.
+            length: The length of each read.
+            mean_quality: The mean quality score of each read.
+            **optional: Arrays for any of the `OPTIONAL_READ_COLUMNS`, e.g
+            `channel`.
+
+        Returns:
+            A `ReadTable` of the reads.
+
+        Raises:
+            ValueError: For a column that isn't one of `READ_COLUMNS` or
+            `OPTIONAL_READ_COLUMNS`.
+        """
+        dtypes = dict(READ_COLUMNS + OPTIONAL_READ_COLUMNS)
+        unknown = set(optional) - set(dtypes)
+        if unknown:
+            raise ValueError("Unknown read columns: {}.".format(
+                ', '.join(sorted(unknown))))
+        columns = dict(optional, gc_content=gc_content, length=length,
+                       mean_quality=mean_quality)
+        table = cls()
+        table._columns = OrderedDict(
+            (name, np.array(columns[name], dtype=dtypes[name]))
+            for name, _ in READ_COLUMNS + OPTIONAL_READ_COLUMNS
+            if name in columns)
+        table._size = len(table._columns['length'])
+
+        return table
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a table from (GC content, length, mean quality) rows.
+
+        Args:
+            rows: A sequence of rows, or a two-dimensional array.
+
+        Returns:
+            A `ReadTable` of the reads.
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(READ_COLUMNS))
+        return cls.from_columns(*rows.T)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(self._size)))
+        if not -self._size <= index < self._size:
+            raise IndexError("ReadTable index out of range.")
+        index %= self._size
+        return (float(self._columns['gc_content'][index]),
+                int(self._columns['length'][index]),
+                float(self._columns['mean_quality'][index]))
+
+    def __setitem__(self, index, row):
+        self.put([index], [row])
+
+    def __iter__(self):
+        return zip(self.gc_content.tolist(), self.length.tolist(),
+                   self.mean_quality.tolist())
+
+    def __eq__(self, other):
+        if not isinstance(other, ReadTable):
+            return list(self) == list(other)
+        return (list(self._columns) == list(other._columns) and
+                all((self.column(name) == other.column(name)).all()
+                    for name in self._columns))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        # only the filled rows are pickled, e.g to send to another process
+        return self.to_arrays()
+
+    def __setstate__(self, state):
+        self.__dict__.update(ReadTable.from_arrays(state).__dict__)
+
+    @property
+    def gc_content(self):
+        """The GC content (%) of each read."""
+        return self.column('gc_content')
+
+    @property
+    def length(self):
+        """The length of each read."""
+        return self.column('length')
+
+    @property
+    def mean_quality(self):
+        """The mean quality score of each read."""
+        return self.column('mean_quality')
+
+    @property
+    def nbytes(self):
+        """The memory taken by the filled rows of the columns, in bytes."""
+        return sum(column[:self._size].nbytes
+                   for column in self._columns.values())
+
+    def column(self, name):
+        """The values of a column for each read.
+
+        Args:
+            name: One of `READ_COLUMNS` or `OPTIONAL_READ_COLUMNS`.
+
+        Returns:
+            An array (a view, not a copy) of the values, or None for an
+            optional column that isn't used.
+        """
+        if name not in self._columns:
+            return None
+        return self._columns[name][:self._size]
+
+    def extend(self, rows):
+        """Add reads to the end of the table.
+
+        Args:
+            rows: A `ReadTable`, or a sequence of (GC content, length, mean
+            quality) rows.
+        """
+        if not isinstance(rows, ReadTable):
+            rows = ReadTable.from_rows(list(rows))
+        start = self._size
+        self._reserve(start + len(rows), rows._columns)
+        self._size += len(rows)
+        for name, column in self._columns.items():
+            values = rows.column(name)
+            column[start:self._size] = 0 if values is None else values
+
+    def take(self, indices):
+        """Get the reads at a list of indices.
+
+        Args:
+            indices: The indices of the reads.
+
+        Returns:
+            A new `ReadTable` of the reads.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        table = ReadTable()
+        table._columns = OrderedDict((name, column[:self._size][indices])
+                                     for name, column in self._columns.items())
+        table._size = len(indices)
+
+        return table
+
+    def put(self, indices, rows):
+        """Replace the reads at a list of indices.
+
+        Args:
+            indices: The indices of the reads to replace.
+            rows: A `ReadTable`, or a sequence of (GC content, length, mean
+            quality) rows, of the reads to put at each index.
+        """
+        if not isinstance(rows, ReadTable):
+            rows = ReadTable.from_rows(list(rows))
+        self._reserve(self._size, rows._columns)
+        indices = np.asarray(indices, dtype=np.intp) % max(self._size, 1)
+        for name, column in self._columns.items():
+            values = rows.column(name)
+            column[indices] = 0 if values is None else values
+
+    def to_arrays(self):
+        """The table as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with an array for each column that is used.
+        """
+        return {name: self.column(name) for name in self._columns}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a table from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `ReadTable` of the saved reads.
+        """
+        return cls.from_columns(**arrays)
+
+    def _reserve(self, size, columns=()):
+        """Make room for size reads, and add any of the given columns that the
+        table doesn't have yet (filled with zeros)."""
+        capacity = len(self._columns['length'])
+        if size > capacity:
+            capacity = max(size, 2 * capacity)
+        dtypes = dict(READ_COLUMNS + OPTIONAL_READ_COLUMNS)
+        names = [name for name, _ in READ_COLUMNS + OPTIONAL_READ_COLUMNS
+                 if name in self._columns or name in columns]
+        for name in names:
+            column = self._columns.get(name)
+            if column is None or len(column) != capacity:
+                grown = np.zeros(capacity, dtype=dtypes[name])
+                if column is not None:
+                    grown[:self._size] = column[:self._size]
+                self._columns[name] = grown
+        self._columns = OrderedDict((name, self._columns[name])
+                                    for name in names)
+
+
+class PositionalQualities(object):
+    """Counts of each Phred quality score within positional bins of reads.
+
+    Rather than holding every quality score, each bin holds a histogram over
+    the Phred range, so memory is constant regardless of the number of reads
+    and box plot statistics can be computed exactly from the counts.
+
+    Args:
+        names: The name of each positional bin.
+        starts: The 0-based start position of each bin, plus the end of the
+        last bin, i.e. `len(starts) == len(names) + 1`.
+
+    Attributes:
+        counts: An integer matrix of shape (number of bins, `PHRED_RANGE`)
+        where element (i, q) is the number of bases in bin i with quality q.
+    """
+
+    def __init__(self, names=BIN_NAMES, starts=BIN_STARTS):
+        self.names = list(names)
+        self.starts = np.asarray(starts)
+        self.counts = np.zeros((len(self.names), PHRED_RANGE), dtype=np.int64)
+        # map each position covered by the bins to the index of its bin
+        self._position_bins = np.repeat(np.arange(len(self.names)),
+                                        np.diff(self.starts))
+
+    def __getitem__(self, name):
+        return self.counts[self.names.index(name)]
+
+    def keys(self):
+        """The bin names, in order."""
+        return list(self.names)
+
+    def add(self, q_scores):
+        """Add the quality scores of a read to the bins.
+
+        Args:
+            q_scores: Quality scores for a read, ordered from the position the
+            bins are anchored to. i.e reversed when binning from the end.
+        """
+        q_scores = np.asarray(q_scores, dtype=np.uint8)
+        self.add_batch(q_scores, np.array([0, len(q_scores)]))
+
+    def add_batch(self, qualities, offsets, from_end=False):
+        """Add the quality scores of a batch of reads to the bins.
+
+        Args:
+            qualities: The quality scores of all reads, concatenated into a
+            single uint8 array.
+            offsets: Array of read boundaries in `qualities`, such that read i
+            is `qualities[offsets[i]:offsets[i + 1]]`.
+            from_end: Anchor the bins at the end, rather than the start, of
+            each read.
+        """
+        n_positions = len(self._position_bins)
+        lengths = np.diff(offsets)
+        steps = np.arange(n_positions)
+        # only the positions covered by the bins are gathered from each read
+        covered = steps < lengths[:, np.newaxis]
+        if from_end:
+            idx = offsets[1:, np.newaxis] - 1 - steps
+        else:
+            idx = offsets[:-1, np.newaxis] + steps
+        q_scores = np.minimum(qualities[idx[covered]], PHRED_RANGE - 1)
+        bins = np.broadcast_to(self._position_bins, covered.shape)[covered]
+        self.counts += np.bincount(
+            bins * PHRED_RANGE + q_scores,
+            minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of another `PositionalQualities` with the same bins.
+
+        Args:
+            other: The `PositionalQualities` to merge into this one.
+
+        Raises:
+            ValueError: If the bins of the two are not the same.
+        """
+        if self.names != other.names:
+            raise ValueError("Cannot merge positional qualities with "
+                             "different bins.")
+        self.counts += other.counts
+
+    def to_arrays(self):
+        """The bins as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the bin names, starts and counts.
+        """
+        return {'names': np.array(self.names), 'starts': self.starts,
+                'counts': self.counts}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create positional bins from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `PositionalQualities` with the saved counts.
+        """
+        bins = cls(names=[str(name) for name in arrays['names']],
+                   starts=arrays['starts'])
+        bins.counts[:] = arrays['counts']
+
+        return bins
+
+    def boxplot_stats(self, whis=1.5):
+        """Box plot statistics for each bin, computed exactly from the counts.
+
+        Quartiles are linearly interpolated and whiskers extend to the most
+        extreme score within `whis` times the interquartile range, as for
+        `matplotlib.cbook.boxplot_stats`.
+
+        Args:
+            whis: The reach of the whiskers, as a multiple of the IQR.
+
+        Returns:
+            A list with a dictionary per bin, in the format expected by
+            `matplotlib.axes.Axes.bxp`.
+        """
+        stats = []
+        scores = np.arange(PHRED_RANGE)
+        for name, counts in zip(self.names, self.counts):
+            total = counts.sum()
+            if not total:
+                stats.append(dict(label=name, med=np.nan, q1=np.nan,
+                                  q3=np.nan, whislo=np.nan, whishi=np.nan,
+                                  mean=np.nan, fliers=np.array([])))
+                continue
+            q1, med, q3 = (_percentile_from_counts(counts, pct)
+                           for pct in (25, 50, 75))
+            iqr = q3 - q1
+            present = scores[counts > 0]
+            within = present[(present >= q1 - whis * iqr) &
+                             (present <= q3 + whis * iqr)]
+            # the whiskers never end inside the box
+            whislo = min(within.min(), q1) if len(within) else q1
+            whishi = max(within.max(), q3) if len(within) else q3
+            stats.append(dict(label=name, med=med, q1=q1, q3=q3,
+                              whislo=whislo, whishi=whishi,
+                              mean=(scores * counts).sum() / total,
+                              fliers=present[(present < whislo) |
+                                             (present > whishi)]))
+
+        return stats
+
+
+class RelativeQualities(PositionalQualities):
+    """Counts of each Phred quality score within bins of relative position
+    along the reads, e.g the first 5% of each read, so that reads of every
+    length contribute to each bin.
+
+    Args:
+        bins: The number of bins, of equal width.
+
+    Attributes:
+        counts: An integer matrix of shape (bins, `PHRED_RANGE`) where element
+        (i, q) is the number of bases in bin i with quality q.
+    """
+
+    def __init__(self, bins=RELATIVE_BINS):
+        percents = np.linspace(0, 100, bins + 1)
+        names = ['{:g}-{:g}%'.format(start, end)
+                 for start, end in zip(percents[:-1], percents[1:])]
+        super(RelativeQualities, self).__init__(names, np.arange(bins + 1))
+
+    def add_batch(self, qualities, offsets, from_end=False):
+        """Add the quality scores of a batch of reads to the bins.
+
+        Args:
+            qualities: The quality scores of all reads, concatenated into a
+            single uint8 array.
+            offsets: Array of read boundaries in `qualities`, such that read i
+            is `qualities[offsets[i]:offsets[i + 1]]`.
+            from_end: Measure the position from the end, rather than the
+            start, of each read.
+        """
+        keys = _batch_qualities(qualities, offsets).astype(np.int32)
+        keys += self._bin_keys(offsets, from_end)
+        self.counts += np.bincount(
+            keys, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def _bin_keys(self, offsets, from_end):
+        """The bin of each base times `PHRED_RANGE`. Rather than dividing the
+        position of every base by the length of its read, the first base of
+        each bin is marked and the marks are added up along the reads."""
+        if from_end:
+            # the bins from the end of the reads are the bins from the start
+            # of the reversed batch
+            return self._bin_keys(offsets[-1] - offsets[::-1], False)[::-1]
+        bins = len(self.names)
+        lengths = np.diff(offsets)
+        read_starts = offsets[:-1] - offsets[0]
+        # base p of a read of length L is in bin k if k <= p * bins / L
+        firsts = read_starts[:, np.newaxis] - (
+            -lengths[:, np.newaxis] * np.arange(1, bins) // bins)
+        marks = np.zeros(offsets[-1] - offsets[0] + 1, dtype=np.int32)
+        np.add.at(marks, firsts.ravel(), PHRED_RANGE)
+        marks[read_starts[1:]] -= (bins - 1) * PHRED_RANGE
+
+        return np.cumsum(marks[:-1], dtype=np.int32)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create relative bins from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `RelativeQualities` with the saved counts.
+        """
+        bins = cls(len(arrays['names']))
+        bins.counts[:] = arrays['counts']
+
+        return bins
+
+
+class PositionProfile(object):
+    """Counts of each Phred quality score at every position along the reads,
+    from their start or their end, however long the reads are.
+
+    The first 2 ** `PROFILE_EXACT_BITS` positions each have a bucket of their
+    own. After that, each time the position doubles the buckets double in
+    width, with 2 ** `PROFILE_BUCKET_BITS` buckets between each doubling, so a
+    bucket is never wider than 1% of its position. Buckets are only added as
+    longer reads are seen, and a megabase read needs under 2,500 of them.
+    `bins` groups the buckets into bins for plotting.
+
+    Args:
+        from_end: Count positions from the end, rather than the start, of each
+        read.
+
+    Attributes:
+        counts: An integer matrix of shape (buckets, `PHRED_RANGE`) where
+        element (i, q) is the number of bases in bucket i with quality q.
+        max_length: The length of the longest read.
+    """
+
+    def __init__(self, from_end=False):
+        self.from_end = from_end
+        self.counts = np.zeros((0, PHRED_RANGE), dtype=np.int64)
+        self.max_length = 0
+        self._bucket_keys = np.zeros(0, dtype=np.int64)
+
+    @property
+    def starts(self):
+        """The 0-based first position of each bucket, plus the end of the
+        last bucket."""
+        return bucket_starts(len(self.counts) + 1)
+
+    def add_batch(self, qualities, offsets):
+        """Add the quality scores of a batch of reads.
+
+        Args:
+            qualities: The quality scores of all reads, concatenated into a
+            single uint8 array.
+            offsets: Array of read boundaries in `qualities`, such that read i
+            is `qualities[offsets[i]:offsets[i + 1]]`.
+        """
+        if offsets[-1] == offsets[0]:
+            return
+        self._add_positions(_batch_qualities(qualities, offsets),
+                            _read_positions(offsets, self.from_end),
+                            int(np.diff(offsets).max()))
+
+    def _add_positions(self, q_scores, positions, max_length):
+        """Count quality scores given the position of each base, counted from
+        the end the profile is anchored to."""
+        if len(self._bucket_keys) < max_length:
+            # looking up the bucket of each position is far quicker than
+            # working it out for every base
+            self._bucket_keys = position_buckets(
+                np.arange(max(max_length, 2 * len(self._bucket_keys)))
+            ) * PHRED_RANGE
+        num_buckets = int(position_buckets(max_length - 1)) + 1
+        self._grow(num_buckets, max_length)
+        self.counts[:num_buckets] += np.bincount(
+            self._bucket_keys[positions] + q_scores,
+            minlength=num_buckets * PHRED_RANGE).reshape(num_buckets,
+                                                         PHRED_RANGE)
+
+    def merge(self, other):
+        """Add the counts of another `PositionProfile` from the same end.
+
+        Args:
+            other: The `PositionProfile` to merge into this one.
+
+        Raises:
+            ValueError: If the profiles are from different ends of the reads.
+        """
+        if self.from_end != other.from_end:
+            raise ValueError("Cannot merge position profiles from different "
+                             "ends of the reads.")
+        self._grow(len(other.counts), other.max_length)
+        self.counts[:len(other.counts)] += other.counts
+
+    def bins(self, binning='default', num_bins=30):
+        """Group the buckets into positional bins, e.g for
+        `plots.quality_per_position`. Bin edges are moved to the nearest
+        bucket start, so bins beyond the exact buckets are approximate.
+
+        Args:
+            binning: One of `POSITION_BINNINGS`. 'default' is the fixed bins
+            `BIN_NAMES` over the first 300 positions, 'linear' is bins of
+            equal width and 'log' is bins of equal width on a log scale, both
+            up to the longest read, and 'all' is a bin for each bucket, i.e
+            every position for the exact buckets.
+            num_bins: The number of 'linear' or 'log' bins. There may be fewer
+            when the reads are short.
+
+        Returns:
+            A `PositionalQualities` of the bins.
+
+        Raises:
+            ValueError: If binning isn't one of `POSITION_BINNINGS`.
+        """
+        starts = self.starts
+        if binning == 'default':
+            return self.binned(BIN_STARTS, BIN_NAMES)
+        elif binning == 'all':
+            edges = starts
+        elif binning == 'linear':
+            edges = np.linspace(0, self.max_length, num_bins + 1)
+        elif binning == 'log':
+            edges = np.append(0, np.geomspace(1, max(self.max_length, 1),
+                                              num_bins))
+        else:
+            raise ValueError("Unknown positional binning {!r}. Choose from "
+                             "{}.".format(binning,
+                                          ', '.join(POSITION_BINNINGS)))
+        # the bucket starts at or after each edge, ending at the longest read
+        edges = starts[np.minimum(np.searchsorted(starts, np.ceil(edges)),
+                                  len(starts) - 1)]
+        edges = np.unique(np.append(np.minimum(edges, self.max_length),
+                                    [0, self.max_length]))
+        if len(edges) < 2:
+            edges = np.array([0, 1])
+
+        return self.binned(edges)
+
+    def binned(self, starts, names=None):
+        """Add up the counts of the buckets starting within each of a set of
+        positional bins.
+
+        Args:
+            starts: The 0-based start position of each bin, plus the end of
+            the last bin.
+            names: The name of each bin. Defaults to the (1-based) positions
+            in the bin, e.g '11-20'.
+
+        Returns:
+            A `PositionalQualities` of the bins.
+        """
+        starts = np.asarray(starts)
+        if names is None:
+            names = [str(start + 1) if end - start == 1 else
+                     '{}-{}'.format(start + 1, end)
+                     for start, end in zip(starts[:-1].tolist(),
+                                           starts[1:].tolist())]
+        bins = PositionalQualities(names, starts)
+        bucket_bins = np.searchsorted(starts, self.starts[:-1],
+                                      side='right') - 1
+        within = (bucket_bins >= 0) & (bucket_bins < len(names))
+        np.add.at(bins.counts, bucket_bins[within], self.counts[within])
+
+        return bins
+
+    def to_arrays(self):
+        """The profile as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the counts, which end the reads are counted
+            from and the longest read.
+        """
+        return {'counts': self.counts, 'from_end': np.array(self.from_end),
+                'max_length': np.array(self.max_length)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a profile from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `PositionProfile` with the saved counts.
+        """
+        profile = cls(bool(arrays['from_end']))
+        profile.counts = np.array(arrays['counts'], dtype=np.int64)
+        profile.max_length = int(arrays['max_length'])
+
+        return profile
+
+    def _grow(self, num_buckets, max_length):
+        """Add buckets, if needed, so there are at least num_buckets."""
+        self.max_length = max(self.max_length, max_length)
+        if num_buckets > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(
+                (num_buckets - len(self.counts), PHRED_RANGE),
+                dtype=np.int64)])
+
+
+def position_buckets(positions):
+    """Get the index of the `PositionProfile` bucket holding each position.
+
+    Args:
+        positions: 0-based positions along a read.
+
+    Returns:
+        An integer array of the bucket indices.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    # the number of bits of the position beyond the bucket's resolution
+    shift = np.maximum(np.frexp(np.maximum(positions, 1))[1] - 1 -
+                       PROFILE_BUCKET_BITS, 0)
+    doublings = np.maximum(shift + PROFILE_BUCKET_BITS - PROFILE_EXACT_BITS,
+                           0)
+    geometric = ((1 << PROFILE_EXACT_BITS) +
+                 (doublings << PROFILE_BUCKET_BITS) +
+                 (positions >> shift) - (1 << PROFILE_BUCKET_BITS))
+
+    return np.where(positions < 1 << PROFILE_EXACT_BITS, positions, geometric)
+
+
+position_buckets.__annotations__ = {'positions': np.ndarray,
+                                    'return': np.ndarray}
+
+
+def bucket_starts(num_buckets):
+    """Get the first position of each of the first num_buckets
+    `PositionProfile` buckets.
+
+    Args:
+        num_buckets: The number of buckets.
+
+    Returns:
+        An integer array of the 0-based start positions.
+    """
+    buckets = np.arange(num_buckets, dtype=np.int64)
+    geometric = np.maximum(buckets - (1 << PROFILE_EXACT_BITS), 0)
+    shift = (geometric >> PROFILE_BUCKET_BITS) + (PROFILE_EXACT_BITS -
+                                                  PROFILE_BUCKET_BITS)
+    starts = (((1 << PROFILE_BUCKET_BITS) +
+               (geometric & ((1 << PROFILE_BUCKET_BITS) - 1))) << shift)
+
+    return np.where(buckets < 1 << PROFILE_EXACT_BITS, buckets, starts)
+
+
+bucket_starts.__annotations__ = {'num_buckets': int, 'return': np.ndarray}
+
+
+def _read_positions(offsets, from_end=False):
+    """The 0-based position of each base within its read, from the start or
+    the end of the read, for a batch of reads packed by `pack_reads`."""
+    lengths = np.diff(offsets)
+    bases = np.arange(offsets[-1] - offsets[0])
+    if from_end:
+        return np.repeat(offsets[1:] - offsets[0] - 1, lengths) - bases
+
+    return bases - np.repeat(offsets[:-1] - offsets[0], lengths)
+
+
+def _batch_qualities(qualities, offsets):
+    """The quality scores of a batch of reads, capped to the Phred range."""
+    return np.minimum(qualities[offsets[0]:offsets[-1]], PHRED_RANGE - 1)
+
+
+def _percentile_from_counts(counts, percentile):
+    """Calculate a percentile of the values represented by a histogram, where
+    element i of `counts` is the number of occurrences of the value i. This
+    gives the same result as `np.percentile` on the expanded values."""
+    cumulative = np.cumsum(counts)
+    rank = (cumulative[-1] - 1) * percentile / 100
+    lower = np.searchsorted(cumulative, np.floor(rank), side='right')
+    upper = np.searchsorted(cumulative, np.ceil(rank), side='right')
+
+    return lower + (rank - np.floor(rank)) * (upper - lower)
+
+
+class LengthQualityGrid(object):
+    """A two-dimensional histogram of read length (on a log10 scale) against
+    mean read quality score. This allows the read length vs. quality plot to
+    be drawn in a time independent of the number of reads.
+
+    Values outside the range of the grid are counted in the closest bin.
+
+    Args:
+        length_bins: The number of bins on the (log10) length axis.
+        quality_bins: The number of bins on the quality score axis.
+        log_length_range: The range of log10 read lengths covered.
+        quality_range: The range of mean quality scores covered.
+
+    Attributes:
+        length_edges: The log10 read length bin edges.
+        quality_edges: The mean quality score bin edges.
+        counts: An integer matrix of shape (length_bins, quality_bins) where
+        element (i, j) is the number of reads in length bin i and quality
+        bin j.
+    """
+
+    def __init__(self, length_bins=350, quality_bins=240,
+                 log_length_range=(0.0, 7.0), quality_range=(0.0, 60.0)):
+        self.length_edges = np.linspace(log_length_range[0],
+                                        log_length_range[1], length_bins + 1)
+        self.quality_edges = np.linspace(quality_range[0], quality_range[1],
+                                         quality_bins + 1)
+        self.counts = np.zeros((length_bins, quality_bins), dtype=np.int64)
+
+    def add(self, lengths, mean_qualities):
+        """Add reads to the grid.
+
+        Args:
+            lengths: An array of read lengths.
+            mean_qualities: An array of the mean quality score of each read.
+        """
+        valid = (lengths > 0) & np.isfinite(mean_qualities)
+        length_idx = _bin_index(np.log10(lengths[valid]), self.length_edges)
+        quality_idx = _bin_index(mean_qualities[valid], self.quality_edges)
+        self.counts += np.bincount(
+            length_idx * self.counts.shape[1] + quality_idx,
+            minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of another `LengthQualityGrid` with the same bins.
+
+        Args:
+            other: The `LengthQualityGrid` to merge into this one.
+
+        Raises:
+            ValueError: If the bins of the two are not the same.
+        """
+        if not (np.array_equal(self.length_edges, other.length_edges) and
+                np.array_equal(self.quality_edges, other.quality_edges)):
+            raise ValueError("Cannot merge length vs. quality grids with "
+                             "different bins.")
+        self.counts += other.counts
+
+    def to_arrays(self):
+        """The grid as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the bin edges and counts.
+        """
+        return {'length_edges': self.length_edges,
+                'quality_edges': self.quality_edges,
+                'counts': self.counts}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a grid from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `LengthQualityGrid` with the saved counts.
+        """
+        grid = cls()
+        grid.length_edges = arrays['length_edges']
+        grid.quality_edges = arrays['quality_edges']
+        grid.counts = arrays['counts'].astype(np.int64)
+
+        return grid
+
+
+class PercentHistogram(object):
+    """A histogram of percentages (e.g GC content or percent identity) in
+    fixed width bins, so that the distribution of every read can be kept in
+    constant memory.
+
+    Values outside [0, 100] are counted in the closest bin.
+
+    Args:
+        bin_width: The width of each bin, in percent.
+
+    Attributes:
+        edges: The bin edges.
+        counts: The number of values in each bin.
+    """
+
+    def __init__(self, bin_width=0.1):
+        num_bins = int(round(100 / bin_width))
+        self.edges = np.linspace(0, 100, num_bins + 1)
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+
+    def add(self, values):
+        """Add values to the histogram. Non-finite values (e.g the GC content
+        of a read with no called bases) are ignored.
+
+        Args:
+            values: An array of percentages.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        self.counts += np.bincount(_bin_index(values, self.edges),
+                                   minlength=len(self.counts))
+
+    def add_value(self, value):
+        """Add a single value to the histogram.
+
+        Args:
+            value: A percentage.
+        """
+        width = self.edges[1] - self.edges[0]
+        idx = int(math.floor(value / width))
+        self.counts[min(max(idx, 0), len(self.counts) - 1)] += 1
+
+    def merge(self, other):
+        """Add the counts of another `PercentHistogram` with the same bins.
+
+        Args:
+            other: The `PercentHistogram` to merge into this one.
+
+        Raises:
+            ValueError: If the bins of the two are not the same.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different bins.")
+        self.counts += other.counts
+
+    def median(self):
+        """Calculates the median, interpolating within the bin it falls in.
+
+        Returns:
+            The median, or NaN if the histogram is empty.
+        """
+        cumulative = np.cumsum(self.counts)
+        if not len(cumulative) or not cumulative[-1]:
+            return float('nan')
+        half = cumulative[-1] / 2
+        idx = int(np.searchsorted(cumulative, half))
+        before = cumulative[idx - 1] if idx else 0
+        width = self.edges[idx + 1] - self.edges[idx]
+
+        return float(self.edges[idx] +
+                     width * (half - before) / self.counts[idx])
+
+    def to_arrays(self):
+        """The histogram as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary with the bin edges and counts.
+        """
+        return {'edges': self.edges, 'counts': self.counts}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a histogram from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `PercentHistogram` with the saved counts.
+        """
+        histogram = cls()
+        histogram.edges = arrays['edges']
+        histogram.counts = arrays['counts'].astype(np.int64)
+
+        return histogram
+
+
+def _bin_index(values, edges):
+    """Get the index of the (equal width) bin each value falls in, counting
+    values outside the range of the edges in the closest bin."""
+    width = edges[1] - edges[0]
+    idx = np.floor((values - edges[0]) / width).astype(np.int64)
+    return np.clip(idx, 0, len(edges) - 2)
+
+
+def binned_kde(counts, edges):
+    """Calculates a Gaussian kernel density estimate from binned data, by
+    convolving the counts with the kernel using FFTs. The bandwidth on each
+    axis is chosen with Scott's rule, from the binned data.
+
+    This takes time proportional to the number of bins, rather than the
+    number of data points times the number of points evaluated.
+
+    Args:
+        counts: An n-dimensional array of counts.
+        edges: A list with the (equal width) bin edges for each axis.
+
+    Returns:
+        An array the same shape as counts with the density at each bin centre.
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum()
+    if not total:
+        return np.zeros_like(counts)
+
+    widths = [axis_edges[1] - axis_edges[0] for axis_edges in edges]
+    kernels = []
+    for axis, axis_edges in enumerate(edges):
+        other_axes = tuple(i for i in range(counts.ndim) if i != axis)
+        marginal = counts.sum(axis=other_axes)
+        centres = (axis_edges[:-1] + axis_edges[1:]) / 2
+        mean = (centres * marginal).sum() / total
+        std = np.sqrt(((centres - mean) ** 2 * marginal).sum() / total)
+        bandwidth = std * total ** (-1 / (counts.ndim + 4))
+        # in units of bins, padded so the convolution doesn't wrap around
+        sigma = max(bandwidth / widths[axis], 1e-3)
+        size = len(marginal) + 2 * int(np.ceil(4 * sigma))
+        distance = np.minimum(np.arange(size), size - np.arange(size))
+        kernel = np.exp(-0.5 * (distance / sigma) ** 2)
+        kernels.append(kernel / kernel.sum())
+
+    shape = [len(kernel) for kernel in kernels]
+    kernel = kernels[0]
+    for axis_kernel in kernels[1:]:
+        kernel = np.multiply.outer(kernel, axis_kernel)
+    axes = list(range(counts.ndim))
+    smoothed = np.fft.irfftn(np.fft.rfftn(counts, shape, axes) *
+                             np.fft.rfftn(kernel, shape, axes), shape, axes)
+    smoothed = smoothed[tuple(slice(0, n) for n in counts.shape)]
+
+    return np.maximum(smoothed, 0) / (total * np.prod(widths))
+
+
+binned_kde.__annotations__ = {'counts': np.ndarray,
+                              'edges': List[np.ndarray],
+                              'return': np.ndarray}
+
+
+def pack_reads(sequences, qualities):
+    """Packs a batch of reads into contiguous buffers for `read_metrics`.
+
+    Args:
+        sequences: A list of read sequences, as str or bytes.
+        qualities: A list of the fastq quality strings for the reads, as str
+        or bytes.
+
+    Returns:
+        A tuple of:
+            - A uint8 array of all sequences concatenated.
+            - A uint8 array of the Phred quality scores of all reads
+            concatenated.
+            - An array of read boundaries in the above, such that read i is
+            `buffer[offsets[i]:offsets[i + 1]]`.
+    """
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in sequences], out=offsets[1:])
+    sequence_buffer = np.frombuffer(_join_bytes(sequences), dtype=np.uint8)
+    quality_buffer = (np.frombuffer(_join_bytes(qualities), dtype=np.uint8) -
+                      PHRED_OFFSET).astype(np.uint8)
+
+    return sequence_buffer, quality_buffer, offsets
+
+
+pack_reads.__annotations__ = {'sequences': List[str],
+                              'qualities': List[str],
+                              'return': Tuple[np.ndarray, np.ndarray,
+                                              np.ndarray]}
+
+
+def _join_bytes(strings):
+    """Concatenate a list of str or bytes into a single bytes object."""
+    if strings and isinstance(strings[0], bytes):
+        return b''.join(strings)
+    return ''.join(strings).encode('ascii')
+
+
+def read_metrics(sequences, qualities, offsets):
+    """Calculates the GC content, length and mean quality score of a batch of
+    reads at once.
+
+    Args:
+        sequences: A uint8 array of the sequences of all reads concatenated.
+        qualities: A uint8 array of the Phred quality scores of all reads
+        concatenated.
+        offsets: Array of read boundaries in `sequences` and `qualities`, such
+        that read i is `sequences[offsets[i]:offsets[i + 1]]`.
+
+    Returns:
+        A tuple of arrays with the GC content (as a percentage, see
+        `gc_content`), length and mean Phred quality score of each read.
+    """
+    lengths = np.diff(offsets)
+    gc_percent = gc_content_batch(sequences, offsets, as_decimal=False)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_qualities = _sum_per_read(qualities, offsets) / lengths
+
+    return gc_percent, lengths, mean_qualities
+
+
+read_metrics.__annotations__ = {'sequences': np.ndarray,
+                                'qualities': np.ndarray,
+                                'offsets': np.ndarray,
+                                'return': Tuple[np.ndarray, np.ndarray,
+                                                np.ndarray]}
+
+
+def _sum_per_read(values, offsets):
+    """Sum a concatenated array of values within each read."""
+    if not len(values):
+        return np.zeros(len(offsets) - 1, dtype=np.int64)
+    # reduceat can't handle indices past the end, or empty reads, itself
+    starts = np.minimum(offsets[:-1], len(values) - 1)
+    sums = np.add.reduceat(values, starts, dtype=np.int64)
+    sums[offsets[:-1] == offsets[1:]] = 0
+    return sums
+
+
+def batch_reads(reads, max_bases=BATCH_BASES):
+    """Group reads into batches of (roughly) max_bases bases and pack them
+    with `pack_reads`.
+
+    Args:
+        reads: An iterable of (sequence, quality string) pairs.
+        max_bases: The number of bases after which a batch is yielded.
+
+    Yields:
+        The packed sequences, qualities and offsets of each batch.
+    """
+    sequences = []
+    qualities = []
+    num_bases = 0
+    for sequence, quality in reads:
+        sequences.append(sequence)
+        qualities.append(quality)
+        num_bases += len(sequence)
+        if num_bases >= max_bases:
+            yield pack_reads(sequences, qualities)
+            sequences = []
+            qualities = []
+            num_bases = 0
+    if sequences:
+        yield pack_reads(sequences, qualities)
+
+
+batch_reads.__annotations__ = {'reads': Iterable[Tuple[str, str]],
+                               'max_bases': int,
+                               'return': Iterable[Tuple[np.ndarray, np.ndarray,
+                                                        np.ndarray]]}
+
+
+def nest_arrays(prefix, arrays):
+    """Prefix the keys of a dictionary of arrays, to nest it in another.
+
+    Args:
+        prefix: The prefix to nest the arrays under.
+        arrays: A dictionary of arrays.
+
+    Returns:
+        A dictionary with keys of the form '<prefix>/<key>'.
+    """
+    return {'{}/{}'.format(prefix, key): value
+            for key, value in arrays.items()}
+
+
+nest_arrays.__annotations__ = {'prefix': str, 'arrays': Dict[str, np.ndarray],
+                               'return': Dict[str, np.ndarray]}
+
+
+def unnest_arrays(prefix, arrays):
+    """Get the arrays nested under a prefix by `nest_arrays`.
+
+    Args:
+        prefix: The prefix the arrays are nested under.
+        arrays: A dictionary of arrays.
+
+    Returns:
+        A dictionary of the nested arrays, with the prefix removed from keys.
+    """
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in arrays.items()
+            if key.startswith(prefix + '/')}
+
+
+unnest_arrays.__annotations__ = {'prefix': str,
+                                 'arrays': Dict[str, np.ndarray],
+                                 'return': Dict[str, np.ndarray]}
+
+
+class FastqSummary(object):
+    """The data collected from the reads of a fastq file that is needed for
+    the plots. Summaries of separate parts of a file can be collected
+    independently and merged.
+
+    Args:
+        downsample: The number of reads to sample the per-read metrics for.
+        Set to 0 for no down-sampling.
+        profiles: Also collect the quality scores at every position of the
+        reads (`PositionProfile`s) and by relative position. This makes
+        summarising the reads around three times slower.
+        sketch_k: The k of the quantile sketches of the read metrics. See
+        `sketch.k_for_error` for the k giving a rank error.
+
+    Attributes:
+        reads: A `Reservoir` of the reads, kept in a `ReadTable`.
+        bins_from_start: A `PositionalQualities` binned from the read starts.
+        bins_from_end: A `PositionalQualities` binned from the read ends.
+        profile_from_start: A `PositionProfile` from the read starts, or None
+        if profiles aren't collected.
+        profile_from_end: A `PositionProfile` from the read ends, or None.
+        relative_qualities: A `RelativeQualities` of all reads, or None.
+        length_quality: A `LengthQualityGrid` of all reads.
+        gc_histogram: A `PercentHistogram` of the GC content of all reads.
+        length_sketch: A `sketch.KLLSketch` of the length of all reads.
+        quality_sketch: A `sketch.KLLSketch` of the mean quality score of all
+        reads.
+        gc_sketch: A `sketch.KLLSketch` of the GC content of all reads.
+        sketch_k: The k of the quantile sketches.
+        offset_sampled: The reads were sampled at random offsets in the files
+        (see `sampling`), rather than all read.
+    """
+
+    def __init__(self, downsample=0, profiles=False, sketch_k=DEFAULT_K):
+        self.offset_sampled = False
+        self.sketch_k = sketch_k
+        self.reads = Reservoir(downsample, items=ReadTable())
+        self.bins_from_start = PositionalQualities()
+        self.bins_from_end = PositionalQualities()
+        self.profile_from_start = self.profile_from_end = None
+        self.relative_qualities = None
+        if profiles:
+            self.profile_from_start = PositionProfile()
+            self.profile_from_end = PositionProfile(from_end=True)
+            self.relative_qualities = RelativeQualities()
+        self.length_quality = LengthQualityGrid()
+        self.gc_histogram = PercentHistogram()
+        self.length_sketch = KLLSketch(sketch_k)
+        self.quality_sketch = KLLSketch(sketch_k)
+        self.gc_sketch = KLLSketch(sketch_k)
+
+    @property
+    def profiles(self):
+        """Whether the per-position profiles are collected."""
+        return self.profile_from_start is not None
+
+    def add_batch(self, sequences, qualities, offsets):
+        """Add a batch of reads, packed by `pack_reads`, to the summary.
+
+        Args:
+            sequences: A uint8 array of the sequences of all reads.
+            qualities: A uint8 array of the Phred quality scores of all reads.
+            offsets: Array of read boundaries in `sequences` and `qualities`.
+        """
+        gc_percent, lengths, mean_qualities = read_metrics(sequences,
+                                                           qualities, offsets)
+        self.reads.extend(ReadTable.from_columns(gc_percent, lengths,
+                                                 mean_qualities))
+        self.length_quality.add(lengths, mean_qualities)
+        self.gc_histogram.add(gc_percent)
+        self.length_sketch.add(lengths)
+        self.quality_sketch.add(mean_qualities)
+        self.gc_sketch.add(gc_percent)
+        self.bins_from_start.add_batch(qualities, offsets)
+        self.bins_from_end.add_batch(qualities, offsets, from_end=True)
+        if self.profiles and offsets[-1] > offsets[0]:
+            self._add_profiles(qualities, offsets, int(lengths.max()))
+
+    def _add_profiles(self, qualities, offsets, max_length):
+        """Add a batch of reads to the profiles."""
+        q_scores = _batch_qualities(qualities, offsets)
+        self.profile_from_start._add_positions(
+            q_scores, _read_positions(offsets), max_length)
+        self.profile_from_end._add_positions(
+            q_scores, _read_positions(offsets, from_end=True), max_length)
+        self.relative_qualities.add_batch(qualities, offsets)
+
+    def add_reads(self, reads):
+        """Add reads to the summary, in batches.
+
+        Args:
+            reads: An iterable of (sequence, quality string) pairs.
+        """
+        # reads are processed in batches to avoid interpreter overhead per read
+        for batch in batch_reads(reads):
+            self.add_batch(*batch)
+
+    def merge(self, other):
+        """Merge the summary of a separate set of reads into this one.
+
+        Args:
+            other: The `FastqSummary` to merge into this one.
+
+        Raises:
+            ValueError: If only one of the summaries has profiles.
+        """
+        if self.profiles != other.profiles:
+            raise ValueError("Cannot merge fastq summaries with and without "
+                             "per-position profiles.")
+        self.offset_sampled = self.offset_sampled or other.offset_sampled
+        self.reads.merge(other.reads)
+        self.bins_from_start.merge(other.bins_from_start)
+        self.bins_from_end.merge(other.bins_from_end)
+        self.length_quality.merge(other.length_quality)
+        self.gc_histogram.merge(other.gc_histogram)
+        for name in SKETCHED_READ_METRICS + PROFILES:
+            if getattr(self, name) is not None:
+                getattr(self, name).merge(getattr(other, name))
+
+    def to_arrays(self):
+        """The summary as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary of arrays, with keys prefixed by attribute name.
+        """
+        arrays = {'offset_sampled': np.array(self.offset_sampled),
+                  'sketch_k': np.array(self.sketch_k)}
+        for name in (('reads', 'bins_from_start', 'bins_from_end',
+                      'length_quality', 'gc_histogram') +
+                     SKETCHED_READ_METRICS + PROFILES):
+            if getattr(self, name) is not None:
+                arrays.update(nest_arrays(name,
+                                          getattr(self, name).to_arrays()))
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a summary from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
+
+        Returns:
+            A `FastqSummary`.
+        """
+        summary = cls(sketch_k=int(arrays['sketch_k']))
+        summary.offset_sampled = bool(arrays['offset_sampled'])
+        summary.reads = Reservoir.from_arrays(unnest_arrays('reads', arrays),
+                                              container=ReadTable)
+        for name in ('bins_from_start', 'bins_from_end'):
+            setattr(summary, name, PositionalQualities.from_arrays(
+                unnest_arrays(name, arrays)))
+        summary.length_quality = LengthQualityGrid.from_arrays(
+            unnest_arrays('length_quality', arrays))
+        summary.gc_histogram = PercentHistogram.from_arrays(
+            unnest_arrays('gc_histogram', arrays))
+        for name in SKETCHED_READ_METRICS:
+            setattr(summary, name,
+                    KLLSketch.from_arrays(unnest_arrays(name, arrays)))
+        if 'relative_qualities/counts' in arrays:
+            for name in ('profile_from_start', 'profile_from_end'):
+                setattr(summary, name, PositionProfile.from_arrays(
+                    unnest_arrays(name, arrays)))
+            summary.relative_qualities = RelativeQualities.from_arrays(
+                unnest_arrays('relative_qualities', arrays))
+
+        return summary
+
+    def as_tuple(self):
+        """The summary in the form returned by `collect_fastq_data`."""
+        reads = self.reads.items
+
+        return (reads.gc_content.tolist(), reads.length.tolist(),
+                reads.mean_quality.tolist(), self.bins_from_start,
+                self.bins_from_end)
+
+
+def summarise_fastq(fastq, downsample=0):
+    """Collects a `FastqSummary` from the records of a fastq file.
+
+    Args:
+        fastq: An iterable fastq object.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        Set to 0 for no down-sampling.
+
+    Returns:
+        A `FastqSummary` of all the reads.
+    """
+    summary = FastqSummary(downsample)
+    summary.add_reads((record.sequence, record.quality) for record in fastq)
+
+    return summary
+
+
+summarise_fastq.__annotations__ = {'fastq': Iterable, 'downsample': int,
+                                   'return': FastqSummary}
 
 
 def collect_fastq_data(fastq, downsample=0):
     """Given a fastq filename, gets the GC content, mean quality scores, read
     length, and quality at certain positional bins - for each read.
 
+    The data is collected in a single pass over the reads. When down-sampling,
+    reads are reservoir sampled as they are read, so memory is bounded by the
+    number of samples rather than the size of the fastq file. The GC content,
+    length and mean quality score of a read are sampled together, so the i-th
+    element of each of the returned lists belongs to the same read.
+
+    The lists take over 100 bytes per read. To keep the reads compactly, use
+    the `ReadTable` of `summarise_fastq(fastq).reads.items` instead.
+
     Args:
         fastq: An iterable fastq object.
         downsample: Down-sample the fastq file to given number of reads. Set
@@ -34,97 +1589,156 @@ def collect_fastq_data(fastq, downsample=0):
             for a read.
             - List of lengths for each read.
             - List where each value is the mean Phred quality score for a read.
-            - An ordered dictionary where each key corresponds to a postitional
-            bin and the values are quality scores for all reads at that
-            position(s) from the start of each read.
-            - An ordered dictionary where each key corresponds to a postitional
-            bin and the values are quality scores for all reads at that
-            position(s) from the end of each read.
-    """
-    gc_content_list = []
-    read_lengths = []
-    mean_quality_scores = []
-    bins_from_start = OrderedDict((name, []) for name in BIN_NAMES)
-    bins_from_end = OrderedDict((name, []) for name in BIN_NAMES)
-    for record in fastq:
-        sequence = record.sequence
-        gc_content_list.append(gc_content(sequence, as_decimal=False))
-        length = len(sequence)
-        read_lengths.append(length)
-        q_scores = record.get_quality_array()
-        mean_quality_scores.append(sum(q_scores) / length)
-        # bin the quality scores for the read from start and end by position
-        for i, (start_idx, bin_name) in enumerate(zip(BIN_STARTS[:-1],
-                                                      BIN_NAMES)):
-            slice_from_start = q_scores[start_idx: BIN_STARTS[i + 1]]
-            slice_from_end = q_scores[-BIN_STARTS[i + 1]: -start_idx or None]
-            bins_from_start[bin_name].extend(slice_from_start)
-            bins_from_end[bin_name].extend(slice_from_end)
-
-    if downsample > 0:
-        gc_content_list = _downsample_list(gc_content_list, downsample)
-        read_lengths = _downsample_list(read_lengths, downsample)
-        mean_quality_scores = _downsample_list(mean_quality_scores, downsample)
-        bins_from_start = _downsample_dict(bins_from_start, downsample)
-        bins_from_end = _downsample_dict(bins_from_end, downsample)
-
-    return (gc_content_list, read_lengths, mean_quality_scores,
-            bins_from_start, bins_from_end)
+            - A `PositionalQualities` holding the quality scores of all reads
+            (regardless of down-sampling) in positional bins from the start of
+            each read.
+            - A `PositionalQualities` holding the quality scores of all reads
+            in positional bins from the end of each read.
+    """
+    return summarise_fastq(fastq, downsample).as_tuple()
 
 
 collect_fastq_data.__annotations__ = {'fastq': Iterable, 'downsample': int,
                                       'return': Tuple[List[float], List[int],
-                                                      List[float], OrderedDict,
-                                                      OrderedDict]}
+                                                      List[float],
+                                                      PositionalQualities,
+                                                      PositionalQualities]}
 
 
-def _downsample_list(full_list, num_samples):
-    """Returns a down-sampled list with a given number of samples.
+class AlignmentSummary(object):
+    """The data collected from the alignments of a SAM/BAM file that is needed
+    for the plots. Summaries of separate parts of a file can be collected
+    independently and merged.
 
     Args:
-        full_list: A list to down-sample.
-        num_samples: The number of elements from full_list to keep.
+        downsample: The number of reads to sample the percent identity for.
+        Set to 0 for no down-sampling.
+        identity: How to define percent identity, one of
+        `IDENTITY_DEFINITIONS`.
+        sketch_k: The k of the quantile sketch of the percent identities. See
+        `sketch.k_for_error` for the k giving a rank error.
 
-    Returns:
-        A list with length of num_samples.
+    Raises:
+        ValueError: If identity isn't one of `IDENTITY_DEFINITIONS`.
+
+    Attributes:
+        identity: The definition of percent identity used.
+        identities: A `Reservoir` of the percent identity of each read.
+        identity_histogram: A `PercentHistogram` of the percent identity of
+        all reads, regardless of down-sampling.
+        identity_sketch: A `sketch.KLLSketch` of the percent identity of all
+        reads.
+        sketch_k: The k of the quantile sketch.
+        offset_sampled: The alignments were sampled at random offsets in the
+        file (see `sampling`), rather than all read.
     """
-    if len(full_list) > num_samples:  # make sure we dont try over sample
-        num_samples = len(full_list)
 
-    return random.sample(full_list, k=num_samples)
+    def __init__(self, downsample=0, identity='nm', sketch_k=DEFAULT_K):
+        if identity not in IDENTITY_DEFINITIONS:
+            raise ValueError("Unknown percent identity definition {!r}. "
+                             "Choose from {}.".format(
+                                 identity, ', '.join(IDENTITY_DEFINITIONS)))
+        self.identity = identity
+        self.offset_sampled = False
+        self.sketch_k = sketch_k
+        self.identities = Reservoir(downsample)
+        self.identity_histogram = PercentHistogram()
+        self.identity_sketch = KLLSketch(sketch_k)
+
+    def add(self, record):
+        """Add an alignment to the summary, if it is mapped and is not a
+        supplementary or secondary alignment.
+
+        Args:
+            record: A read within a sam file (pysam class).
+        """
+        # make sure read is mapped, and is not a suppl. or secondary alignment
+        if (record.is_unmapped or
+                record.is_supplementary or
+                record.is_secondary):
+            return
+        pid = get_percent_identity(record, self.identity)
+        if pid:
+            self.identities.add(pid)
+            self.identity_histogram.add_value(pid)
+            self.identity_sketch.add_value(pid)
+
+    def merge(self, other):
+        """Merge the summary of a separate set of alignments into this one.
+
+        Args:
+            other: The `AlignmentSummary` to merge into this one.
+
+        Raises:
+            ValueError: If the summaries use different definitions of percent
+            identity.
+        """
+        if self.identity != other.identity:
+            raise ValueError("Cannot merge alignment summaries with {!r} and "
+                             "{!r} percent identity.".format(self.identity,
+                                                             other.identity))
+        self.offset_sampled = self.offset_sampled or other.offset_sampled
+        self.identities.merge(other.identities)
+        self.identity_histogram.merge(other.identity_histogram)
+        self.identity_sketch.merge(other.identity_sketch)
+
+    def to_arrays(self):
+        """The summary as a dictionary of arrays, e.g for `np.savez`.
+
+        Returns:
+            A dictionary of arrays, with keys prefixed by attribute name.
+        """
+        arrays = nest_arrays('identities', self.identities.to_arrays())
+        arrays['identity'] = np.array(self.identity)
+        arrays['offset_sampled'] = np.array(self.offset_sampled)
+        arrays['sketch_k'] = np.array(self.sketch_k)
+        arrays.update(nest_arrays('identity_histogram',
+                                  self.identity_histogram.to_arrays()))
+        arrays.update(nest_arrays('identity_sketch',
+                                  self.identity_sketch.to_arrays()))
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a summary from the arrays returned by `to_arrays`.
+
+        Args:
+            arrays: A dictionary of arrays as returned by `to_arrays`.
 
+        Returns:
+            An `AlignmentSummary`.
+        """
+        summary = cls(identity=str(arrays['identity']),
+                      sketch_k=int(arrays['sketch_k']))
+        summary.offset_sampled = bool(arrays['offset_sampled'])
+        summary.identities = Reservoir.from_arrays(
+            unnest_arrays('identities', arrays))
+        summary.identity_histogram = PercentHistogram.from_arrays(
+            unnest_arrays('identity_histogram', arrays))
+        summary.identity_sketch = KLLSketch.from_arrays(
+            unnest_arrays('identity_sketch', arrays))
 
-_downsample_list.__annotations__ = {'full_list': list, 'num_samples': int,
-                                    'returns': list}
+        return summary
 
 
-def _downsample_dict(full_dict, num_samples):
-    """Returns a down-sampled dictionary with a given number of samples in
-    each value list.
+def alignment_read_mode(filename):
+    """Get the pysam read mode for an alignment file based on its extension.
 
     Args:
-        full_dict: A dictionary with lists as values to down-sample.
-        num_samples: The number of elements in each value list from full_dict
-        to keep.
+        filename: Path to SAM/BAM/CRAM file.
 
     Returns:
-        A dictionary with value lengths of num_samples.
+        The mode to open the file with in `pysam.AlignmentFile`.
     """
-    downsampled_dict = OrderedDict()
-    for key, value in full_dict.items():
-        if len(value) > num_samples:
-            downsampled_dict[key] = random.sample(value, k=num_samples)
-        else:
-            downsampled_dict[key] = value
-
-    return downsampled_dict
+    file_ext = os.path.splitext(filename)[-1].lower()
+    return {'.bam': 'rb', '.cram': 'rc'}.get(file_ext, 'r')
 
 
-_downsample_dict.__annotations__ = {'full_dict': dict, 'num_samples': int,
-                                    'returns': dict}
+alignment_read_mode.__annotations__ = {'filename': str, 'return': str}
 
 
-def sam_percent_identity(filename, downsample=0):
+def sam_percent_identity(filename, downsample=0, identity='nm'):
     """Opens a SAM/BAM file and extracts the read percent identity for all
     mapped reads that are nort supplementary or secondary alignments.
 
@@ -132,74 +1746,143 @@ def sam_percent_identity(filename, downsample=0):
         filename: Path to SAM/BAM file.
         downsample: Down-sample the sam file to given number of reads. Set
         to 0 for no down-sampling.
+        identity: How to define percent identity, one of
+        `IDENTITY_DEFINITIONS`.
 
     Returns:
         A list of the percent identity for all valid reads.
     """
-    # get pysam read option depending on whether file is sam or bam
-    file_ext = os.path.splitext(filename)[-1]
-    read_opt = 'rb' if file_ext == '.bam' else 'r'
+    import pysam
+    summary = AlignmentSummary(downsample, identity)
+    with pysam.AlignmentFile(filename,
+                             alignment_read_mode(filename)) as samfile:
+        for record in samfile:
+            summary.add(record)
 
-    # open file
-    samfile = pysam.AlignmentFile(filename, read_opt)
-
-    perc_identities = []
-    for record in samfile:
-        # make sure read is mapped, and is not a suppl. or secondary alignment
-        if (record.is_unmapped or
-                record.is_supplementary or
-                record.is_secondary):
-            continue
-        pid = get_percent_identity(record)
-        if pid:
-            perc_identities.append(pid)
-
-    if downsample > 0:
-        perc_identities = _downsample_list(perc_identities, downsample)
-
-    return perc_identities
+    return summary.identities.items
 
 
 sam_percent_identity.__annotations__ = {'filename': str, 'downsample': int,
+                                        'identity': str,
                                         'return': List[float]}
 
 
-def get_percent_identity(read):
-    """Calculates the percent identity of a read based on the NM tag if present
-    , if not calculate from MD tag and CIGAR string.
+def get_percent_identity(read, definition='nm'):
+    """Calculates the percent identity of a read. See `IDENTITY_DEFINITIONS`
+    for the definitions available. For the default ('nm'), the NM tag is used
+    if present, if not it is calculated from the MD tag and CIGAR string.
 
     Args:
         read: A read within a sam file (pysam class).
+        definition: How to define identity, one of `IDENTITY_DEFINITIONS`.
 
     Returns:
         The percent identity or None if required fields are not present.
     """
-    try:
-        return 100 * (1 - read.get_tag("NM") / read.query_alignment_length)
-    except KeyError:
+    if definition == 'nm':
         try:
-            return 100 * (
-                    1 - (_parse_md_flag(read.get_tag("MD")) +
-                         _parse_cigar(read.cigartuples)) /
-                    read.query_alignment_length
-            )
+            return 100 * (1 - read.get_tag("NM") / read.query_alignment_length)
         except KeyError:
+            pass  # calculate the NM from the alignment statistics
+        except ZeroDivisionError:
             return None
-    except ZeroDivisionError:
+    identities = get_percent_identities(read)
+    if identities is None:
         return None
 
+    return identities[IDENTITY_DEFINITIONS.index(definition)]
+
+
+get_percent_identity.__annotations__ = {'read': Sam, 'definition': str,
+                                        'return': float}
+
+
+def get_percent_identities(read):
+    """Calculates the percent identity of a read under each of the
+    `IDENTITY_DEFINITIONS`, from a single count of its alignment statistics
+    (see `alignment_stats`):
+        - 'nm': 100 * (1 - NM / aligned read bases), where NM is the number of
+        mismatched, inserted and deleted bases.
+        - 'blast': 100 * matching bases / alignment columns (matched,
+        mismatched, inserted and deleted bases), as reported by BLAST.
+        - 'gap_compressed': as 'blast', but counting each insertion or deletion
+        as a single column and difference, whatever its length. This ignores
+        the length of indels, which for long reads are mostly sequencing
+        errors in homopolymers.
+
+    Args:
+        read: A read within a sam file (pysam class).
+
+    Returns:
+        A tuple of the percent identity under each definition, in the order of
+        `IDENTITY_DEFINITIONS`, or None if the mismatches can't be counted (no
+        NM or MD tag, or =/X CIGAR operations) or nothing is aligned.
+    """
+    stats = alignment_stats(read)
+    if stats is None:
+        return None
+    aligned, mismatches, inserted, insertions, deleted, deletions = stats
+    columns = aligned + inserted + deleted
+    compressed_columns = aligned + insertions + deletions
+    if not aligned + inserted or not columns:
+        return None
+
+    return (100 * (1 - (mismatches + inserted + deleted) /
+                   (aligned + inserted)),
+            100 * (aligned - mismatches) / columns,
+            100 * (1 - (mismatches + insertions + deletions) /
+                   compressed_columns))
+
+
+get_percent_identities.__annotations__ = {'read': Sam,
+                                          'return': Tuple[float, float, float]}
 
-get_percent_identity.__annotations__ = {'read': Sam, 'return': float}
 
+def alignment_stats(read):
+    """Counts the differences between a read and the reference, using pysam's
+    counts of the bases and blocks of each CIGAR operation. Mismatches are
+    taken from the =/X CIGAR operations if there are any, otherwise from the NM
+    tag, otherwise from the MD tag.
 
-def _parse_md_flag(md_list):
-    """Parse MD string to get number of mismatches and deletions."""
-    return sum([len(item) for item in re.split('[0-9^]', md_list)])
+    Args:
+        read: A read within a sam file (pysam class).
+
+    Returns:
+        A tuple of the number of aligned (M, = and X) bases, mismatched bases,
+        inserted bases, insertions, deleted bases and deletions. None if the
+        mismatches can't be counted.
+    """
+    bases, blocks = read.get_cigar_stats()
+    aligned = bases[CIGAR_MATCH] + bases[CIGAR_EQUAL] + bases[CIGAR_DIFF]
+    inserted = bases[CIGAR_INS]
+    deleted = bases[CIGAR_DEL]
+    if bases[CIGAR_EQUAL] or bases[CIGAR_DIFF]:
+        mismatches = bases[CIGAR_DIFF]
+    elif read.has_tag('NM'):
+        # NM also counts the inserted and deleted bases
+        mismatches = max(bases[CIGAR_STATS_NM] - inserted - deleted, 0)
+    elif read.has_tag('MD'):
+        mismatches = _count_md_mismatches(read.get_tag('MD'), deleted)
+    else:
+        return None
+
+    return (aligned, mismatches, inserted, blocks[CIGAR_INS], deleted,
+            blocks[CIGAR_DEL])
 
 
-def _parse_cigar(cigartuples):
-    """Count the insertions in the read using the CIGAR string."""
-    return sum([item[1] for item in cigartuples if item[0] == 1])
+alignment_stats.__annotations__ = {'read': Sam,
+                                   'return': Tuple[int, int, int, int, int,
+                                                   int]}
+
+
+def _count_md_mismatches(md, deleted):
+    """Count the mismatches in an MD tag. The reference bases in the tag are
+    the mismatched and the deleted bases, so deleting the other characters
+    with translate (a single pass in C) leaves both, and the deleted bases are
+    known from the CIGAR string."""
+    if not isinstance(md, bytes):
+        md = md.encode('ascii')
+    return max(len(md.translate(None, MD_NON_BASES)) - deleted, 0)
 
 
 def gc_content(sequence, as_decimal=True):
@@ -210,7 +1893,7 @@ def gc_content(sequence, as_decimal=True):
         includes the ambiguous base S (G or C). In this sense the method is
         conservative with its calculation.
     Args:
-        sequence: A DNA string.
+        sequence: A DNA string (str or bytes).
         as_decimal: Return the result as a decimal. Setting to False
         will return as a percentage. i.e for the sequence GCAT it will
         return 0.5 by default and 50.00 if set to False.
@@ -218,20 +1901,14 @@ def gc_content(sequence, as_decimal=True):
         float: GC content calculated as the number of G, C, and S divided
         by the number of (non-N) bases (length).
     """
-    gc_total = 0.0
-    num_bases = 0.0
-    n_tuple = tuple('nN')
-    accepted_bases = tuple('cCgGsS')
-
-    # counter sums all unique characters in sequence. Case insensitive.
-    for base, count in Counter(sequence).items():
+    if not isinstance(sequence, bytes):
+        sequence = sequence.encode('ascii')
 
-        # dont count N in the number of bases
-        if base not in n_tuple:
-            num_bases += count
-
-            if base in accepted_bases:  # S is a G or C
-                gc_total += count
+    # deleting bases with translate is a single pass in C. Case insensitive.
+    length = len(sequence)
+    gc_total = length - len(sequence.translate(None, GC_BASES))
+    # dont count N in the number of bases
+    num_bases = len(sequence.translate(None, N_BASES))
 
     result = gc_total / num_bases
 
@@ -243,3 +1920,36 @@ def gc_content(sequence, as_decimal=True):
 
 gc_content.__annotations__ = {'sequence': str, 'as_decimal': bool,
                               'return': float}
+
+
+def gc_content_batch(sequences, offsets, as_decimal=True):
+    """Returns the GC content for each of a batch of sequences, calculated in
+    the same way as `gc_content`.
+
+    Args:
+        sequences: A uint8 array of all sequences concatenated, as returned by
+        `pack_reads`.
+        offsets: Array of sequence boundaries, such that sequence i is
+        `sequences[offsets[i]:offsets[i + 1]]`.
+        as_decimal: Return the results as decimals. Setting to False will
+        return them as percentages.
+
+    Returns:
+        An array with the GC content of each sequence. Sequences without any
+        non-N bases have a GC content of NaN.
+    """
+    gc_counts = _sum_per_read(GC_TABLE[sequences], offsets)
+    num_bases = np.diff(offsets) - _sum_per_read(N_TABLE[sequences], offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = gc_counts / num_bases
+
+    if not as_decimal:  # return as percentage
+        result *= 100
+
+    return result
+
+
+gc_content_batch.__annotations__ = {'sequences': np.ndarray,
+                                    'offsets': np.ndarray,
+                                    'as_decimal': bool,
+                                    'return': np.ndarray}
@@ -0,0 +1,89 @@
+"""This module contains a watcher for directories that fastq files are being
+written to during a sequencing run. Only reads that have not been seen before
+are added to the running summary each time the directory is polled.
+"""
+from __future__ import absolute_import
+import os
+from pistis import utils, fastq, pipeline
+from pistis.sketch import DEFAULT_K
+
+
+class FastqWatcher(object):
+    """Tracks the fastq files in a directory (and its subdirectories) and folds
+    new reads into a running `utils.FastqSummary`.
+
+    Uncompressed files are read incrementally: the byte offset up to which
+    complete records have been read is remembered, so files that are still
+    being appended to are resumed where they were left. Compressed files can't
+    be resumed, so they are read in full once their size and modification time
+    are unchanged between two polls.
+
+    Args:
+        directory: The directory to watch.
+        downsample: Down-sample the per-read metrics to given number of reads.
+        Set to 0 for no down-sampling.
+        profiles: Also collect the per-position quality profiles, see
+        `utils.FastqSummary`.
+        sketch_k: The k of the quantile sketches, see `utils.FastqSummary`.
+
+    Attributes:
+        summary: The `utils.FastqSummary` of all reads processed so far.
+        offsets: A dictionary of the number of bytes processed for each
+        uncompressed file.
+        finished: The set of compressed files that have been processed.
+    """
+
+    def __init__(self, directory, downsample=0, profiles=False,
+                 sketch_k=DEFAULT_K):
+        self.directory = directory
+        self.summary = utils.FastqSummary(downsample, profiles, sketch_k)
+        self.offsets = {}
+        self.finished = set()
+        self._last_seen = {}
+
+    def fastq_files(self):
+        """Lists the fastq files currently in the watched directory.
+
+        Returns:
+            A sorted list of paths.
+        """
+        return fastq.find_fastq_files(self.directory)
+
+    def poll(self):
+        """Processes any new reads in the watched directory.
+
+        Returns:
+            The number of new reads added to the summary.
+        """
+        reads_before = self.summary.reads.seen
+        for path in self.fastq_files():
+            if path in self.finished:
+                continue
+            if fastq.is_gzipped(path):
+                self._poll_compressed(path)
+            else:
+                self._poll_uncompressed(path)
+
+        return self.summary.reads.seen - reads_before
+
+    def _poll_uncompressed(self, path):
+        """Add the complete records written since the last poll."""
+        offset = self.offsets.get(path, 0)
+        if os.path.getsize(path) <= offset:
+            return
+        with open(path, 'rb') as handle:
+            handle.seek(offset)
+            self.summary.add_reads(fastq.read_complete_records(handle))
+            self.offsets[path] = handle.tell()
+
+    def _poll_compressed(self, path):
+        """Add all records once the file has stopped changing."""
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime)
+        if self._last_seen.get(path) != signature:
+            self._last_seen[path] = signature
+            return
+        for batch in pipeline.read_batches(path):
+            self.summary.add_batch(*batch)
+        self.finished.add(path)
+        del self._last_seen[path]
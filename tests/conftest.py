@@ -0,0 +1,75 @@
+"""Fixtures shared by the `pistis` tests."""
+from __future__ import absolute_import
+import gzip
+import random
+import pytest
+import pysam
+from pistis import cache
+
+FASTQ_READS = 300  # reads in the `fastq_file` fixture
+FASTQ_COMPRESSIONS = ('plain', 'gzip', 'multi_member', 'bgzf')
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """Keeps the summaries cached by each test (including those run in a
+    subprocess) in its own directory, rather than in the user's cache.
+
+    Returns:
+        The path of the cache directory.
+    """
+    directory = str(tmpdir.join('cache'))
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, directory)
+
+    return directory
+
+
+@pytest.fixture
+def fastq_file(request, tmpdir):
+    """Writes a fastq file of `FASTQ_READS` random reads of 50 to 999 bases.
+    Some quality strings start with '@', to test finding record boundaries.
+
+    The file is uncompressed, unless the fixture is parametrised indirectly
+    with one of `FASTQ_COMPRESSIONS`, e.g
+    `@pytest.mark.parametrize('fastq_file', ['gzip'], indirect=True)`:
+        - plain: Uncompressed.
+        - gzip: Gzipped.
+        - multi_member: Gzipped as two gzip members.
+        - bgzf: BGZF compressed, with a .gzi index.
+    The reads are the same whatever the compression.
+
+    Returns:
+        The path to the fastq file.
+    """
+    compression = getattr(request, 'param', 'plain')
+    rng = random.Random(42)
+    records = []
+    for i in range(FASTQ_READS):
+        length = rng.randint(50, 999)
+        sequence = ''.join(rng.choice('ACGTN') for _ in range(length))
+        quality = ''.join(chr(rng.randint(0, 40) + 33) for _ in range(length))
+        records.append('@read{}\n{}\n+\n{}\n'.format(i, sequence, quality))
+    text = ''.join(records)
+
+    plain = str(tmpdir.join('reads.fastq'))
+    with open(plain, 'w') as fastq:
+        fastq.write(text)
+    if compression == 'plain':
+        return plain
+
+    path = plain + '.gz'
+    if compression == 'bgzf':
+        pysam.tabix_compress(plain, path)
+        pysam.fqidx(path)
+    elif compression == 'gzip':
+        with gzip.open(path, 'wt') as fastq:
+            fastq.write(text)
+    elif compression == 'multi_member':
+        with open(path, 'wb') as fastq:
+            for part in (records[:FASTQ_READS // 2],
+                         records[FASTQ_READS // 2:]):
+                fastq.write(gzip.compress(''.join(part).encode('ascii')))
+    else:
+        raise ValueError("Unknown compression {!r}.".format(compression))
+
+    return path
@@ -0,0 +1,72 @@
+"""Tests for the cache module."""
+from __future__ import absolute_import
+import os
+from pistis import cache, utils
+
+READS = '@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n'
+
+
+def _summary():
+    summary = utils.FastqSummary(10)
+    summary.add_reads([(b'ACGT', b'IIII'), (b'GGCCAA', b'######')])
+    return summary
+
+
+def test_load_and_save(tmpdir):
+    """Test a summary is only found under the key of unchanged files and the
+    same parameters."""
+    fastq = tmpdir.join('reads.fastq')
+    fastq.write(READS)
+    summary_cache = cache.SummaryCache(str(tmpdir.join('cache')))
+    key = summary_cache.key('fastq', [str(fastq)], downsample=10)
+    assert summary_cache.load('fastq', key) is None
+
+    summary_cache.save('fastq', key, _summary())
+    loaded = summary_cache.load('fastq', key)
+    assert loaded.reads.seen == 2
+    assert loaded.reads.items == _summary().reads.items
+    assert summary_cache.load('bam', key) is None
+    assert summary_cache.key('fastq', [str(fastq)], downsample=0) != key
+
+    fastq.write(READS + READS)
+    assert summary_cache.key('fastq', [str(fastq)], downsample=10) != key
+
+    # a corrupt summary is a miss
+    with open(summary_cache.entries()[0], 'wb') as handle:
+        handle.write(b'not a summary')
+    assert summary_cache.load('fastq', key) is None
+
+
+def test_content_hash(tmpdir):
+    """Test with content_hash, copies of a file have the same key."""
+    summary_cache = cache.SummaryCache(str(tmpdir), content_hash=True)
+    keys = []
+    for name in ('a.fastq', 'b.fastq'):
+        tmpdir.join(name).write(READS)
+        keys.append(summary_cache.key('fastq', [str(tmpdir.join(name))]))
+    assert keys[0] == keys[1]
+
+    tmpdir.join('b.fastq').write(READS.replace('ACGT', 'ACGA'))
+    assert summary_cache.key('fastq', [str(tmpdir.join('b.fastq'))]) != keys[0]
+
+
+def test_evict(tmpdir):
+    """Test the least recently used summaries are removed once the cache is
+    bigger than max_size."""
+    summary_cache = cache.SummaryCache(str(tmpdir))
+    summary_cache.save('fastq', 'a', _summary())
+    size = os.path.getsize(summary_cache.entries()[0])
+    summary_cache.max_size = 2 * size
+    summary_cache.save('fastq', 'b', _summary())
+    for key, mtime in (('a', 1000), ('b', 2000)):
+        os.utime(str(tmpdir.join(key + '.npz')), (mtime, mtime))
+    # loading a makes it the most recently used
+    assert summary_cache.load('fastq', 'a') is not None
+
+    summary_cache.save('fastq', 'c', _summary())
+    assert [os.path.basename(path) for path in summary_cache.entries()] == [
+        'a.npz', 'c.npz']
+    summary_cache.max_size = 0
+    assert len(summary_cache.evict()) == 2
+    assert not summary_cache.entries()
+    assert not tmpdir.listdir()
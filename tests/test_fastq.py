@@ -0,0 +1,81 @@
+"""Tests for the fastq module."""
+from __future__ import absolute_import
+import io
+import pytest
+from pistis import fastq
+
+RECORDS = (b'@read1\nACGT\n+\n@@@@\n'
+           b'@read2\nGGCCA\n+\n@!!!!\n'
+           b'@read3\nTT\n+\n##\n')
+
+
+def test_find_record_start():
+    """Test record boundaries are found from any offset, even when a quality
+    string starts with '@'."""
+    handle = io.BytesIO(RECORDS)
+    starts = [0, RECORDS.index(b'@read2'), RECORDS.index(b'@read3'),
+              len(RECORDS)]
+    for offset in range(len(RECORDS) + 1):
+        expected = min(start for start in starts if start >= offset)
+        assert fastq.find_record_start(handle, offset) == expected
+        assert handle.tell() == expected
+
+
+def test_read_records():
+    """Test reading records from a position up to an end offset."""
+    handle = io.BytesIO(RECORDS)
+    assert list(fastq.read_records(handle)) == [(b'ACGT', b'@@@@'),
+                                                (b'GGCCA', b'@!!!!'),
+                                                (b'TT', b'##')]
+    handle.seek(0)
+    end = RECORDS.index(b'@read2') + 1
+    assert list(fastq.read_records(handle, end)) == [(b'ACGT', b'@@@@'),
+                                                     (b'GGCCA', b'@!!!!')]
+
+
+def _unpack(sequences, qualities, offsets):
+    return ([sequences[start:end].tobytes() for start, end in
+             zip(offsets[:-1], offsets[1:])],
+            [(qualities[start:end] + fastq.PHRED_OFFSET).tobytes()
+             for start, end in zip(offsets[:-1], offsets[1:])])
+
+
+def test_parse_records():
+    """Test a block is parsed into packed batches of its complete records, and
+    the end of them is found."""
+    end = RECORDS.index(b'@read3') + 9
+    sequences, qualities, offsets, parsed = fastq.parse_records(RECORDS[:end])
+    assert _unpack(sequences, qualities, offsets) == ([b'ACGT', b'GGCCA'],
+                                                      [b'@@@@', b'@!!!!'])
+    assert parsed == RECORDS.index(b'@read3')
+
+    sequences, qualities, offsets, parsed = fastq.parse_records(
+        RECORDS[parsed:].replace(b'\n', b'\r\n').rstrip(), final=True)
+    assert _unpack(sequences, qualities, offsets) == ([b'TT'], [b'##'])
+
+    with pytest.raises(ValueError):
+        fastq.parse_records(RECORDS[1:])
+    with pytest.raises(ValueError):
+        fastq.parse_records(RECORDS.replace(b'GGCCA', b'GGCC'))
+    with pytest.raises(ValueError):
+        fastq.parse_records(RECORDS[:end], final=True)
+
+
+def test_read_batches():
+    """Test records are read in blocks smaller and larger than a record, up to
+    an end offset."""
+    end = RECORDS.index(b'@read3')
+    for block_size in (1, 7, len(RECORDS)):
+        handle = io.BytesIO(RECORDS)
+        batches = [_unpack(*batch) for batch in
+                   fastq.read_batches(handle, block_size=block_size)]
+        assert ([sequence for batch in batches for sequence in batch[0]] ==
+                [b'ACGT', b'GGCCA', b'TT'])
+        assert ([quality for batch in batches for quality in batch[1]] ==
+                [b'@@@@', b'@!!!!', b'##'])
+
+        handle.seek(0)
+        batches = [_unpack(*batch) for batch in
+                   fastq.read_batches(handle, end, block_size)]
+        assert ([sequence for batch in batches for sequence in batch[0]] ==
+                [b'ACGT', b'GGCCA'])
@@ -0,0 +1,57 @@
+"""Tests for the metrics module."""
+from __future__ import absolute_import
+import json
+import numpy as np
+import pytest
+from pistis import utils, metrics
+
+READS = [('ACGTACGTAA', 'IIIIIIIIII'), ('GGGCC', '+++++'),
+         ('ACGTACGTACGTACGTACGT', '55555555555555555555')]
+
+
+@pytest.fixture
+def fastq_summary():
+    """A summary of three reads, of 10, 5 and 20 bases."""
+    summary = utils.FastqSummary()
+    summary.add_reads(READS)
+    return summary
+
+
+def test_fastq_metrics(fastq_summary):
+    fastq = metrics.fastq_metrics(fastq_summary)
+
+    assert fastq['reads'] == 3
+    assert fastq['bases'] == 35
+    assert fastq['length']['min'] == 5
+    assert fastq['length']['max'] == 20
+    assert fastq['length']['p50'] == 10
+    assert fastq['length']['n50'] == 20
+    assert fastq['mean_quality']['p50'] == 20
+    assert fastq['gc_content']['max'] == 100
+    assert fastq['quality_from_start']['1']['scores'] == 3
+    assert fastq['quality_from_start']['1']['median'] == 20
+    assert fastq['quality_from_end']['11-20']['scores'] == 10
+    assert fastq['quality_from_end']['21-50']['scores'] == 0
+    assert np.isnan(fastq['quality_from_end']['21-50']['median'])
+
+
+def test_write_metrics(fastq_summary, tmpdir):
+    alignment_summary = utils.AlignmentSummary()
+    collected = metrics.collect_metrics(fastq_summary, alignment_summary)
+    assert list(collected) == ['fastq', 'alignment']
+
+    json_file = str(tmpdir.join('metrics.json'))
+    metrics.write_metrics(collected, json_file)
+    with open(json_file) as handle:
+        written = json.load(handle)
+    assert written['fastq']['length']['n50'] == 20
+    # NaN is not valid JSON
+    assert written['alignment']['percent_identity']['p50'] is None
+
+    tsv_file = str(tmpdir.join('metrics.tsv'))
+    metrics.write_metrics(collected, tsv_file)
+    with open(tsv_file) as handle:
+        rows = dict(line.rstrip('\n').split('\t') for line in handle)
+    assert rows['fastq.reads'] == '3'
+    assert rows['fastq.quality_from_start.11-20.scores'] == '10'
+    assert rows['alignment.reads'] == '0'
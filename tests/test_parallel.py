@@ -0,0 +1,158 @@
+"""Tests for the parallel module."""
+from __future__ import absolute_import
+import random
+import pytest
+import pysam
+from pistis import utils, parallel
+
+
+@pytest.mark.parametrize('fastq_file', ['plain', 'gzip'], indirect=True)
+def test_scan_fastq_matches_serial(fastq_file):
+    """Test scanning with multiple processes gives the same summary as
+    scanning with one."""
+    with pysam.FastxFile(fastq_file) as fastq:
+        expected = utils.summarise_fastq(fastq)
+    summary = parallel.scan_fastq(fastq_file, threads=3)
+
+    assert summary.reads.seen == 300
+    assert sorted(summary.reads.items) == sorted(expected.reads.items)
+    assert (summary.bins_from_start.counts ==
+            expected.bins_from_start.counts).all()
+    assert (summary.bins_from_end.counts ==
+            expected.bins_from_end.counts).all()
+
+
+@pytest.mark.parametrize('fastq_file', ['plain', 'gzip'], indirect=True)
+def test_scan_fastq_profiles(fastq_file):
+    """Test the per-position profiles collected by multiple processes are
+    the same as those collected by one."""
+    expected = parallel.scan_fastq(fastq_file, profiles=True)
+    summary = parallel.scan_fastq(fastq_file, threads=3, profiles=True)
+
+    for name in utils.PROFILES:
+        assert (getattr(summary, name).counts ==
+                getattr(expected, name).counts).all()
+    assert summary.profile_from_start.counts.sum() == (
+        summary.length_sketch.total)
+
+
+@pytest.mark.parametrize('fastq_file', ['plain', 'gzip'], indirect=True)
+def test_scan_fastq_downsample(fastq_file):
+    """Test down-sampling with multiple processes samples from every read."""
+    with pysam.FastxFile(fastq_file) as fastq:
+        expected = set(utils.summarise_fastq(fastq).reads.items)
+    summary = parallel.scan_fastq(fastq_file, downsample=40, threads=2)
+
+    assert summary.reads.seen == 300
+    assert len(summary.reads.items) == 40
+    assert all(read in expected for read in summary.reads.items)
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_scan_wrapped_fastq(tmpdir, threads):
+    """Test fastq with the sequences and quality strings wrapped over several
+    lines, which only pysam reads, is summarised too."""
+    path = str(tmpdir.join('wrapped.fastq'))
+    with open(path, 'w') as handle:
+        handle.write('@a\nACGTAC\nGT\n+\nIIIIII\nII\n@b\nGC\n+\n##\n')
+
+    summary = parallel.scan_fastq(path, threads=threads)
+    files_summary = parallel.scan_fastq_files([path, path], threads=threads)
+
+    assert summary.reads.seen == 2
+    assert sorted(summary.reads.items.length) == [2, 8]
+    assert files_summary.reads.seen == 4
+
+
+@pytest.fixture
+def synthetic_bam(tmpdir):
+    """Writes a sorted, indexed BAM file of 500 alignments to two contigs. One
+    in five reads is unmapped and one in seven is a secondary alignment.
+
+    Returns:
+        The path to the BAM file.
+    """
+    rng = random.Random(7)
+    path = str(tmpdir.join('synthetic.bam'))
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'chr1', 'LN': 100000},
+                     {'SN': 'chr2', 'LN': 30000}]}
+    records = []
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        for i in range(500):
+            record = pysam.AlignedSegment(bam.header)
+            record.query_name = 'read{}'.format(i)
+            record.query_sequence = 'A' * 1000
+            record.reference_id = rng.randint(0, 1)
+            record.reference_start = rng.randint(0, 25000)
+            record.cigartuples = [(0, 1000)]
+            record.flag = 4 if i % 5 == 0 else 256 if i % 7 == 0 else 0
+            record.set_tag('NM', rng.randint(0, 200))
+            records.append(record)
+        for record in sorted(records, key=lambda r: (r.reference_id,
+                                                     r.reference_start)):
+            bam.write(record)
+    pysam.index(path)
+
+    return path
+
+
+def test_scan_alignments_matches_serial(synthetic_bam):
+    """Test scanning an indexed BAM by region gives the same percent
+    identities as reading it serially."""
+    expected = utils.sam_percent_identity(synthetic_bam)
+    summary = parallel.scan_alignments(synthetic_bam, threads=3)
+
+    assert len(expected) == 343
+    assert sorted(summary.identities.items) == sorted(expected)
+
+
+def test_scan_alignments_empty_regions(synthetic_bam):
+    """Test regions without any alignments, and fewer alignments than the
+    down-sampling size, are summarised."""
+    with pysam.AlignmentFile(synthetic_bam) as bam:
+        regions = parallel._alignment_regions(bam, 3 * 4)
+    # the alignments all start before 25000
+    assert any(start > 26000 for _, start, _ in regions)
+    summary = parallel.scan_alignments(synthetic_bam, downsample=50000,
+                                       threads=3)
+
+    assert summary.identities.seen == 343
+    assert len(summary.identities.items) == 343
+    assert sorted(summary.identities.items) == sorted(
+        utils.sam_percent_identity(synthetic_bam))
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+@pytest.mark.parametrize('downsample', [0, 50000])
+def test_scan_fastq_files(tmpdir, threads, downsample):
+    """Test several files, one of them empty, are summarised as if they were
+    one."""
+    filenames = []
+    for i, num_reads in enumerate((5, 50, 20, 0)):
+        filenames.append(str(tmpdir.join('chunk_{}.fastq'.format(i))))
+        with open(filenames[-1], 'w') as fastq:
+            for j in range(num_reads):
+                sequence = 'ACGT' * (i + 1)
+                fastq.write('@read{}\n{}\n+\n{}\n'.format(
+                    j, sequence, 'I' * len(sequence)))
+    summary = parallel.scan_fastq_files(filenames, downsample, threads)
+
+    assert summary.reads.seen == 75
+    assert sorted(set(summary.reads.items)) == [(50.0, 4, 40.0),
+                                                (50.0, 8, 40.0),
+                                                (50.0, 12, 40.0)]
+    assert summary.bins_from_start['1'][40] == 75
+
+
+def test_scan_small_fastq(tmpdir):
+    """Test a file too small to split between the processes is summarised at
+    the default down-sampling."""
+    path = str(tmpdir.join('small.fastq'))
+    with open(path, 'w') as fastq:
+        for i in range(5):
+            fastq.write('@read{}\nACGTACGT\n+\nIIIIIIII\n'.format(i))
+    summary = parallel.scan_fastq(path, downsample=50000, threads=4)
+
+    assert summary.reads.seen == 5
+    assert list(summary.reads.items) == [(50.0, 8, 40.0)] * 5
@@ -0,0 +1,82 @@
+"""Tests for the pipeline module."""
+from __future__ import absolute_import
+import gzip
+import pytest
+import pysam
+from pistis import utils, pipeline
+
+# the compressions of the fastq_file fixture to test reading
+COMPRESSIONS = ['plain', 'gzip', 'multi_member', 'bgzf']
+
+
+@pytest.mark.parametrize('fastq_file', COMPRESSIONS, indirect=True)
+def test_summarise_fastq_file_matches_pysam(fastq_file):
+    """Test the pipeline gives the same summary as reading with pysam."""
+    with pysam.FastxFile(fastq_file) as fastq:
+        expected = utils.summarise_fastq(fastq)
+
+    for threads in (1, 3):
+        summary = pipeline.summarise_fastq_file(fastq_file, threads=threads)
+        assert summary.reads.seen == 300
+        assert sorted(summary.reads.items) == sorted(expected.reads.items)
+        assert (summary.bins_from_start.counts ==
+                expected.bins_from_start.counts).all()
+        assert (summary.gc_histogram.counts ==
+                expected.gc_histogram.counts).all()
+
+
+@pytest.mark.parametrize('fastq_file', COMPRESSIONS, indirect=True)
+def test_read_batches_small_batches(fastq_file, monkeypatch):
+    """Test records split across read chunks and batches are kept whole."""
+    monkeypatch.setattr(pipeline, 'READ_SIZE', 1000)
+    lengths = []
+    for _, _, offsets in pipeline.read_batches(fastq_file, max_bases=5000):
+        lengths.extend(offsets[1:] - offsets[:-1])
+
+    with pysam.FastxFile(fastq_file) as fastq:
+        assert lengths == [len(record.sequence) for record in fastq]
+
+
+@pytest.mark.parametrize('fastq_file', COMPRESSIONS, indirect=True)
+def test_read_batches_stops_early(fastq_file):
+    """Test the pipeline threads finish when the batches aren't all read."""
+    batches = pipeline.read_batches(fastq_file, max_bases=1000)
+    next(batches)
+    batches.close()
+
+
+def test_is_bgzf(tmpdir, fastq_file):
+    plain = fastq_file
+    gzipped = str(tmpdir.join('reads.gz.fastq.gz'))
+    with open(plain, 'rb') as fastq, gzip.open(gzipped, 'wb') as out:
+        out.write(fastq.read())
+    bgzipped = str(tmpdir.join('reads.bgz.fastq.gz'))
+    pysam.tabix_compress(plain, bgzipped)
+
+    assert not pipeline.is_bgzf(plain)
+    assert not pipeline.is_bgzf(gzipped)
+    assert pipeline.is_bgzf(bgzipped)
+
+
+def test_windows_line_endings_and_no_final_newline(tmpdir):
+    path = str(tmpdir.join('reads.fastq'))
+    with open(path, 'wb') as fastq:
+        fastq.write(b'@a\r\nACGT\r\n+\r\nIIII\r\n@b\r\nGG\r\n+\r\n##')
+
+    summary = pipeline.summarise_fastq_file(path)
+    assert sorted(read[1] for read in summary.reads.items) == [2, 4]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_truncated_file_raises(tmpdir, fastq_file, compress):
+    with open(fastq_file, 'rb') as fastq:
+        text = fastq.read()
+    path = str(tmpdir.join('truncated.fastq'))
+    with open(path, 'wb') as fastq:
+        if compress:
+            fastq.write(gzip.compress(text)[:-100])
+        else:
+            fastq.write(text[:text.index(b'@read299') + 20])
+
+    with pytest.raises(ValueError):
+        pipeline.summarise_fastq_file(path)
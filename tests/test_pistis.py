@@ -1,7 +1,11 @@
 """Tests for `pistis` package."""
 from __future__ import absolute_import
+import os
+import json
+import click
+import pytest
 from click.testing import CliRunner
-from pistis import pistis
+from pistis import pistis, utils, stats, sketch
 
 
 def test_command_line_interface():
@@ -46,3 +50,202 @@ def test_command_line_interface():
     assert bad_kind_result.exit_code == 2
     assert ('invalid choice: hownowbrowncow. (choose from kde, scatter, hex)'
             in bad_kind_result.output)
+
+
+def test_merge_command(tmpdir):
+    """Test the merge subcommand produces a report from summary files."""
+    summaries = []
+    for i, identities in enumerate(([99.1, 87.5, 95.0], [92.0, 97.3])):
+        alignment_summary = utils.AlignmentSummary()
+        alignment_summary.identities.extend(identities)
+        summaries.append(str(tmpdir.join('run{}.npz'.format(i))))
+        stats.save_stats(summaries[-1], alignment_summary=alignment_summary)
+    merged = str(tmpdir.join('merged.npz'))
+    report = str(tmpdir.join('report.pdf'))
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, ['merge'] + summaries +
+                           ['--output', report, '--save-stats', merged])
+    assert result.exit_code == 0
+    assert os.path.isfile(report)
+    assert (sorted(stats.load_stats(merged)[1].identities.items) ==
+            [87.5, 92.0, 95.0, 97.3, 99.1])
+
+
+def test_fastq_path(tmpdir):
+    """Test fastq paths can be files, directories or globs."""
+    tmpdir.mkdir('barcode01')
+    filenames = [str(tmpdir.join('a.fastq')), str(tmpdir.join('b.fq.gz')),
+                 str(tmpdir.join('barcode01', 'c.fastq'))]
+    for filename in filenames + [str(tmpdir.join('summary.txt'))]:
+        open(filename, 'w').close()
+    path_type = pistis.FastqPath()
+
+    assert (path_type.convert(filenames[0], None, None) ==
+            pistis.FastqInput(filenames[0], [filenames[0]]))
+    assert (path_type.convert(str(tmpdir), None, None) ==
+            pistis.FastqInput(str(tmpdir), sorted(filenames)))
+    assert (path_type.convert(str(tmpdir.join('*.fastq')), None, None) ==
+            pistis.FastqInput(str(tmpdir), [filenames[0]]))
+
+
+def test_fastq_path_glob_skips_indexes(tmpdir):
+    """Test a glob only matches the fastq files, not their indexes."""
+    fastq = str(tmpdir.join('reads.fastq.gz'))
+    for filename in (fastq, fastq + '.gzi', fastq + '.fai'):
+        open(filename, 'w').close()
+    path_type = pistis.FastqPath()
+
+    assert (path_type.convert(str(tmpdir.join('r*.fastq*')), None, None) ==
+            pistis.FastqInput(str(tmpdir), [fastq]))
+    with pytest.raises(click.BadParameter):
+        path_type.convert(str(tmpdir.join('*.gzi')), None, None)
+
+
+def test_metrics_only(tmpdir):
+    """Test --metrics-only writes the metrics without making a report."""
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n')
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--output', str(tmpdir)])
+    assert result.exit_code == 0
+    assert json.loads(result.output)['fastq']['bases'] == 10
+    assert not tmpdir.join('reads.pdf').exists()
+
+    tsv = str(tmpdir.join('metrics.tsv'))
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--metrics', tsv])
+    assert result.exit_code == 0
+    assert 'fastq.reads\t2\n' in tmpdir.join('metrics.tsv').read()
+
+
+def test_profile(tmpdir):
+    """Test --profile writes the measurements of each stage of a run."""
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n')
+    profile = str(tmpdir.join('profile.json'))
+
+    result = CliRunner().invoke(pistis.main, ['--fastq', fastq,
+                                              '--output', str(tmpdir),
+                                              '--profile', profile])
+    assert result.exit_code == 0, result.output
+    measured = json.loads(tmpdir.join('profile.json').read())
+    assert list(measured['stages']) == ['fastq', 'report', 'total']
+    assert measured['stages']['fastq']['bases'] == 10
+    assert 'fastq.parse' in measured['timers']
+    assert 'report.gc_plot' in measured['timers']
+
+
+def test_preview(tmpdir):
+    """Test --preview samples the reads, and needs --downsample."""
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n')
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--preview', '--downsample', '100'])
+    assert result.exit_code == 0, result.output
+    metrics = json.loads(result.output)['fastq']
+    assert metrics['offset_sampled']
+    assert metrics['bases'] == 10
+
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--preview', '--downsample', '0'])
+    assert result.exit_code == 2
+
+
+def test_position_bins(tmpdir):
+    """Test --position-bins collects the quality at every position, and can
+    only re-bin saved summaries that have it."""
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\n{}\n+\n{}\n@b\nGGCCAA\n+\n######\n'.format(
+            'ACGT' * 500, 'I' * 2000))
+    with_profiles = str(tmpdir.join('profiles.npz'))
+    without_profiles = str(tmpdir.join('default.npz'))
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--output',
+                                         str(tmpdir), '--position-bins', 'log',
+                                         '--save-stats', with_profiles])
+    assert result.exit_code == 0, result.output
+    assert tmpdir.join('reads.pdf').exists()
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--save-stats', without_profiles])
+    assert 'quality_relative' not in json.loads(result.output)['fastq']
+
+    result = runner.invoke(pistis.main, ['--from-stats', with_profiles,
+                                         '--metrics-only'])
+    metrics = json.loads(result.output)['fastq']
+    assert metrics['quality_relative']['95-100%']['scores'] == 100
+    result = runner.invoke(pistis.main, ['--from-stats', without_profiles,
+                                         '--output', str(tmpdir),
+                                         '--position-bins', 'all'])
+    assert result.exit_code == 2
+
+
+def test_cache(tmpdir, cache_dir):
+    """Test a rerun on an unchanged file uses the cached summary, unless
+    --no-cache is given."""
+    fastq = tmpdir.join('reads.fastq')
+    fastq.write('@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n')
+    profile = str(tmpdir.join('profile.json'))
+    args = ['--fastq', str(fastq), '--metrics-only', '--profile', profile]
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, args)
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)['fastq']['bases'] == 10
+    assert len(os.listdir(cache_dir)) == 1
+    assert 'fastq.parse' in json.loads(tmpdir.join('profile.json').read())[
+        'timers']
+
+    result = runner.invoke(pistis.main, args)
+    assert json.loads(result.output)['fastq']['bases'] == 10
+    timers = json.loads(tmpdir.join('profile.json').read())['timers']
+    assert 'cache.load' in timers
+    assert 'fastq.parse' not in timers
+
+    result = runner.invoke(pistis.main, args + ['--no-cache'])
+    assert 'fastq.parse' in json.loads(tmpdir.join('profile.json').read())[
+        'timers']
+    result = runner.invoke(pistis.main, args + ['--downsample', '1'])
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_sketch_error(tmpdir, cache_dir):
+    """Test --sketch-error sets the k of the quantile sketches, and is part of
+    the cache key."""
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\nACGT\n+\nIIII\n@b\nGGCCAA\n+\n######\n')
+    saved = str(tmpdir.join('summary.npz'))
+
+    runner = CliRunner()
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--save-stats', saved])
+    assert result.exit_code == 0, result.output
+    assert stats.load_stats(saved)[0].sketch_k == sketch.DEFAULT_K
+    result = runner.invoke(pistis.main, ['--fastq', fastq, '--metrics-only',
+                                         '--sketch-error', '0.001',
+                                         '--save-stats', saved])
+    assert result.exit_code == 0, result.output
+    assert stats.load_stats(saved)[0].length_sketch.k == 1650
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_unreadable_fastq(tmpdir):
+    """Test fastq that can't be read gives a usage error, not a traceback."""
+    fasta = str(tmpdir.join('reads.fastq'))
+    with open(fasta, 'w') as handle:
+        handle.write('>a\nACGT\n')
+
+    result = CliRunner().invoke(pistis.main, ['--fastq', fasta,
+                                              '--metrics-only'])
+    assert result.exit_code == 2
+    assert 'has no quality scores' in result.output
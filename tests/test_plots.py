@@ -2,9 +2,10 @@
 from __future__ import absolute_import
 import pytest
 import os
+import re
 import copy
 import pysam
-import collections
+import numpy as np
 from typing import Tuple, List
 import matplotlib
 matplotlib.use('agg')
@@ -35,8 +36,8 @@ def get_test_data():
 
 get_test_data.__annotations__ = {'return': Tuple[List[float], List[int],
                                                  List[float],
-                                                 collections.OrderedDict,
-                                                 collections.OrderedDict]}
+                                                 utils.PositionalQualities,
+                                                 utils.PositionalQualities]}
 
 
 @pytest.fixture
@@ -122,3 +123,124 @@ def test_save_plots_to_pdf():
     # assert open(fname, 'rb').read() == open(expected_fname, 'rb').read()
     # Open report.pdf and report-expected.pdf and compare by eye. Currently no
     # test to compare two PDF documents.
+
+
+@pytest.mark.parametrize('kind', ['kde', 'hex', 'scatter'])
+def test_length_vs_qual_grid_plot(tmpdir, kind):
+    """Test generation of the binned read length vs. quality score plot."""
+    fname = str(tmpdir.join('len_v_qual_grid_{}.png'.format(kind)))
+    rng = np.random.RandomState(1)
+    lengths = rng.lognormal(8, 1, 2000).astype(int) + 1
+    quality_scores = rng.normal(12, 3, 2000)
+    grid = utils.LengthQualityGrid()
+    grid.add(lengths, quality_scores)
+    reads = utils.ReadTable.from_columns(np.zeros(2000), lengths,
+                                         quality_scores)
+    for sample in ((lengths, quality_scores), reads):
+        fig = plots.length_vs_qual_grid_plot(grid, kind=kind, sample=sample)
+        fig.savefig(fname, format='png')
+        # the joint plot and the two marginal plots
+        assert len(fig.axes) == 3
+        ax_joint = fig.axes[0]
+        assert len(ax_joint.collections) == 1
+        if kind == 'scatter':
+            assert len(ax_joint.collections[0].get_offsets()) == 2000
+        x_min, x_max = ax_joint.get_xlim()
+        assert x_min < np.log10(np.median(lengths)) < x_max
+        y_min, y_max = ax_joint.get_ylim()
+        assert y_min < 12 < y_max
+
+    fig = plots.length_vs_qual_grid_plot(grid, kind=kind, log_length=False)
+    fig.savefig(fname, format='png')
+    x_min, x_max = fig.axes[0].get_xlim()
+    assert x_min < np.median(lengths) < x_max
+    assert x_max > 10 ** 4
+
+
+def test_length_vs_qual_grid_scatter_without_sample():
+    """Test the bin centres drawn by the scatter plot without a sample are
+    within the lengths covered by the other kinds of plot."""
+    rng = np.random.RandomState(1)
+    grid = utils.LengthQualityGrid()
+    grid.add(rng.lognormal(8, 1, 2000).astype(int) + 1,
+             rng.normal(12, 3, 2000))
+    for log_length in (True, False):
+        hex_fig = plots.length_vs_qual_grid_plot(grid, kind='hex',
+                                                 log_length=log_length)
+        x_min, x_max = hex_fig.axes[0].get_xlim()
+        fig = plots.length_vs_qual_grid_plot(grid, kind='scatter',
+                                             log_length=log_length)
+        offsets = fig.axes[0].collections[0].get_offsets()
+        assert len(offsets) == (grid.counts > 0).sum()
+        assert x_min <= offsets[:, 0].min()
+        assert offsets[:, 0].max() <= x_max
+        if log_length:
+            assert 2 < np.median(np.asarray(offsets)[:, 0]) < 5
+
+
+def test_histogram_plots(tmpdir):
+    """Test generation of the GC and percent identity plots from histograms."""
+    histogram = utils.PercentHistogram()
+    histogram.add(np.random.RandomState(2).normal(90, 4, 5000))
+    fig = plots.gc_plot(histogram)
+    fig.savefig(str(tmpdir.join('gc_plot_histogram.png')), format='png')
+    ax = fig.axes[0]
+    assert ax.get_xlim() == (0, 100)
+    assert ax.collections and ax.lines  # the bars and the density curve
+    fig = plots.percent_identity(histogram)
+    fig.savefig(str(tmpdir.join('percent_identity_histogram.png')),
+                format='png')
+    x_min, x_max = fig.axes[0].get_xlim()
+    assert x_min < 90 < x_max
+    bars = fig.axes[0].collections[0].get_paths()
+    assert max(bar.vertices[:, 1].max() for bar in bars) > 0
+    plots.percent_identity(utils.PercentHistogram())
+
+
+def test_save_plot_jobs_to_pdf(tmpdir):
+    """Test a page is saved for each plot."""
+    histogram = utils.PercentHistogram()
+    histogram.add(np.random.RandomState(5).normal(50, 5, 1000))
+    jobs = [(plots.gc_plot, (histogram,)),
+            (plots.percent_identity, (histogram,)),
+            (plots.gc_plot, (histogram,))]
+    fname = str(tmpdir.join('report.pdf'))
+    plots.save_plot_jobs_to_pdf(jobs, fname)
+
+    with open(fname, 'rb') as pdf:
+        content = pdf.read()
+    assert len(re.findall(br'/Type\s*/Page\b', content)) == len(jobs)
+
+
+def test_quality_per_position_profiles(tmpdir):
+    """Test generation of the quality per position plots from every position
+    of long reads, drawn as bands, and of the quality by relative position."""
+    rng = np.random.RandomState(4)
+    lengths = rng.randint(1, 20000, 50)
+    offsets = np.cumsum(np.append(0, lengths))
+    qualities = rng.randint(5, 40, offsets[-1]).astype(np.uint8)
+    summary = utils.FastqSummary(profiles=True)
+    summary.add_batch(np.full(offsets[-1], ord('A'), dtype=np.uint8),
+                      qualities, offsets)
+
+    fig = plots.quality_per_position(summary.profile_from_start.bins('all'),
+                                     log_position=True)
+    fig.savefig(str(tmpdir.join('qual_pos_start_all.png')), format='png')
+    ax = fig.axes[0]
+    # too many bins for boxes, so the quartiles are drawn as bands
+    assert ax.get_xscale() == 'log'
+    assert [len(band.get_paths()) for band in ax.collections] == [1, 1]
+    assert ax.get_xlim()[1] >= lengths.max()
+
+    fig = plots.quality_per_position(
+        summary.profile_from_end.bins('linear', 30), from_end='end')
+    fig.savefig(str(tmpdir.join('qual_pos_end_linear.png')), format='png')
+    ax = fig.axes[0]
+    assert len(ax.collections[0].get_paths()) == 30
+    assert 'from the end' in ax.get_title()
+
+    fig = plots.relative_quality_per_position(summary.relative_qualities)
+    fig.savefig(str(tmpdir.join('qual_pos_relative.png')), format='png')
+    ax = fig.axes[0]
+    assert len(ax.collections[0].get_paths()) == utils.RELATIVE_BINS
+    assert ax.get_xticklabels()[0].get_text() == '0-5%'
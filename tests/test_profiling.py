@@ -0,0 +1,59 @@
+"""Tests for the profiling module."""
+from __future__ import absolute_import
+import json
+import time
+from pistis import profiling
+
+
+def test_session_measures_stages_and_timers(tmpdir):
+    filename = str(tmpdir.join('profile.json'))
+    with profiling.session(filename) as profile:
+        assert isinstance(profile, profiling.Profile)
+        with profiling.stage('fastq'):
+            for _ in range(3):
+                with profiling.timed('fastq.parse', reads=2, bases=10):
+                    time.sleep(0.01)
+        profiling.record('fastq', reads=6, bases=30)
+
+    measured = json.loads(tmpdir.join('profile.json').read())
+    assert list(measured['stages']) == ['fastq', 'total']
+    fastq = measured['stages']['fastq']
+    assert fastq['wall_seconds'] >= 0.03
+    assert (fastq['reads'], fastq['bases']) == (6, 30)
+    assert fastq['max_rss_mb'] > 0
+    assert fastq['reads_per_second'] == 6 / fastq['wall_seconds']
+    parse = measured['timers']['fastq.parse']
+    assert (parse['calls'], parse['reads'], parse['bases']) == (3, 6, 30)
+    assert 0.03 <= parse['seconds'] <= fastq['wall_seconds']
+    # nothing is measured after the session
+    assert profiling.timed('fastq.parse') is profiling._NULL_TIMER
+
+
+def test_no_session_measures_nothing():
+    with profiling.session() as profile:
+        assert profile is None
+        with profiling.stage('fastq'):
+            with profiling.timed('fastq.parse'):
+                pass
+        profiling.record('fastq', reads=1)
+
+
+def test_session_to_stderr(capsys):
+    with profiling.session('-'):
+        with profiling.stage('report'):
+            with profiling.timed('report.gc_plot'):
+                pass
+
+    table = capsys.readouterr().err.splitlines()
+    assert table[0].split()[:3] == ['stage', 'wall', '(s)']
+    assert [line.split()[0] for line in table[1:] if line] == [
+        'report', 'total', 'timer', 'report.gc_plot']
+
+
+def test_cprofile(tmpdir):
+    import pstats
+    filename = str(tmpdir.join('run.prof'))
+    with profiling.session(cprofile_file=filename):
+        sorted(range(1000))
+
+    assert pstats.Stats(filename).total_calls > 0
@@ -0,0 +1,127 @@
+"""Tests for the sampling module."""
+from __future__ import absolute_import
+import gzip
+import random
+import pytest
+import pysam
+from pistis import utils, sampling
+
+
+@pytest.mark.parametrize('fastq_file', ['plain', 'bgzf'], indirect=True)
+def test_sample_fastq_files(fastq_file):
+    """Test the sampled reads are distinct reads from the file."""
+    with pysam.FastxFile(fastq_file) as fastq:
+        expected = set(utils.summarise_fastq(fastq).reads.items)
+    summary = sampling.sample_fastq_files([fastq_file], 50, seed=1)
+
+    assert summary.offset_sampled
+    assert 40 < summary.reads.seen <= 50
+    assert len(set(summary.reads.items)) == summary.reads.seen
+    assert all(read in expected for read in summary.reads.items)
+
+    # with many more offsets than reads, every read is sampled once
+    summary = sampling.sample_fastq_files([fastq_file, fastq_file], 50000,
+                                          seed=1)
+    assert summary.reads.seen == 600
+    assert set(summary.reads.items) == expected
+
+
+def test_can_sample_fastq(fastq_file):
+    """Test only uncompressed and indexed BGZF fastq files can be sampled."""
+    path = fastq_file
+    assert sampling.can_sample_fastq(path)
+
+    with open(path, 'rb') as fastq, gzip.open(path + '.gz', 'wb') as gz:
+        gz.write(fastq.read())
+    assert not sampling.can_sample_fastq(path + '.gz')
+
+    pysam.tabix_compress(path, path + '.gz', force=True)
+    assert not sampling.can_sample_fastq(path + '.gz')
+    pysam.fqidx(path + '.gz')
+    assert sampling.can_sample_fastq(path + '.gz')
+
+
+def test_bgzf_reader(fastq_file):
+    """Test lines are read from any offset, across block boundaries."""
+    path = fastq_file
+    with open(path, 'rb') as fastq:
+        data = fastq.read()
+    pysam.tabix_compress(path, path + '.gz', force=True)
+    pysam.fqidx(path + '.gz')
+
+    with sampling.BgzfReader(path + '.gz') as reader:
+        assert reader.size == len(data)
+        for offset in list(range(0, len(data), 997)) + [len(data)]:
+            reader.seek(offset)
+            end = data.find(b'\n', offset) + 1 or len(data)
+            assert reader.readline() == data[offset:end]
+            assert reader.tell() == end
+        reader.seek(-3, 2)
+        assert reader.readline() == data[-3:]
+        assert reader.readline() == b''
+
+
+@pytest.fixture
+def indexed_bam(tmpdir):
+    """Writes a sorted, indexed BAM file of 2000 alignments to two contigs.
+    One in five reads is unmapped.
+
+    Returns:
+        The path to the BAM file.
+    """
+    rng = random.Random(7)
+    path = str(tmpdir.join('alignments.bam'))
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'chr1', 'LN': 200000},
+                     {'SN': 'chr2', 'LN': 50000}]}
+    records = []
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        for i in range(2000):
+            length = rng.randint(100, 2000)
+            record = pysam.AlignedSegment(bam.header)
+            record.query_name = 'read{}'.format(i)
+            record.query_sequence = 'A' * length
+            record.reference_id = rng.randint(0, 1)
+            record.reference_start = rng.randint(0, 40000)
+            record.cigartuples = [(0, length)]
+            record.flag = 4 if i % 5 == 0 else 0
+            record.set_tag('NM', rng.randint(0, length // 5))
+            records.append(record)
+        for record in sorted(records, key=lambda r: (r.reference_id,
+                                                     r.reference_start)):
+            bam.write(record)
+    pysam.index(path)
+
+    return path
+
+
+def test_sample_alignments(indexed_bam):
+    """Test the sampled alignments are distinct primary, mapped alignments
+    from the file."""
+    expected = utils.sam_percent_identity(indexed_bam)
+    assert sampling.can_sample_alignments(indexed_bam)
+    summary = sampling.sample_alignments(indexed_bam, 200, seed=2)
+
+    assert summary.offset_sampled
+    assert 100 < summary.identity_sketch.count <= 200
+    assert all(identity in expected for identity in summary.identities.items)
+
+    summary = sampling.sample_alignments(indexed_bam, 200000, seed=2)
+    assert sorted(summary.identities.items) == sorted(expected)
+
+
+def test_read_bai_offsets(indexed_bam):
+    """Test the offsets in the index are the starts of records."""
+    starts, end = sampling.read_bai_offsets(indexed_bam + '.bai')
+    with pysam.AlignmentFile(indexed_bam, 'rb') as bam:
+        first = bam.tell()
+        offsets = set()
+        while True:
+            offset = bam.tell()
+            if next(bam, None) is None:
+                break
+            offsets.add(offset)
+
+    assert starts[0] == first
+    assert set(starts.tolist()) <= offsets
+    assert max(offsets) < end
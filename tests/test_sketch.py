@@ -0,0 +1,82 @@
+"""Tests for the sketch module."""
+from __future__ import absolute_import
+import random
+import numpy as np
+import pytest
+from pistis import sketch
+
+FRACTIONS = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def _rank_errors(kll, values):
+    """The error in the rank of each estimated quantile, as a fraction."""
+    values = np.sort(values)
+    estimates = kll.quantiles(FRACTIONS)
+    ranks = np.searchsorted(values, estimates, side='right') / len(values)
+    return np.abs(ranks - FRACTIONS)
+
+
+def test_quantiles_within_error():
+    values = np.random.RandomState(0).lognormal(8, 1, 200000)
+    kll = sketch.KLLSketch(k=sketch.k_for_error(0.01), rng=random.Random(1))
+    for batch in np.array_split(values, 37):
+        kll.add(batch)
+
+    assert kll.count == len(values)
+    assert kll.mean() == pytest.approx(values.mean())
+    assert (kll.min, kll.max) == (values.min(), values.max())
+    assert (_rank_errors(kll, values) < 0.01).all()
+    # memory is bounded by k, not the number of values
+    assert len(kll.weighted_values()[0]) < 4 * kll.k
+    assert kll.weighted_values()[1].sum() == pytest.approx(len(values))
+
+
+def test_merge_within_error():
+    rng = np.random.RandomState(2)
+    parts = [rng.normal(mean, 3, 30000) for mean in (5, 10, 20)]
+    merged = sketch.KLLSketch(rng=random.Random(3))
+    for part in parts:
+        kll = sketch.KLLSketch(k=100, rng=random.Random(4))
+        kll.add(part)
+        merged.merge(kll)
+
+    values = np.concatenate(parts)
+    assert merged.count == len(values)
+    assert (_rank_errors(merged, values) < 0.03).all()
+
+
+def test_add_value_and_serialisation():
+    kll = sketch.KLLSketch(k=20)
+    for value in range(1010):
+        kll.add_value(value)
+        # the counters include the values still buffered
+        assert (kll.count, kll.max) == (value + 1, value)
+    kll.add([np.nan, np.inf])
+    kll.add_value(float('nan'))
+
+    copy = sketch.KLLSketch.from_arrays(kll.to_arrays())
+    assert copy.count == kll.count == 1010
+    assert copy.k == 20
+    assert list(copy.quantiles(FRACTIONS)) == list(kll.quantiles(FRACTIONS))
+    assert copy.quantile(0) == 0
+    assert copy.quantile(1) == 1009
+
+
+def test_n50():
+    lengths = np.random.RandomState(5).lognormal(8, 1, 50000).astype(int)
+    kll = sketch.KLLSketch(k=400)
+    kll.add(lengths)
+
+    ordered = np.sort(lengths)[::-1]
+    expected = ordered[np.searchsorted(np.cumsum(ordered),
+                                       lengths.sum() / 2)]
+    assert sketch.n50(kll) == pytest.approx(expected, rel=0.05)
+
+
+def test_empty_sketch():
+    kll = sketch.KLLSketch()
+    assert np.isnan(kll.quantile(0.5))
+    assert np.isnan(kll.mean())
+    assert np.isnan(sketch.n50(kll))
+    assert np.isnan(sketch.describe(kll)['p50'])
+    assert sketch.describe(kll)['count'] == 0
@@ -0,0 +1,42 @@
+"""Tests that the command line interface starts up without importing the slow
+to import plotting and alignment libraries, unless they are needed."""
+from __future__ import absolute_import
+import sys
+import json
+import subprocess
+
+HEAVY_MODULES = ('matplotlib', 'seaborn', 'pysam', 'scipy', 'pandas')
+
+
+def _modules_imported(code):
+    """Run code in a fresh interpreter and return which of `HEAVY_MODULES` it
+    imported."""
+    script = (code + '\nimport sys, json\n'
+              'print(json.dumps([name for name in {!r} '
+              'if name in sys.modules]))'.format(HEAVY_MODULES))
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_import_is_light():
+    assert _modules_imported('import pistis.pistis') == []
+
+
+def test_help_is_light():
+    code = ("from click.testing import CliRunner\n"
+            "from pistis import pistis\n"
+            "result = CliRunner().invoke(pistis.main, ['--help'])\n"
+            "assert result.exit_code == 0")
+    assert _modules_imported(code) == []
+
+
+def test_metrics_only_is_light(tmpdir):
+    fastq = str(tmpdir.join('reads.fastq'))
+    with open(fastq, 'w') as handle:
+        handle.write('@a\nACGT\n+\nIIII\n')
+    code = ("from click.testing import CliRunner\n"
+            "from pistis import pistis\n"
+            "result = CliRunner().invoke(pistis.main, ['-f', {!r}, "
+            "'--metrics-only'])\n"
+            "assert result.exit_code == 0, result.output".format(fastq))
+    assert _modules_imported(code) == []
@@ -0,0 +1,154 @@
+"""Tests for the stats module."""
+from __future__ import absolute_import
+import random
+import numpy as np
+import pytest
+from pistis import utils, stats, sketch
+
+
+@pytest.fixture
+def fastq_summary():
+    """Creates a fastq summary of 100 random reads, down-sampled to 30.
+
+    Returns:
+        A `utils.FastqSummary`.
+    """
+    rng = random.Random(3)
+    sequences = [''.join(rng.choice('ACGTN')
+                         for _ in range(rng.randint(1, 500)))
+                 for _ in range(100)]
+    qualities = [''.join(chr(rng.randint(33, 73)) for _ in sequence)
+                 for sequence in sequences]
+    summary = utils.FastqSummary(30)
+    summary.add_batch(*utils.pack_reads(sequences, qualities))
+
+    return summary
+
+
+def test_save_and_load_stats(tmpdir, fastq_summary):
+    """Test a summary is the same after saving and loading it."""
+    alignment_summary = utils.AlignmentSummary()
+    alignment_summary.identities.extend([99.1, 87.5, 92.0])
+    alignment_summary.offset_sampled = True
+    filename = str(tmpdir.join('summary.stats'))
+    stats.save_stats(filename, fastq_summary, alignment_summary)
+    loaded_fastq, loaded_alignment = stats.load_stats(filename)
+
+    assert loaded_fastq.reads.items == fastq_summary.reads.items
+    assert loaded_fastq.reads.seen == 100
+    assert (loaded_fastq.bins_from_start.counts ==
+            fastq_summary.bins_from_start.counts).all()
+    assert (loaded_fastq.bins_from_end.counts ==
+            fastq_summary.bins_from_end.counts).all()
+    assert loaded_fastq.bins_from_end.names == utils.BIN_NAMES
+    assert loaded_alignment.identities.items == [99.1, 87.5, 92.0]
+    assert not loaded_fastq.offset_sampled
+    assert loaded_alignment.offset_sampled
+
+    # a loaded reservoir keeps sampling where the saved one left off
+    loaded_fastq.reads.extend([(50.0, 100, 10.0)] * 100)
+    assert loaded_fastq.reads.seen == 200
+    assert len(loaded_fastq.reads.items) == 30
+
+
+def test_load_stats_only_fastq(tmpdir, fastq_summary):
+    """Test loading a summary without alignment data."""
+    filename = str(tmpdir.join('summary.npz'))
+    stats.save_stats(filename, fastq_summary=fastq_summary)
+    loaded_fastq, loaded_alignment = stats.load_stats(filename)
+
+    assert loaded_fastq.as_tuple()[:3] == fastq_summary.as_tuple()[:3]
+    assert loaded_alignment is None
+
+
+def test_load_stats_bad_version(tmpdir):
+    """Test loading a summary with an unknown format version fails."""
+    filename = str(tmpdir.join('summary.npz'))
+    np.savez(filename, format_version=np.array(999))
+    with pytest.raises(ValueError):
+        stats.load_stats(filename)
+
+
+def test_load_stats_missing_arrays(tmpdir, fastq_summary):
+    """Test loading a summary with missing arrays fails, rather than filling
+    them in with defaults."""
+    filename = str(tmpdir.join('summary.npz'))
+    arrays = utils.nest_arrays('fastq', fastq_summary.to_arrays())
+    del arrays['fastq/sketch_k']
+    np.savez(filename, format_version=np.array(stats.STATS_FORMAT_VERSION),
+             **arrays)
+    with pytest.raises(KeyError):
+        stats.load_stats(filename)
+
+
+def test_merge_stats(tmpdir, fastq_summary):
+    """Test merging summary files combines the data from each."""
+    first_alignments = utils.AlignmentSummary()
+    first_alignments.identities.extend([99.1, 87.5])
+    second_alignments = utils.AlignmentSummary()
+    second_alignments.identities.extend([92.0])
+    first = str(tmpdir.join('first.npz'))
+    second = str(tmpdir.join('second.npz'))
+    third = str(tmpdir.join('third.npz'))
+    stats.save_stats(first, fastq_summary, first_alignments)
+    stats.save_stats(second, fastq_summary)
+    stats.save_stats(third, alignment_summary=second_alignments)
+    merged_fastq, merged_alignments = stats.merge_stats([first, second,
+                                                         third])
+
+    assert merged_fastq.reads.seen == 200
+    assert len(merged_fastq.reads.items) == 30
+    assert all(read in fastq_summary.reads.items
+               for read in merged_fastq.reads.items)
+    assert (merged_fastq.bins_from_start.counts ==
+            2 * fastq_summary.bins_from_start.counts).all()
+    assert sorted(merged_alignments.identities.items) == [87.5, 92.0, 99.1]
+
+
+def test_merge_stats_different_downsampling(tmpdir, fastq_summary):
+    """Test merging summaries down-sampled to different sizes fails."""
+    other_summary = utils.FastqSummary(10)
+    other_summary.add_batch(*utils.pack_reads(['ACGT'] * 20, ['IIII'] * 20))
+    first = str(tmpdir.join('first.npz'))
+    second = str(tmpdir.join('second.npz'))
+    stats.save_stats(first, fastq_summary)
+    stats.save_stats(second, other_summary)
+    with pytest.raises(ValueError):
+        stats.merge_stats([first, second])
+
+
+def test_save_and_load_profiles(tmpdir):
+    """Test the per-position profiles of a summary are saved, and that
+    summaries without them still load without them."""
+    summary = utils.FastqSummary(profiles=True)
+    summary.add_batch(*utils.pack_reads(['ACGT' * 500, 'GC'],
+                                        ['I' * 2000, '##']))
+    filename = str(tmpdir.join('summary.npz'))
+    stats.save_stats(filename, summary)
+    loaded, _ = stats.load_stats(filename)
+
+    assert loaded.profiles
+    for name in utils.PROFILES:
+        assert (getattr(loaded, name).counts ==
+                getattr(summary, name).counts).all()
+    assert loaded.profile_from_end.from_end
+    assert loaded.profile_from_start.max_length == 2000
+
+    stats.save_stats(filename, utils.FastqSummary())
+    assert not stats.load_stats(filename)[0].profiles
+
+
+def test_save_and_load_sketch_k(tmpdir):
+    """Test the k of the quantile sketches is saved with the summaries."""
+    fastq_summary = utils.FastqSummary(sketch_k=sketch.k_for_error(0.001))
+    fastq_summary.add_batch(*utils.pack_reads(['ACGT'] * 20, ['IIII'] * 20))
+    alignment_summary = utils.AlignmentSummary(sketch_k=50)
+    filename = str(tmpdir.join('summary.npz'))
+    stats.save_stats(filename, fastq_summary, alignment_summary)
+    loaded_fastq, loaded_alignment = stats.load_stats(filename)
+
+    assert loaded_fastq.sketch_k == 1650
+    assert all(getattr(loaded_fastq, name).k == 1650
+               for name in utils.SKETCHED_READ_METRICS)
+    assert loaded_alignment.sketch_k == 50
+    assert loaded_alignment.identity_sketch.k == 50
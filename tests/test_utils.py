@@ -1,8 +1,13 @@
 """Tests for the utils module."""
+from __future__ import division
 from __future__ import absolute_import
 import copy
+import pickle
+import random
 import pytest
 import pysam
+import numpy as np
+from matplotlib import cbook
 from pistis import utils
 from six.moves import zip
 
@@ -63,25 +68,20 @@ def test_collect_fastq_data():
                for x, y in
                zip(sorted(correct_quality_means), sorted(mean_quality_scores)))
     # test df start bins are correct
-    assert all(x == y
-               for x, y in
-               zip(sorted(correct_df_start_pos_1), sorted(df_start['1'])))
-    assert all(x == y
-               for x, y in
-               zip(sorted(correct_df_start_pos_4), sorted(df_start['4'])))
-    assert all(x == y
-               for x, y in zip(sorted(correct_df_start_pos_11_20),
-                               sorted(df_start['11-20'])))
+    assert list(_expand(df_start['1'])) == sorted(correct_df_start_pos_1)
+    assert list(_expand(df_start['4'])) == sorted(correct_df_start_pos_4)
+    assert (list(_expand(df_start['11-20'])) ==
+            sorted(correct_df_start_pos_11_20))
     # test df end bins are correct
-    assert all(x == y
-               for x, y in
-               zip(sorted(correct_df_end_pos_3), sorted(df_end['3'])))
-    assert all(x == y
-               for x, y in
-               zip(sorted(correct_df_end_pos_10), sorted(df_end['10'])))
-    assert all(x == y
-               for x, y in
-               zip(sorted(correct_df_end_pos_11_20), sorted(df_end['11-20'])))
+    assert list(_expand(df_end['3'])) == sorted(correct_df_end_pos_3)
+    assert list(_expand(df_end['10'])) == sorted(correct_df_end_pos_10)
+    assert (list(_expand(df_end['11-20'])) ==
+            sorted(correct_df_end_pos_11_20))
+
+
+def _expand(counts):
+    """Expand a histogram of quality score counts into sorted scores."""
+    return np.repeat(np.arange(len(counts)), counts)
 
 
 def test_gc_content():
@@ -98,3 +98,486 @@ def test_gc_content():
         assert pytest.approx(utils.gc_content(test)) == answer
         assert (pytest.approx(utils.gc_content(test, as_decimal=False) ==
                               answer * 100))
+
+
+def test_reservoir_size_is_bounded():
+    """Test the reservoir never holds more than its size."""
+    reservoir = utils.Reservoir(10, rng=random.Random(1))
+    for i in range(1000):
+        reservoir.add(i)
+    assert len(reservoir.items) == 10
+    assert reservoir.seen == 1000
+    assert len(set(reservoir.items)) == 10
+
+
+def test_reservoir_keeps_everything_when_size_zero():
+    """Test a reservoir of size 0 keeps every item in order."""
+    reservoir = utils.Reservoir(0)
+    reservoir.extend([3, 1, 2])
+    reservoir.add(5)
+    assert reservoir.items == [3, 1, 2, 5]
+
+
+def test_reservoir_partial():
+    """Test extending or merging a reservoir that isn't full yet with empty or
+    short sequences keeps every item."""
+    reservoir = utils.Reservoir(10, rng=random.Random(1))
+    reservoir.extend([1, 2, 3])
+    reservoir.extend([])
+    assert reservoir.items == [1, 2, 3]
+
+    reservoir.merge(utils.Reservoir(10))
+    assert reservoir.items == [1, 2, 3]
+    assert reservoir.seen == 3
+
+    other = utils.Reservoir(10)
+    other.extend([4, 5, 6, 7])
+    reservoir.merge(other)
+    assert reservoir.items == [1, 2, 3, 4, 5, 6, 7]
+    assert reservoir.seen == 7
+
+    # the reservoir carries on sampling once it is full
+    reservoir.extend(list(range(8, 100)))
+    assert len(reservoir.items) == 10
+    assert reservoir.seen == 99
+    assert set(reservoir.items) - set(range(1, 100)) == set()
+
+
+def test_reservoir_is_uniform():
+    """Test every item has the same chance of ending up in the sample."""
+    counts = [0] * 20
+    for seed in range(2000):
+        reservoir = utils.Reservoir(5, rng=random.Random(seed))
+        reservoir.extend(list(range(12)))
+        reservoir.extend(list(range(12, 20)))
+        for item in reservoir.items:
+            counts[item] += 1
+    # each item is expected to be sampled 2000 * 5 / 20 = 500 times
+    assert all(400 < count < 600 for count in counts)
+
+
+def test_read_table():
+    """Test a read table holds the metrics of each read in typed columns."""
+    table = utils.ReadTable()
+    table.extend(utils.ReadTable.from_columns([40.5, 60.0], [1000, 70000],
+                                              [12.25, 9.5]))
+    table.extend([(50.0, 12, 7.0)])
+
+    assert len(table) == 3
+    assert table.length.dtype == np.uint32
+    assert table.mean_quality.dtype == np.float32
+    assert table.nbytes == 12 * len(table)
+    assert list(table) == [(40.5, 1000, 12.25), (60.0, 70000, 9.5),
+                           (50.0, 12, 7.0)]
+    assert table[-1] == (50.0, 12, 7.0)
+    assert list(table[1:]) == list(table)[1:]
+    assert list(table.take([2, 0])) == [table[2], table[0]]
+    table[0] = (0.0, 5, 1.0)
+    assert table[0] == (0.0, 5, 1.0)
+    with pytest.raises(IndexError):
+        table[3]
+
+    assert utils.ReadTable.from_arrays(table.to_arrays()) == table
+    assert pickle.loads(pickle.dumps(table)) == table
+    assert table.column('channel') is None
+    with pytest.raises(ValueError):
+        utils.ReadTable.from_columns([1.0], [1], [1.0], barcode=[1])
+
+
+def test_read_table_optional_columns():
+    """Test optional columns are only stored once they are used, and are 0
+    for the reads they weren't given for."""
+    table = utils.ReadTable.from_rows([(50.0, 100, 10.0)])
+    table.extend(utils.ReadTable.from_columns([40.0], [200], [20.0],
+                                              channel=[512]))
+
+    assert table.column('channel').dtype == np.uint16
+    assert list(table.column('channel')) == [0, 512]
+    assert table.nbytes == 14 * len(table)
+    table.extend([(30.0, 300, 30.0)])
+    assert list(table.column('channel')) == [0, 512, 0]
+    assert list(table.take([1]).column('channel')) == [512]
+
+
+def test_reservoir_read_table():
+    """Test a reservoir keeping its sample in a read table samples the same
+    reads as one keeping them in a list."""
+    rows = [(float(i % 100), i, float(i % 40)) for i in range(1000)]
+    in_list = utils.Reservoir(50, rng=random.Random(4))
+    in_table = utils.Reservoir(50, rng=random.Random(4),
+                               items=utils.ReadTable())
+    for start in range(0, 1000, 64):
+        in_list.extend(rows[start:start + 64])
+        in_table.extend(utils.ReadTable.from_rows(rows[start:start + 64]))
+    assert list(in_table.items) == in_list.items
+
+    in_list.merge(copy.deepcopy(in_list))
+    in_table.merge(copy.deepcopy(in_table))
+    assert list(in_table.items) == in_list.items
+    assert len(in_table.items) == 50
+
+
+def test_collect_fastq_data_downsample(fastq_file):
+    """Test down-sampling keeps the metrics of each read together."""
+    with pysam.FastxFile(fastq_file) as fastq:
+        expected = utils.collect_fastq_data(fastq)
+    with pysam.FastxFile(fastq_file) as fastq:
+        sampled = utils.collect_fastq_data(fastq, downsample=50)
+
+    expected_reads = set(zip(*expected[:3]))
+    sampled_reads = list(zip(*sampled[:3]))
+    assert len(expected_reads) == 300
+    assert len(sampled_reads) == 50
+    assert all(read in expected_reads for read in sampled_reads)
+    # positional bins are exact over all reads, regardless of down-sampling
+    assert (sampled[3].counts == expected[3].counts).all()
+    assert (sampled[4].counts == expected[4].counts).all()
+
+
+def test_positional_qualities_bins_from_both_ends():
+    """Test quality scores are counted in the correct positional bins."""
+    q_scores = np.arange(30, dtype=np.uint8)
+    bins_from_start = utils.PositionalQualities()
+    bins_from_end = utils.PositionalQualities()
+    bins_from_start.add(q_scores)
+    bins_from_end.add(q_scores[::-1])
+
+    assert list(_expand(bins_from_start['1'])) == [0]
+    assert list(_expand(bins_from_start['11-20'])) == list(range(10, 21))
+    assert list(_expand(bins_from_start['21-50'])) == list(range(21, 30))
+    assert list(_expand(bins_from_end['1'])) == [29]
+    assert list(_expand(bins_from_end['10'])) == [20]
+    assert bins_from_end['201-300'].sum() == 0
+
+
+def test_positional_qualities_boxplot_stats():
+    """Test box plot statistics from counts match those from the raw data."""
+    rng = np.random.RandomState(7)
+    bins = utils.PositionalQualities()
+    reads = [rng.randint(0, 41, size=rng.randint(5, 400)).astype(np.uint8)
+             for _ in range(100)]
+    for q_scores in reads:
+        bins.add(q_scores)
+
+    stats = bins.boxplot_stats()
+    for idx, (start, end) in ((0, (0, 1)), (10, (10, 21)), (14, (201, 301))):
+        scores = np.concatenate([q_scores[start:end] for q_scores in reads])
+        expected = cbook.boxplot_stats(scores)[0]
+        for key in ('med', 'q1', 'q3', 'whislo', 'whishi', 'mean'):
+            assert pytest.approx(expected[key]) == stats[idx][key]
+        assert set(expected['fliers']) == set(stats[idx]['fliers'])
+
+
+def test_positional_qualities_boxplot_stats_small_bins():
+    """Test box plot statistics of bins with few, spread out scores, whose
+    whiskers can fall inside the box, match matplotlib's."""
+    rng = np.random.RandomState(11)
+    for _ in range(500):
+        bins = utils.PositionalQualities()
+        scores = rng.randint(0, 41, size=rng.randint(1, 6)).astype(np.uint8)
+        for score in scores:  # reads of one base, all in the first bin
+            bins.add(np.array([score], dtype=np.uint8))
+        stats = bins.boxplot_stats()[0]
+        expected = cbook.boxplot_stats(np.repeat(np.arange(utils.PHRED_RANGE),
+                                                 bins.counts[0]))[0]
+        for key in ('med', 'q1', 'q3', 'whislo', 'whishi', 'mean'):
+            assert pytest.approx(expected[key]) == stats[key]
+        assert stats['whislo'] <= stats['q1'] <= stats['q3'] <= stats['whishi']
+        assert set(expected['fliers']) == set(stats['fliers'])
+
+
+def test_read_metrics():
+    """Test the batched metrics match those calculated read by read."""
+    sequences = ['ACGTNN', 'ggcs', 'AT', '', 'ACGTACGTAA']
+    qualities = ['!!!!!!', '+++I', '5I', '', 'ABCDEFGHIJ']
+    sequence_buffer, quality_buffer, offsets = utils.pack_reads(sequences,
+                                                                qualities)
+    gc_percent, lengths, mean_qualities = utils.read_metrics(
+        sequence_buffer, quality_buffer, offsets)
+
+    assert list(lengths) == [len(sequence) for sequence in sequences]
+    for i, (sequence, quality) in enumerate(zip(sequences, qualities)):
+        if not sequence:
+            continue
+        assert (pytest.approx(utils.gc_content(sequence, as_decimal=False)) ==
+                gc_percent[i])
+        assert (pytest.approx(np.mean([ord(q) - 33 for q in quality])) ==
+                mean_qualities[i])
+
+
+def test_positional_qualities_add_batch():
+    """Test binning a batch of reads at once matches binning one by one."""
+    rng = np.random.RandomState(3)
+    reads = [rng.randint(0, 41, size=rng.randint(1, 400)).astype(np.uint8)
+             for _ in range(20)]
+    offsets = np.cumsum([0] + [len(q_scores) for q_scores in reads])
+    qualities = np.concatenate(reads)
+    for from_end in (False, True):
+        batched = utils.PositionalQualities()
+        batched.add_batch(qualities, offsets, from_end=from_end)
+        one_by_one = utils.PositionalQualities()
+        for q_scores in reads:
+            one_by_one.add(q_scores[::-1] if from_end else q_scores)
+        assert (batched.counts == one_by_one.counts).all()
+
+
+def _random_reads(rng, num_reads, max_length):
+    """Random quality scores of reads of random length, packed into a batch."""
+    reads = [rng.randint(0, 41, size=rng.randint(1, max_length)).astype(
+        np.uint8) for _ in range(num_reads)]
+    offsets = np.cumsum([0] + [len(q_scores) for q_scores in reads])
+
+    return reads, np.concatenate(reads), offsets
+
+
+def test_position_buckets():
+    """Test positions are counted in the bucket starting at or before them,
+    and buckets past the exact ones are under 1% as wide as their start."""
+    positions = np.arange(3 * 10 ** 6)
+    buckets = utils.position_buckets(positions)
+    starts = utils.bucket_starts(buckets[-1] + 2)
+
+    assert (np.diff(buckets) >= 0).all()
+    assert (starts[buckets] <= positions).all()
+    assert (positions < starts[buckets + 1]).all()
+    assert (buckets[:1024] == positions[:1024]).all()
+    assert (np.diff(starts)[1024:] / starts[1024:-1] <= 0.01).all()
+    assert len(starts) < 2500
+
+
+def test_position_profile():
+    """Test a profile counts the quality at every position of the reads,
+    from either end."""
+    rng = np.random.RandomState(11)
+    reads, qualities, offsets = _random_reads(rng, 30, 3000)
+    for from_end in (False, True):
+        profile = utils.PositionProfile(from_end)
+        profile.add_batch(qualities, offsets[:11])
+        profile.add_batch(qualities, offsets[10:])
+        expected = np.zeros((max(map(len, reads)), utils.PHRED_RANGE),
+                            dtype=np.int64)
+        for q_scores in reads:
+            positions = np.arange(len(q_scores))
+            np.add.at(expected, (positions, q_scores[::-1] if from_end
+                                 else q_scores), 1)
+        assert profile.max_length == len(expected)
+        assert (profile.counts[:1024] == expected[:1024]).all()
+        assert (profile.counts.sum(axis=0) == expected.sum(axis=0)).all()
+
+        bins = utils.PositionalQualities()
+        bins.add_batch(qualities, offsets, from_end)
+        assert (profile.bins().counts == bins.counts).all()
+        assert profile.bins().names == utils.BIN_NAMES
+        for binning in ('linear', 'log', 'all'):
+            binned = profile.bins(binning, 40)
+            assert binned.counts.sum() == len(qualities)
+            assert binned.starts[-1] == profile.max_length
+        assert len(profile.bins('linear', 40).names) <= 40
+        assert profile.bins('all').names[:3] == ['1', '2', '3']
+    with pytest.raises(ValueError):
+        profile.bins('quadratic')
+
+
+def test_position_profile_merge():
+    """Test merging profiles of two batches of reads matches adding both
+    batches to one, and that they survive saving."""
+    rng = np.random.RandomState(5)
+    _, short_qualities, short_offsets = _random_reads(rng, 10, 100)
+    _, long_qualities, long_offsets = _random_reads(rng, 10, 50000)
+    both = utils.PositionProfile()
+    both.add_batch(short_qualities, short_offsets)
+    both.add_batch(long_qualities, long_offsets)
+    merged = utils.PositionProfile()
+    merged.add_batch(short_qualities, short_offsets)
+    other = utils.PositionProfile()
+    other.add_batch(long_qualities, long_offsets)
+    merged.merge(utils.PositionProfile.from_arrays(other.to_arrays()))
+
+    assert (merged.counts == both.counts).all()
+    assert merged.max_length == both.max_length
+    with pytest.raises(ValueError):
+        merged.merge(utils.PositionProfile(from_end=True))
+
+
+def test_relative_qualities():
+    """Test quality scores are counted by their position relative to the
+    length of the read."""
+    rng = np.random.RandomState(8)
+    reads, qualities, offsets = _random_reads(rng, 50, 200)
+    for from_end in (False, True):
+        relative = utils.RelativeQualities()
+        relative.add_batch(qualities, offsets, from_end)
+        expected = np.zeros_like(relative.counts)
+        for q_scores in reads:
+            if from_end:
+                q_scores = q_scores[::-1]
+            positions = np.arange(len(q_scores))
+            np.add.at(expected, (positions * 20 // len(q_scores), q_scores),
+                      1)
+        assert (relative.counts == expected).all()
+    assert relative.names[0] == '0-5%'
+    assert relative.names[-1] == '95-100%'
+
+
+def test_fastq_summary_profiles():
+    """Test summaries only collect profiles when asked to, and that summaries
+    with and without them can't be merged."""
+    sequences = ['ACGT' * 300, 'GC']
+    batch = utils.pack_reads(sequences, ['I' * len(sequence)
+                                         for sequence in sequences])
+    summary = utils.FastqSummary(profiles=True)
+    summary.add_batch(*batch)
+
+    assert list(summary.profile_from_start.counts[:3, 40]) == [2, 2, 1]
+    assert summary.profile_from_start.bins('all').counts.sum() == 1202
+    assert summary.profile_from_end.bins()['1'][40] == 2
+    assert summary.relative_qualities['0-5%'][40] == 61
+    assert utils.FastqSummary().relative_qualities is None
+    with pytest.raises(ValueError):
+        summary.merge(utils.FastqSummary())
+
+
+def test_reservoir_merge_is_uniform():
+    """Test merging reservoirs of two streams samples uniformly from both."""
+    counts = [0] * 40
+    for seed in range(2000):
+        rng = random.Random(seed)
+        first = utils.Reservoir(5, rng=rng)
+        first.extend(list(range(10)))
+        second = utils.Reservoir(5, rng=rng)
+        second.extend(list(range(10, 30)))
+        first.merge(second)
+        # keep streaming after the merge
+        first.extend(list(range(30, 40)))
+        assert first.seen == 40
+        for item in first.items:
+            counts[item] += 1
+    # each item is expected to be sampled 2000 * 5 / 40 = 250 times
+    assert all(180 < count < 320 for count in counts)
+
+
+def test_gc_content_batch():
+    """Test batched GC content matches GC content for each sequence."""
+    sequences = ['cgCG', 'tTaA', 'GCAT', 'GCATNN', 'GCATNNS', 'GCATNNSK',
+                 'NNNN']
+    sequence_buffer, _, offsets = utils.pack_reads(sequences, sequences)
+    result = utils.gc_content_batch(sequence_buffer, offsets)
+    percentages = utils.gc_content_batch(sequence_buffer, offsets,
+                                         as_decimal=False)
+
+    for i, sequence in enumerate(sequences[:-1]):
+        assert pytest.approx(utils.gc_content(sequence)) == result[i]
+        assert (pytest.approx(utils.gc_content(sequence.encode('ascii'))) ==
+                result[i])
+        assert pytest.approx(result[i] * 100) == percentages[i]
+    assert np.isnan(result[-1])
+
+
+def test_length_quality_grid():
+    grid = utils.LengthQualityGrid(length_bins=7, quality_bins=6,
+                                   log_length_range=(0, 7),
+                                   quality_range=(0, 60))
+    lengths = np.array([5, 150, 2000, 2000, 10 ** 9, 0])
+    qualities = np.array([5.0, 12.0, 59.0, 75.0, 30.0, 10.0])
+    grid.add(lengths, qualities)
+
+    expected = np.zeros((7, 6), dtype=int)
+    expected[0, 0] = 1
+    expected[2, 1] = 1
+    expected[3, 5] = 2  # 75 is counted in the last bin
+    expected[6, 3] = 1  # as is 10^9
+    assert np.array_equal(grid.counts, expected)
+
+    other = utils.LengthQualityGrid.from_arrays(grid.to_arrays())
+    grid.merge(other)
+    assert np.array_equal(grid.counts, 2 * expected)
+
+    with pytest.raises(ValueError):
+        grid.merge(utils.LengthQualityGrid())
+
+
+def test_binned_kde():
+    rng = np.random.RandomState(3)
+    edges = [np.linspace(0, 10, 201), np.linspace(-5, 5, 101)]
+    counts = np.histogram2d(rng.normal(5, 1, 10000), rng.normal(0, 1, 10000),
+                            bins=edges)[0]
+    density = utils.binned_kde(counts, edges)
+
+    assert density.shape == counts.shape
+    assert density.sum() * 0.05 * 0.1 == pytest.approx(1, abs=0.01)
+    peak = np.unravel_index(density.argmax(), density.shape)
+    assert abs(edges[0][peak[0]] - 5) < 0.5
+    assert abs(edges[1][peak[1]]) < 0.5
+
+    assert not utils.binned_kde(np.zeros(10), [np.arange(11)]).any()
+
+
+def test_percent_histogram():
+    histogram = utils.PercentHistogram()
+    assert np.isnan(histogram.median())
+
+    values = np.random.RandomState(4).uniform(20, 80, 10001)
+    histogram.add(np.append(values, [np.nan, -1.0, 101.0]))
+    histogram.add_value(50.0)
+    assert histogram.counts.sum() == 10004
+    assert histogram.counts[0] == 1
+    assert histogram.counts[-1] == 1
+    assert histogram.median() == pytest.approx(np.median(values), abs=0.1)
+
+    other = utils.PercentHistogram.from_arrays(histogram.to_arrays())
+    histogram.merge(other)
+    assert histogram.counts.sum() == 2 * 10004
+
+    with pytest.raises(ValueError):
+        histogram.merge(utils.PercentHistogram(bin_width=1))
+
+
+def _alignment(cigar, tags):
+    """An alignment with the given CIGAR string and tags."""
+    header = pysam.AlignmentHeader.from_dict(
+        {'SQ': [{'SN': 'chr1', 'LN': 1000}]})
+    record = pysam.AlignedSegment(header)
+    record.reference_id = 0
+    record.cigarstring = cigar
+    record.query_sequence = 'A' * record.infer_query_length()
+    record.set_tags(tags)
+    return record
+
+
+@pytest.mark.parametrize('cigar,tags', [
+    # 25 aligned bases with 2 mismatches, a 2 base insertion and a 3 base
+    # deletion, described by MD, NM or =/X operations
+    ('3S10M2I5M3D10M', [('MD', '5A9^GCC3T6')]),
+    ('3S10M2I5M3D10M', [('MD', '5A9^GCC3T6'), ('NM', 7)]),
+    ('3S10M2I5M3D10M', [('NM', 7)]),
+    ('3S5=1X4=2I5=3D3=1X6=', [])])
+def test_percent_identities(cigar, tags):
+    record = _alignment(cigar, tags)
+
+    assert utils.alignment_stats(record) == (25, 2, 2, 1, 3, 1)
+    expected = (100 * (1 - 7 / 27), 100 * 23 / 30, 100 * (1 - 4 / 27))
+    assert utils.get_percent_identities(record) == pytest.approx(expected)
+    for definition, identity in zip(utils.IDENTITY_DEFINITIONS, expected):
+        assert (utils.get_percent_identity(record, definition) ==
+                pytest.approx(identity))
+
+
+def test_percent_identity_without_tags():
+    record = _alignment('10M2I5M', [])
+
+    assert utils.alignment_stats(record) is None
+    assert utils.get_percent_identity(record) is None
+    assert utils.get_percent_identity(record, 'blast') is None
+
+
+def test_alignment_summary_identity():
+    blast = utils.AlignmentSummary(identity='blast')
+    blast.add(_alignment('10M2I5M3D10M', [('NM', 7)]))
+    assert blast.identities.items == [pytest.approx(100 * 23 / 30)]
+
+    copy = utils.AlignmentSummary.from_arrays(blast.to_arrays())
+    assert copy.identity == 'blast'
+    with pytest.raises(ValueError):
+        utils.AlignmentSummary().merge(copy)
+    with pytest.raises(ValueError):
+        utils.AlignmentSummary(identity='identical')
@@ -0,0 +1,45 @@
+"""Tests for the watch module."""
+from __future__ import absolute_import
+import os
+import gzip
+from pistis import watch
+
+RECORD = '@read{}\nACGTACGT\n+\nIIIIIIII\n'
+
+
+def test_poll_resumes_growing_files(tmpdir):
+    """Test only new, completely written, reads are added on each poll."""
+    path = str(tmpdir.join('run.fastq'))
+    fastq_watcher = watch.FastqWatcher(str(tmpdir))
+    assert fastq_watcher.poll() == 0
+
+    with open(path, 'w') as fastq:
+        fastq.write(RECORD.format(0) + RECORD.format(1))
+        # a record that is still being written
+        fastq.write(RECORD.format(2)[:20])
+    assert fastq_watcher.poll() == 2
+    assert fastq_watcher.offsets[path] == 2 * len(RECORD.format(0))
+
+    with open(path, 'a') as fastq:
+        fastq.write(RECORD.format(2)[20:] + RECORD.format(3))
+    assert fastq_watcher.poll() == 2
+    assert fastq_watcher.poll() == 0
+    assert fastq_watcher.summary.reads.seen == 4
+    assert fastq_watcher.summary.bins_from_start['1'][40] == 4
+
+
+def test_poll_compressed_files_once_finished(tmpdir):
+    """Test compressed files, including in subdirectories, are read once they
+    stop changing."""
+    os.mkdir(str(tmpdir.join('barcode01')))
+    path = str(tmpdir.join('barcode01', 'chunk_0.fastq.gz'))
+    with gzip.open(path, 'wt') as fastq:
+        fastq.write(''.join(RECORD.format(i) for i in range(3)))
+    tmpdir.join('sequencing_summary.txt').write('not a fastq')
+
+    fastq_watcher = watch.FastqWatcher(str(tmpdir))
+    assert fastq_watcher.fastq_files() == [path]
+    assert fastq_watcher.poll() == 0
+    assert fastq_watcher.poll() == 3
+    assert fastq_watcher.poll() == 0
+    assert path in fastq_watcher.finished